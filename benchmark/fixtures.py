@@ -0,0 +1,143 @@
+"""
+Synthetic model folders in the same layout as test/files (books.csv, the id map pickles, model_properties.p and
+model_weights.pth), at whatever scale the benchmarks need. Weights are random, which is all it takes to time the
+service, but says nothing about the quality of its rankings.
+"""
+import logging
+import pickle
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+
+from src.artifact_bundle import SOURCE_FILES
+from src.ml.ncf_inference import USER_EMBEDDING_DIM, BOOK_EMBEDDING_DIM, FEATURES_DIM
+from src.service.id_map import CompactIdMap, DenseIdMap, MISSING_ID
+
+logger = logging.getLogger(__name__)
+
+# Named (books, users) scales, anything else can be given as BOOKSxUSERS
+SCALES = {
+    "10k": (10_000, 100_000),
+    "100k": (100_000, 1_000_000),
+    "1m": (1_000_000, 10_000_000),
+}
+
+# Same columns, in the same order, as test/files/books.csv, the genre columns end up in the model's input in this order
+GENRE_COLUMNS = [
+    "genre_science", "genre_biography", "genre_young_adult", "genre_chick_lit", "genre_psychology", "genre_ebooks",
+    "genre_religion", "genre_cookbooks", "genre_humor_and_comedy", "genre_self_help", "genre_crime", "genre_mystery",
+    "genre_manga", "genre_paranormal", "genre_romance", "genre_horror", "genre_contemporary", "genre_music",
+    "genre_science_fiction", "genre_graphic_novels", "genre_art", "genre_history", "genre_memoir", "genre_childrens",
+    "genre_gay_and_lesbian", "genre_poetry", "genre_thriller", "genre_historical_fiction", "genre_philosophy",
+    "genre_spirituality", "genre_comics", "genre_suspense", "genre_fantasy", "genre_nonfiction", "genre_travel",
+    "genre_business", "genre_classics", "genre_christian", "genre_fiction", "genre_sports"]
+SCALED_COLUMNS = ["scaled_num_pages", "scaled_avg_rating", "scaled_promoters", "scaled_detractors"]
+# Share of the books tagged with each genre
+GENRE_PROBABILITY = 0.1
+
+
+def parse_scale(scale: str) -> tuple:
+    """
+    Returns the (books, users) of a named scale, or of one given as BOOKSxUSERS
+    """
+    if scale in SCALES:
+        return SCALES[scale]
+    try:
+        num_books, num_users = (int(part) for part in scale.lower().split("x"))
+    except ValueError:
+        raise ValueError(f"Unknown scale {scale}, expected one of {list(SCALES)} or BOOKSxUSERS")
+    return num_books, num_users
+
+
+def generate_model_folder(path: Path, num_books: int, num_users: int, seed: int = 0) -> Path:
+    """
+    Writes a synthetic model folder of num_books books and num_users users to path, unless one is already there
+    """
+    if all((path / name).exists() for name in SOURCE_FILES):
+        return path
+    start_time = time.time()
+    path.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    # Sparse, increasing IDs like Goodreads', factorized in a random order like the training data's
+    book_ids = np.cumsum(rng.integers(1, 8, num_books))
+    user_ids = np.cumsum(rng.integers(1, 8, num_users))
+    f_book_ids = rng.permutation(num_books)
+    f_user_ids = rng.permutation(num_users)
+    _dump(dict(zip(book_ids.tolist(), f_book_ids.tolist())), path / "book_id_to_f_book_id.p")
+    _dump(dict(zip(f_book_ids.tolist(), book_ids.tolist())), path / "f_book_id_to_book_id.p")
+    _dump(dict(zip(user_ids.tolist(), f_user_ids.tolist())), path / "user_id_to_f_user_id.p")
+    _dump(dict(zip(f_user_ids.tolist(), user_ids.tolist())), path / "f_user_id_to_user_id.p")
+
+    _books_dataframe(book_ids, rng).to_csv(path / "books.csv")
+    _dump({"source_folder": "synthetic", "model_top_10_score": 0.0, "model_destination": path.as_posix(),
+           "model_architecture": "NCF", "num_users": num_users, "num_books": num_books, "neptune_run_url": None},
+          path / "model_properties.p")
+    torch.save(_state_dict(num_users, num_books, seed), path / "model_weights.pth")
+
+    logger.info("Generated a synthetic model folder of %d books and %d users at %s in %s seconds", num_books,
+                num_users, path, time.time() - start_time)
+    return path
+
+
+def known_ids(id_map: CompactIdMap) -> np.ndarray:
+    """
+    Every ID the map has a value for
+    """
+    if isinstance(id_map, DenseIdMap):
+        return id_map.offset + np.flatnonzero(np.asarray(id_map.values) != MISSING_ID)
+    return np.asarray(id_map.keys)
+
+
+def _books_dataframe(book_ids: np.ndarray, rng: np.random.Generator) -> pd.DataFrame:
+    num_books = len(book_ids)
+    num_ratings = rng.lognormal(8, 2, num_books).astype(np.int64)
+    promoters = (num_ratings * rng.uniform(0.3, 0.9, num_books)).astype(np.int64)
+    author_ids = rng.integers(1, max(2, num_books // 5), num_books)
+    columns = {
+        "Unnamed: 0": np.arange(num_books),
+        "book_title": [f"Book {book_id}" for book_id in book_ids.tolist()],
+        "avg_rating": rng.uniform(1, 5, num_books).round(2),
+        "num_ratings": num_ratings,
+        "num_pages": rng.integers(50, 1200, num_books).astype(np.float64),
+        "promoters": promoters,
+        "detractors": num_ratings - promoters,
+        "author_url": [f"https://www.goodreads.com/author/show/{author_id}" for author_id in author_ids.tolist()],
+        "book_id": book_ids,
+        "book_url": [f"/book/show/{book_id}" for book_id in book_ids.tolist()],
+        "isbn": rng.integers(10 ** 8, 10 ** 9, num_books).astype(np.float64),
+        "isbn13": rng.integers(978 * 10 ** 10, 979 * 10 ** 10, num_books).astype(np.float64),
+        "asin": None,
+        "language": "English",
+        "author_id": author_ids,
+    }
+    columns["book_url_1"] = columns["book_url"]
+    for genre in GENRE_COLUMNS:
+        columns[genre] = rng.random(num_books) < GENRE_PROBABILITY
+    for scaled in SCALED_COLUMNS:
+        columns[scaled] = rng.normal(size=num_books)
+    return pd.DataFrame(columns)
+
+
+def _state_dict(num_users: int, num_books: int, seed: int) -> dict:
+    # Same names and shapes as a trained NCF's state dict, see src.ml.ncf_inference
+    generator = torch.Generator().manual_seed(seed)
+    shapes = {
+        "user_id_embedding.weight": (num_users, USER_EMBEDDING_DIM),
+        "book_id_embedding.weight": (num_books, BOOK_EMBEDDING_DIM),
+        "fc1.weight": (140, FEATURES_DIM),
+        "fc1.bias": (140,),
+        "fc2.weight": (70, 140),
+        "fc2.bias": (70,),
+        "output.weight": (1, 70),
+        "output.bias": (1,),
+    }
+    return {name: torch.randn(shape, generator=generator) * 0.1 for name, shape in shapes.items()}
+
+
+def _dump(value, path: Path):
+    with open(path, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
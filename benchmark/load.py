@@ -0,0 +1,344 @@
+"""
+End-to-end load tests of /predict/{user_id}, over HTTP and including the books read upstream, entirely locally. The
+service runs as its own uvicorn process, pointed at a fake Book Recommender API running in this one:
+
+    python -m benchmark.load --scale 10k --concurrency 1 8 32 --requests 2000 --upstream-latency-ms 5 50
+
+Requests are replayed from --requests-file, in the same newline delimited JSON as bulk predictions
+({"user_id": 1, "genres": ["fantasy"], "count": 20} per line), or synthesized from the model's users. Every
+combination of concurrency, upstream latency and upstream error rate is run in turn against the same service, and
+gets its throughput, latency percentiles and latency histogram reported as JSON.
+
+The service reads its configuration from the environment as usual, e.g. BOOKS_READ_CACHE_MAX_SIZE=0 and
+RESULT_CACHE_MAX_SIZE=0 to measure every request without the caches.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import pickle
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import httpx
+import numpy as np
+import pandas as pd
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from benchmark.fixtures import parse_scale, generate_model_folder, known_ids
+from benchmark.run import DEFAULT_FIXTURES_FOLDER
+from src.artifact_bundle import is_bundle
+from src.models.genre_list import GenreList
+from src.service.id_map import compact_id_map, load_id_map
+
+logger = logging.getLogger(__name__)
+
+REPORT_FORMAT_VERSION = 1
+# Upper bounds of the latency histogram's buckets, anything slower lands in a last, unbounded one
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+DEFAULT_BOOKS_READ_PER_USER = 50
+DEFAULT_REQUESTS = 1000
+DEFAULT_SYNTHESIZED_REQUESTS = 10_000
+MAX_GENRES_PER_REQUEST = 2
+# How long the service may take to load its model and start answering
+DEFAULT_STARTUP_TIMEOUT_SECONDS = 300
+
+
+class FakeUpstream:
+    """
+    In-process stand-in for the Book Recommender API's GET /users/{user_id}/book-ids. Every user has read the same
+    books_read_per_user random books of the catalogue on every call. Latency (with up to jitter_ms more, uniformly)
+    and the share of calls failing with a 500 can be changed while it runs.
+    """
+
+    def __init__(self, book_ids: np.ndarray, books_read_per_user: int = DEFAULT_BOOKS_READ_PER_USER,
+                 latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0, seed: int = 0):
+        self.book_ids = np.asarray(book_ids)
+        self.books_read_per_user = min(books_read_per_user, len(self.book_ids))
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.seed = seed
+        self.calls = 0
+        self.errors = 0
+        self._rng = np.random.default_rng(seed)
+        self.app = Starlette(routes=[Route("/users/{user_id:int}/book-ids", self.get_book_ids)])
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+
+    async def get_book_ids(self, request):
+        self.calls += 1
+        delay_ms = self.latency_ms + self.jitter_ms * self._rng.random()
+        if delay_ms > 0:
+            await asyncio.sleep(delay_ms / 1000)
+        if self._rng.random() < self.error_rate:
+            self.errors += 1
+            return JSONResponse({"detail": "Injected failure"}, status_code=500)
+        user_rng = np.random.default_rng([self.seed, request.path_params["user_id"]])
+        book_ids = user_rng.choice(self.book_ids, self.books_read_per_user, replace=False)
+        return JSONResponse({"user_id": request.path_params["user_id"], "book_ids": book_ids.tolist()})
+
+    def start(self) -> str:
+        """
+        Starts serving on a free local port in a background thread, and returns the base URL to call it on
+        """
+        sock = socket.socket()
+        # Accepted connections inherit it, without it every keep-alive call waits ~40ms on Nagle and delayed ACKs
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.bind(("127.0.0.1", 0))
+        self._server = uvicorn.Server(uvicorn.Config(self.app, log_level="warning", lifespan="off"))
+        self._thread = threading.Thread(target=self._server.run, kwargs={"sockets": [sock]}, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join()
+
+
+class ServiceProcess:
+    """
+    The service, started with uvicorn in a process of its own so the load generator doesn't compete with it for the
+    GIL, and stopped on exit
+    """
+
+    def __init__(self, model_folder: Path, upstream_url: str, workers: int = 1,
+                 startup_timeout: float = DEFAULT_STARTUP_TIMEOUT_SECONDS, log_file: Optional[Path] = None):
+        self.model_folder = model_folder
+        self.upstream_url = upstream_url
+        self.workers = workers
+        self.startup_timeout = startup_timeout
+        self.log_file = log_file
+        self.url = None
+        self._process = None
+
+    def __enter__(self) -> "ServiceProcess":
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        env = {**os.environ, "MODEL_FOLDER": self.model_folder.as_posix(),
+               "BOOK_RECOMMENDER_API_BASE_URL": self.upstream_url, "WEB_CONCURRENCY": str(self.workers)}
+        log = open(self.log_file, "w") if self.log_file is not None else subprocess.DEVNULL
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "src.main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(self.workers), "--log-level", "warning", "--no-access-log"],
+            cwd=Path(__file__).parent.parent, env=env, stdout=log, stderr=subprocess.STDOUT)
+        self.url = f"http://127.0.0.1:{port}"
+        self._wait_until_ready()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._process.terminate()
+        try:
+            self._process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+
+    def _wait_until_ready(self):
+        deadline = time.time() + self.startup_timeout
+        while time.time() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"The service exited with {self._process.returncode} while starting")
+            try:
+                if httpx.get(self.url + "/").status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            time.sleep(0.2)
+        self.__exit__(None, None, None)
+        raise RuntimeError(f"The service didn't start within {self.startup_timeout} seconds")
+
+
+def read_requests(lines) -> List[dict]:
+    """
+    Parses newline delimited {"user_id": ..., "genres": [...], "count": ...} requests, genres and count are optional
+    """
+    requests = []
+    for line in lines:
+        if line.strip():
+            request = json.loads(line)
+            requests.append({"user_id": int(request["user_id"]), "genres": list(request.get("genres", [])),
+                             "count": int(request.get("count", 20))})
+    return requests
+
+
+def synthesize_requests(user_ids: np.ndarray, num_requests: int, seed: int = 0) -> List[dict]:
+    """
+    Random users, each asking for 0 to MAX_GENRES_PER_REQUEST random genres and 20 recommendations most of the time
+    """
+    rng = np.random.default_rng(seed)
+    genres = [genre.value for genre in GenreList]
+    return [{"user_id": int(user_id),
+             "genres": [genres[position] for position in
+                        rng.choice(len(genres), rng.integers(0, MAX_GENRES_PER_REQUEST + 1), replace=False)],
+             "count": int(rng.choice([10, 20, 20, 20, 50, 100]))}
+            for user_id in rng.choice(user_ids, num_requests)]
+
+
+async def generate_load(url: str, pending: Iterator[dict], concurrency: int, num_requests: int,
+                        warm_up: int = 0) -> dict:
+    """
+    Sends the next num_requests pending requests from concurrency clients, each one sending its next request as soon
+    as its previous one is answered. warm_up more requests are sent first, unmeasured.
+    """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as http_client:
+        await _send(http_client, url, pending, concurrency, warm_up)
+        start_time = time.perf_counter()
+        latencies_ms, statuses = await _send(http_client, url, pending, concurrency, num_requests)
+        duration = time.perf_counter() - start_time
+    return summarize(latencies_ms, statuses, duration)
+
+
+def summarize(latencies_ms: List[float], statuses: dict, duration: float) -> dict:
+    """
+    Throughput, latency percentiles and a latency histogram (how many requests took at most le_ms, without the
+    faster buckets, None being the unbounded one) of a run
+    """
+    latencies_ms = np.array(latencies_ms)
+    bucket_counts = np.bincount(np.searchsorted(HISTOGRAM_BUCKETS_MS, latencies_ms),
+                                minlength=len(HISTOGRAM_BUCKETS_MS) + 1)
+    return {
+        "requests": len(latencies_ms),
+        "statuses": statuses,
+        "errors": sum(count for status, count in statuses.items() if status != "200"),
+        "duration_seconds": duration,
+        "throughput_rps": len(latencies_ms) / duration if duration > 0 else 0.0,
+        "latency_ms": {
+            "mean": float(latencies_ms.mean()) if len(latencies_ms) else None,
+            **{name: float(np.percentile(latencies_ms, percentile)) if len(latencies_ms) else None
+               for name, percentile in [("p50", 50), ("p95", 95), ("p99", 99), ("max", 100)]},
+        },
+        "histogram": [{"le_ms": le_ms, "count": int(count)}
+                      for le_ms, count in zip(list(HISTOGRAM_BUCKETS_MS) + [None], bucket_counts)],
+    }
+
+
+async def _send(http_client: httpx.AsyncClient, url: str, pending, concurrency: int, num_requests: int):
+    latencies_ms = []
+    statuses = {}
+    remaining = num_requests
+
+    async def client():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            request = next(pending)
+            start_time = time.perf_counter()
+            try:
+                response = await http_client.get(f"{url}/predict/{request['user_id']}",
+                                                 params={"genres": request["genres"], "count": request["count"]})
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies_ms.append((time.perf_counter() - start_time) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return latencies_ms, statuses
+
+
+def _model_ids(model_folder: Path):
+    """
+    The users and books of the model folder (or bundle) at model_folder
+    """
+    if is_bundle(model_folder):
+        user_id_to_f_user_id = load_id_map(model_folder, "user_id_to_f_user_id")
+        book_ids = np.load(model_folder / "candidates" / "book_ids.npy")
+    else:
+        with open(model_folder / "user_id_to_f_user_id.p", "rb") as f:
+            user_id_to_f_user_id = compact_id_map(pickle.load(f))
+        book_ids = pd.read_csv(model_folder / "books.csv", usecols=["book_id"])["book_id"].values
+    return known_ids(user_id_to_f_user_id), book_ids
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Load test /predict/{user_id} against a fake books read upstream")
+    model = parser.add_mutually_exclusive_group()
+    model.add_argument("--model-folder", type=Path, help="Model folder or bundle to serve")
+    model.add_argument("--scale", default="10k",
+                       help="Otherwise, scale of a synthetic model folder to serve (see benchmark.run)")
+    parser.add_argument("--fixtures", type=Path, default=DEFAULT_FIXTURES_FOLDER,
+                        help="Where synthetic model folders are generated, and reused from on later runs")
+    parser.add_argument("--requests-file", type=argparse.FileType("r"),
+                        help="Newline delimited JSON requests to replay, synthesized from the model's users if unset")
+    parser.add_argument("--synthesize", type=int, default=DEFAULT_SYNTHESIZED_REQUESTS,
+                        help="How many distinct requests to synthesize")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="Requests measured per configuration")
+    parser.add_argument("--warm-up", type=int, default=50, help="Requests sent unmeasured before each configuration")
+    parser.add_argument("--upstream-latency-ms", type=float, nargs="+", default=[10.0],
+                        help="How long the fake books read API takes to answer")
+    parser.add_argument("--upstream-jitter-ms", type=float, default=0.0,
+                        help="Up to how much longer, uniformly, it randomly takes")
+    parser.add_argument("--upstream-error-rate", type=float, nargs="+", default=[0.0],
+                        help="Share of its answers that are 500s")
+    parser.add_argument("--books-read", type=int, default=DEFAULT_BOOKS_READ_PER_USER,
+                        help="Books read by every user according to the fake API")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the service")
+    parser.add_argument("--service-log", type=Path, help="Where to write the service's output, discarded if unset")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout,
+                        help="Where to write the JSON report, defaults to stdout")
+    parsed = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    model_folder = parsed.model_folder
+    if model_folder is None:
+        num_books, num_users = parse_scale(parsed.scale)
+        model_folder = generate_model_folder(parsed.fixtures / f"{num_books}x{num_users}-{parsed.seed}", num_books,
+                                             num_users, parsed.seed)
+    user_ids, book_ids = _model_ids(model_folder)
+    if parsed.requests_file is not None:
+        with parsed.requests_file:
+            requests = read_requests(parsed.requests_file)
+    else:
+        requests = synthesize_requests(user_ids, parsed.synthesize, parsed.seed)
+
+    # Every configuration carries on through the requests where the previous one stopped, rather than replaying the
+    # same ones and finding their rankings already cached
+    pending = itertools.cycle(requests)
+    upstream = FakeUpstream(book_ids, parsed.books_read, jitter_ms=parsed.upstream_jitter_ms, seed=parsed.seed)
+    upstream_url = upstream.start()
+    report = {"format_version": REPORT_FORMAT_VERSION, "created_at": int(time.time()),
+              "model_folder": model_folder.as_posix(), "workers": parsed.workers, "distinct_requests": len(requests),
+              "configurations": []}
+    try:
+        logger.info("Starting the service on %s, calling the fake books read API on %s", model_folder, upstream_url)
+        with ServiceProcess(model_folder, upstream_url, parsed.workers, log_file=parsed.service_log) as service:
+            for latency_ms, error_rate, concurrency in itertools.product(
+                    parsed.upstream_latency_ms, parsed.upstream_error_rate, parsed.concurrency):
+                upstream.latency_ms = latency_ms
+                upstream.error_rate = error_rate
+                result = asyncio.run(generate_load(service.url, pending, concurrency, parsed.requests,
+                                                   parsed.warm_up))
+                logger.info("concurrency %d, upstream %.0f ms with %.0f%% errors: %.1f requests/s, p50 %.1f ms, "
+                            "p95 %.1f ms, p99 %.1f ms, %d errors", concurrency, latency_ms, error_rate * 100,
+                            result["throughput_rps"], result["latency_ms"]["p50"], result["latency_ms"]["p95"],
+                            result["latency_ms"]["p99"], result["errors"])
+                report["configurations"].append({"concurrency": concurrency, "upstream_latency_ms": latency_ms,
+                                                 "upstream_jitter_ms": parsed.upstream_jitter_ms,
+                                                 "upstream_error_rate": error_rate, **result})
+    finally:
+        upstream.stop()
+
+    with parsed.output:
+        json.dump(report, parsed.output, indent=2)
+        parsed.output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+In-process benchmarks of startup and of every stage of a prediction, on synthetic catalogues (see
+benchmark.fixtures) of one or more scales:
+
+    python -m benchmark.run --scales 10k 100k --output results.json
+
+Writes a JSON report with the median, 95th percentile and mean of every stage (to stdout without --output). Pass a
+previous report as --baseline to compare against it, the run fails if any stage got more than --tolerance slower:
+
+    python -m benchmark.run --scales 10k --baseline baseline.json
+
+The service is configured (precision, TorchScript, retrieval...) from the same environment variables as when it
+serves, so a change of configuration can be benchmarked like a change of code.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+import torch
+from fastapi.responses import ORJSONResponse
+
+from benchmark.fixtures import parse_scale, generate_model_folder, known_ids
+from src.artifact_bundle import load_source_folder, build_bundle, load_bundle
+from src.dependencies import get_properties
+from src.ml.ncf_inference import export_inference_model
+from src.ml.quantization import quantize_model
+from src.models.genre_list import GenreList
+from src.service.factorization_service import FactorizationService
+from src.service.prediction_service import PredictionService, PredictionServiceResponse
+from src.service.retrieval_index import RetrievalIndex
+from src.service.scoring import score_candidates
+from src.service.user_info_client import BooksReadResponse
+
+logger = logging.getLogger(__name__)
+
+REPORT_FORMAT_VERSION = 1
+# A stage has to be this much slower relatively, and at least MIN_REGRESSION_MS slower, than its baseline to count as
+# a regression, so sub-millisecond stages don't fail runs on noise
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_MS = 0.1
+DEFAULT_REQUESTS = 200
+# Untimed requests run first, so TorchScript's profiling runs and cold caches don't skew the numbers
+WARM_UP_REQUESTS = 5
+BOOKS_READ_PER_USER = 50
+MAX_GENRES_PER_REQUEST = 2
+DEFAULT_FIXTURES_FOLDER = Path(tempfile.gettempdir()) / "book-recommender-benchmark"
+
+
+class FixedBooksReadClient:
+    """
+    Stands in for UserInfoClient with every user's books read known up front, so the benchmarks measure the service
+    rather than the Book Recommender API
+    """
+
+    def __init__(self, books_read: Dict[int, np.ndarray]):
+        self.books_read = books_read
+
+    async def get_books_read(self, user_id) -> BooksReadResponse:
+        return BooksReadResponse(book_ids=self.books_read.get(user_id, np.array([], dtype=np.int64)))
+
+
+def benchmark_model_folder(path: Path, requests: int = DEFAULT_REQUESTS, count: int = 20, seed: int = 0) -> dict:
+    """
+    Times startup from the model folder at path, then every stage of requests predictions made one after the other
+    """
+    startup = {}
+    _timed(startup, "load_source_folder", load_source_folder, path)
+    _timed(startup, "build_bundle", build_bundle, path, path / "bundle")
+    artifacts = _timed(startup, "load_bundle", load_bundle, path / "bundle")
+
+    # Same steps, with the same configuration, as when the service loads a model
+    properties = get_properties()
+    model = _timed(startup, "quantize", quantize_model, artifacts.model, properties.inference_linear_precision,
+                   properties.inference_embedding_precision)
+    if properties.inference_torchscript:
+        model = _timed(startup, "export", export_inference_model, model)
+    retrieval_index = None
+    if properties.retrieval_depth > 0:
+        retrieval_index = _timed(startup, "retrieval_index", RetrievalIndex.build, artifacts.candidate_store,
+                                 properties.retrieval_depth, properties.retrieval_clusters or None)
+
+    rng = np.random.default_rng(seed)
+    candidate_store = artifacts.candidate_store
+    user_ids = rng.choice(known_ids(artifacts.user_id_to_f_user_id), WARM_UP_REQUESTS + requests).tolist()
+    books_read = {user_id: rng.choice(candidate_store.book_ids, BOOKS_READ_PER_USER) for user_id in user_ids}
+    all_genres = list(GenreList)
+    genres = [[all_genres[position] for position in
+               rng.choice(len(all_genres), rng.integers(0, MAX_GENRES_PER_REQUEST + 1), replace=False)]
+              for _ in user_ids]
+    factorization_service = FactorizationService(artifacts.user_id_to_f_user_id, artifacts.book_id_to_f_book_id)
+    prediction_service = PredictionService(model, candidate_store, FixedBooksReadClient(books_read),
+                                           factorization_service, retrieval_index=retrieval_index)
+
+    timings = {stage: [] for stage in ["factorize", "filter", "forward", "top_k", "serialize", "predict"]}
+    for position, (user_id, user_genres) in enumerate(zip(user_ids, genres)):
+        stages = {}
+        f_user_id = _timed(stages, "factorize", factorization_service.factorize_user_id, user_id)
+        rows = _timed(stages, "filter", prediction_service._filter_candidates, user_genres, books_read[user_id],
+                      f_user_id)
+        scores = _timed(stages, "forward", score_candidates, model, candidate_store, [f_user_id], rows)
+        items = _timed(stages, "top_k", prediction_service._top_candidates, rows, scores, count)
+        _timed(stages, "serialize", _serialize,
+               PredictionServiceResponse(items=items, count=len(items), took_ms=0))
+        # Everything above plus fetching the books read, as the route runs it, short of HTTP
+        _timed(stages, "predict", asyncio.run, prediction_service.predict(user_id, user_genres, count))
+        if position >= WARM_UP_REQUESTS:
+            for stage, seconds in stages.items():
+                timings[stage].append(seconds)
+
+    return {
+        "num_books": len(candidate_store),
+        "num_users": len(artifacts.user_id_to_f_user_id),
+        "requests": requests,
+        "startup_ms": {stage: seconds * 1000 for stage, seconds in startup.items()},
+        "stages": {stage: _summary(seconds) for stage, seconds in timings.items()},
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> List[dict]:
+    """
+    Compares the median of every stage (and every startup step) of the report against the baseline, for the scales
+    and stages both have in common. Returns one row per comparison, flagged when it regressed.
+    """
+    comparisons = []
+    for scale, results in report["scales"].items():
+        baseline_results = baseline.get("scales", {}).get(scale)
+        if baseline_results is None:
+            continue
+        timings = {f"startup.{step}": ms for step, ms in results["startup_ms"].items()}
+        timings.update({stage: summary["p50_ms"] for stage, summary in results["stages"].items()})
+        baseline_timings = {f"startup.{step}": ms for step, ms in baseline_results["startup_ms"].items()}
+        baseline_timings.update({stage: summary["p50_ms"] for stage, summary in baseline_results["stages"].items()})
+        for stage, ms in timings.items():
+            if stage not in baseline_timings:
+                continue
+            baseline_ms = baseline_timings[stage]
+            comparisons.append({
+                "scale": scale,
+                "stage": stage,
+                "baseline_ms": baseline_ms,
+                "ms": ms,
+                "ratio": ms / baseline_ms if baseline_ms > 0 else float("inf"),
+                "regressed": ms > baseline_ms * (1 + tolerance) and ms - baseline_ms > MIN_REGRESSION_MS,
+            })
+    return comparisons
+
+
+def _serialize(response: PredictionServiceResponse) -> bytes:
+    # What the predict route does with its response
+    return ORJSONResponse(response).body
+
+
+def _timed(timings: dict, stage: str, fn: Callable, *args):
+    start_time = time.perf_counter()
+    result = fn(*args)
+    timings[stage] = time.perf_counter() - start_time
+    return result
+
+
+def _summary(seconds: List[float]) -> dict:
+    ms = np.array(seconds) * 1000
+    return {
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "mean_ms": float(ms.mean()),
+    }
+
+
+def _environment() -> dict:
+    properties = get_properties()
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch_num_threads": torch.get_num_threads(),
+        "inference_linear_precision": properties.inference_linear_precision,
+        "inference_embedding_precision": properties.inference_embedding_precision,
+        "inference_torchscript": properties.inference_torchscript,
+        "retrieval_depth": properties.retrieval_depth,
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark startup and every stage of a prediction")
+    parser.add_argument("--scales", nargs="+", default=["10k"],
+                        help="Named scales (10k, 100k, 1m books) or BOOKSxUSERS, e.g. 50000x200000")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="Predictions timed per scale")
+    parser.add_argument("--count", type=int, default=20, help="Recommendations per prediction")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fixtures", type=Path, default=DEFAULT_FIXTURES_FOLDER,
+                        help="Where synthetic model folders are generated, and reused from on later runs")
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout,
+                        help="Where to write the JSON report, defaults to stdout")
+    parser.add_argument("--baseline", type=argparse.FileType("r"), help="A previous report to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="How much slower than the baseline a stage may get, relatively, before failing the run")
+    parsed = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    # A few lines logged per prediction would drown out the report
+    logging.getLogger("src.service").setLevel(logging.WARNING)
+    report = {"format_version": REPORT_FORMAT_VERSION, "created_at": int(time.time()), "environment": _environment(),
+              "scales": {}}
+    for scale in parsed.scales:
+        num_books, num_users = parse_scale(scale)
+        path = generate_model_folder(parsed.fixtures / f"{num_books}x{num_users}-{parsed.seed}", num_books,
+                                     num_users, parsed.seed)
+        logger.info("Benchmarking %d books and %d users", num_books, num_users)
+        report["scales"][scale] = benchmark_model_folder(path, parsed.requests, parsed.count, parsed.seed)
+
+    with parsed.output:
+        json.dump(report, parsed.output, indent=2)
+        parsed.output.write("\n")
+
+    if parsed.baseline is not None:
+        with parsed.baseline:
+            comparisons = compare(report, json.load(parsed.baseline), parsed.tolerance)
+        for comparison in comparisons:
+            print("{scale:>8} {stage:<30} {baseline_ms:>12.3f} ms -> {ms:>12.3f} ms ({ratio:.2f}x){flag}".format(
+                **comparison, flag="  REGRESSED" if comparison["regressed"] else ""), file=sys.stderr)
+        if any(comparison["regressed"] for comparison in comparisons):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Fast-start model artifacts. Compiles the pickles, books.csv and weights the model is trained into, into a bundle of
+pre-filtered .npy arrays which can be memory-mapped at startup instead of being parsed and filtered on every boot:
+
+    python -m src.artifact_bundle --source /path/to/model --output /path/to/bundle
+
+Serve a bundle by pointing MODEL_FOLDER at it.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import pickle
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+
+from src.ml.ncf_inference import NCFInference
+from src.service.candidate_store import CandidateStore
+from src.service.id_map import compact_id_map, load_id_map
+
+# We cut off the top N of the books by popularity because everyone has read Harry Potter. Currently set to .5%
+QUANTILE_CUTOFF = 0.995
+
+MANIFEST_FILE = "manifest.json"
+# Bumped whenever the layout of a bundle changes, so old bundles are rejected rather than misread
+BUNDLE_FORMAT_VERSION = 2
+
+SOURCE_FILES = ["book_id_to_f_book_id.p", "user_id_to_f_user_id.p", "model_properties.p", "books.csv",
+                "model_weights.pth"]
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactBundle:
+    """
+    Everything the service needs to make predictions, loaded either from a bundle or the original model folder
+    """
+
+    def __init__(self, version: str, model_properties: dict, book_id_to_f_book_id, user_id_to_f_user_id,
+                 model: NCFInference, candidate_store: CandidateStore, books_df: pd.DataFrame = None):
+        self.version = version
+        self.model_properties = model_properties
+        self.book_id_to_f_book_id = book_id_to_f_book_id
+        self.user_id_to_f_user_id = user_id_to_f_user_id
+        self.model = model
+        # What requests are scored with, the model itself unless a compiled copy of it is swapped in
+        self.inference_model = model
+        # Built at load time when candidates are retrieved before being ranked, see RetrievalIndex
+        self.retrieval_index = None
+        # Loaded alongside the model when its rankings were precomputed offline, see ScoreStore
+        self.score_store = None
+        self.candidate_store = candidate_store
+        # Only available when loaded from the original model folder
+        self.books_df = books_df
+        self.loaded_at = time.time()
+
+    def info(self) -> dict:
+        return {**self.model_properties, "model_version": self.version,
+                "model_loaded_at": datetime.fromtimestamp(self.loaded_at, timezone.utc).isoformat()}
+
+
+def is_bundle(path: Path) -> bool:
+    return (path / MANIFEST_FILE).exists()
+
+
+def load_artifacts(path: Path) -> ArtifactBundle:
+    return load_bundle(path) if is_bundle(path) else load_source_folder(path)
+
+
+def load_source_folder(path: Path) -> ArtifactBundle:
+    """
+    Loads the original pickles, books.csv and weights, like the model was shipped before bundles existed
+    """
+    # The pickled dicts are only kept around until they are converted to compact maps
+    book_id_to_f_book_id = compact_id_map(pickle.load(open(path / "book_id_to_f_book_id.p", "rb")))
+    user_id_to_f_user_id = compact_id_map(pickle.load(open(path / "user_id_to_f_user_id.p", "rb")))
+    model_properties = pickle.load(open(path / "model_properties.p", "rb"))
+
+    books_df = pd.read_csv(path / "books.csv")
+    books_df = books_df[books_df['num_ratings'] < books_df['num_ratings'].quantile(QUANTILE_CUTOFF)]
+
+    # Stand up model and load weights
+    model = NCFInference.from_state_dict(torch.load(path / "model_weights.pth"))
+
+    # The model's item tower is cached alongside the catalogue, so it has to be built after the weights are loaded
+    candidate_store = CandidateStore.from_dataframe(books_df, book_id_to_f_book_id.get_many, model)
+
+    return ArtifactBundle(_source_version(path), model_properties, book_id_to_f_book_id,
+                          user_id_to_f_user_id, model, candidate_store, books_df)
+
+
+def build_bundle(source: Path, output: Path) -> dict:
+    """
+    Compiles the model folder at source into a bundle at output, returning the bundle's manifest
+    """
+    artifacts = load_source_folder(source)
+    output.mkdir(parents=True, exist_ok=True)
+
+    artifacts.book_id_to_f_book_id.save(output, "book_id_to_f_book_id")
+    artifacts.user_id_to_f_user_id.save(output, "user_id_to_f_user_id")
+
+    artifacts.candidate_store.save(output / "candidates")
+
+    (output / "weights").mkdir(exist_ok=True)
+    for name, tensor in artifacts.model.state_dict().items():
+        np.save(output / "weights" / f"{name}.npy", tensor.numpy())
+
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "version": artifacts.version,
+        "created_at": int(time.time()),
+        "model_properties": artifacts.model_properties,
+        "num_candidates": len(artifacts.candidate_store),
+    }
+    # Written last, so a half written bundle is never mistaken for a complete one
+    with open(output / MANIFEST_FILE, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_bundle(path: Path) -> ArtifactBundle:
+    with open(path / MANIFEST_FILE) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported bundle format {manifest.get('format_version')} at {path}, "
+                         f"expected {BUNDLE_FORMAT_VERSION}")
+
+    model_properties = manifest["model_properties"]
+    model = NCFInference(model_properties.get("num_users"), model_properties.get("num_books"))
+    _map_weights(model, path / "weights")
+    model.eval()
+
+    return ArtifactBundle(manifest["version"], model_properties, load_id_map(path, "book_id_to_f_book_id"),
+                          load_id_map(path, "user_id_to_f_user_id"), model, CandidateStore.load(path / "candidates"))
+
+
+def _map_weights(model: NCFInference, weights_path: Path):
+    """
+    Points the model's parameters straight at the memory-mapped weights, rather than copying them in like
+    load_state_dict() would. Every process serving the same bundle then shares one copy of the embedding tables through
+    the page cache. The mapping is copy-on-write, so nothing ever writes back to the bundle.
+    """
+    state_dict = model.state_dict()
+    for name, current in state_dict.items():
+        weights = torch.from_numpy(np.load(weights_path / f"{name}.npy", mmap_mode="c"))
+        if weights.shape != current.shape:
+            raise ValueError(f"Weights {name} in {weights_path} have shape {tuple(weights.shape)}, "
+                             f"expected {tuple(current.shape)}")
+        module_name, _, attribute = name.rpartition(".")
+        setattr(model.get_submodule(module_name), attribute, torch.nn.Parameter(weights, requires_grad=False))
+
+
+def _source_version(path: Path) -> str:
+    """
+    Hashes the contents of the source files into a short version. A model gets the same version whether it's served
+    from its source folder, a copy of it or the bundle built from it, which is what score stores are matched against.
+    """
+    digest = hashlib.sha256()
+    for name in SOURCE_FILES:
+        with open(path / name, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Compile a model folder into a fast-start artifact bundle")
+    parser.add_argument("--source", type=Path, required=True,
+                        help="Folder with the pickles, books.csv and model_weights.pth")
+    parser.add_argument("--output", type=Path, required=True, help="Folder to write the bundle to")
+    parsed = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO)
+    manifest = build_bundle(parsed.source, parsed.output)
+    logger.info("Built bundle %s with %d candidates at %s", manifest["version"], manifest["num_candidates"],
+                parsed.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Bulk recommendations from the command line, for backfills that shouldn't go through HTTP one user at a time.
+
+Reads newline delimited JSON requests, one {"user_id": 1, "genres": ["fantasy"], "count": 20} per line, and writes
+one result per line in the same order:
+
+    MODEL_FOLDER=/path/to/model python -m src.bulk_predict --input requests.jsonl --output results.jsonl
+"""
+import argparse
+import asyncio
+import logging
+import sys
+
+from src.dependencies import initialize_dependencies, validate_dependencies, shutdown_dependencies, get_artifacts, \
+    get_inference_executor, get_inference_batcher, get_result_cache, get_model
+from src.service.bulk_prediction import stream_predictions, aiter_sync, BULK_PREDICTION_BATCH_SIZE
+from src.service.factorization_service import get_factorization_service
+from src.service.prediction_service import get_prediction_service
+from src.service.user_info_client import initialize_user_info_client, shutdown_user_info_client, \
+    get_user_info_client
+
+
+async def bulk_predict(input_file, output_file, batch_size: int):
+    initialize_dependencies()
+    validate_dependencies()
+    initialize_user_info_client()
+    try:
+        artifacts = get_artifacts()
+        prediction_service = get_prediction_service(
+            # The same compiled model the API scores with, rather than the eager one it was compiled from
+            model=get_model(artifacts),
+            candidate_store=artifacts.candidate_store,
+            user_info_client=get_user_info_client(),
+            factorization_service=get_factorization_service(artifacts.user_id_to_f_user_id,
+                                                            artifacts.book_id_to_f_book_id),
+            inference_executor=get_inference_executor(),
+            inference_batcher=get_inference_batcher(),
+            result_cache=get_result_cache(),
+            retrieval_index=artifacts.retrieval_index,
+            score_store=artifacts.score_store)
+        async for result in stream_predictions(prediction_service, aiter_sync(input_file), batch_size):
+            output_file.write(result)
+    finally:
+        await shutdown_user_info_client()
+        shutdown_dependencies()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Bulk book recommendations from newline delimited JSON requests")
+    parser.add_argument("--input", type=argparse.FileType("r"), default=sys.stdin,
+                        help="Newline delimited JSON requests, defaults to stdin")
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout,
+                        help="Where to write newline delimited JSON results, defaults to stdout")
+    parser.add_argument("--batch-size", type=int, default=BULK_PREDICTION_BATCH_SIZE,
+                        help="Requests scored at a time")
+    parsed = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    with parsed.input, parsed.output:
+        asyncio.run(bulk_predict(parsed.input, parsed.output, parsed.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,84 +1,275 @@
+import asyncio
 import logging
 import os
-import pickle
 import time
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
 
-import pandas
+import numpy as np
 import pandas as pd
 import torch
+from fastapi import Depends
 from pydantic import BaseSettings
 
-from src.ml.ncf import NCF
-
-# We cut off the top N of the books by popularity because everyone has read Harry Potter. Currently set to .5%
-QUANTILE_CUTOFF = 0.995
+from src.artifact_bundle import ArtifactBundle, load_artifacts, is_bundle
+from src.ml.ncf_inference import NCFInference, InferenceModel, export_inference_model
+from src.ml.quantization import quantize_model
+from src.service.candidate_store import CandidateStore
+from src.service.id_map import CompactIdMap
+from src.service.inference_batcher import InferenceBatcher
+from src.service.inference_executor import InferenceExecutor
+from src.service.result_cache import ResultCache
+from src.service.retrieval_index import RetrievalIndex
+from src.service.score_store import ScoreStore
+from src.service.scoring import score_candidates
 
 
 class Properties(BaseSettings):
     env_name: str = "local"
     book_recommender_api_base_url: str = "http://localhost:8999"
+    # Timeouts (seconds) and connection pool limits for the Book Recommender API
+    user_info_connect_timeout: float = 0.5
+    user_info_read_timeout: float = 2.0
+    user_info_max_connections: int = 100
+    user_info_max_keepalive_connections: int = 20
+    # Books read are cached per user for a while, 0 disables the cache
+    books_read_cache_max_size: int = 10000
+    books_read_cache_ttl_seconds: float = 300
+    # Threads running predictions off the event loop, and how many more calls may wait before we start returning 503s
+    inference_workers: int = 2
+    inference_max_queue_size: int = 16
+    # Intra-op threads torch may use, 0 splits the available cores evenly between the inference workers
+    torch_num_threads: int = 0
+    # uvicorn worker processes on this node (uvicorn reads the same variable), only used to split the cores between them
+    web_concurrency: int = 1
+    # Concurrent predictions are scored together, in batches of up to this many, 1 disables batching
+    inference_batch_max_size: int = 16
+    # How long the first prediction in a batch may wait for others to join it
+    inference_batch_max_wait_ms: float = 2.0
+    # Rankings are cached per (user, genres, books read) until the model or catalogue changes, 0 disables the cache
+    result_cache_max_size: int = 50000
+    result_cache_ttl_seconds: float = 3600
+    # Precision of the model being served, see src.ml.quantization. Linear layers may be fp32 or int8, embedding tables
+    # fp32, fp16 or int8. Check what it costs in ranking quality with python -m src.quantization_report first.
+    inference_linear_precision: str = "fp32"
+    inference_embedding_precision: str = "fp32"
+    # Requests are scored with a TorchScript compiled copy of the model, disable to debug in eager mode
+    inference_torchscript: bool = True
+    # Only score the candidates in the best clusters of the catalogue (at least this many) instead of every one of
+    # them, 0 scores every candidate. Check the recall it costs with python -m src.retrieval_report first.
+    retrieval_depth: int = 0
+    # Clusters the catalogue is split into for retrieval, 0 picks the square root of the size of the catalogue
+    retrieval_clusters: int = 0
+    # Rankings precomputed by python -m src.precompute_scores, served for the users they cover when they were
+    # precomputed for the model being served. Empty scores every request live.
+    score_store_folder: str = ""
+    # Sent as X-Admin-Token to use the /admin endpoints, which are disabled while it's empty
+    admin_token: str = ""
 
 
 root_path = Path(os.getenv("MODEL_FOLDER", "."))
 
-book_id_to_f_book_id = {}
-user_to_books_read = {}
-model_properties = {}
-model = None
-books_df = None
+# The model, id maps and catalogue are swapped together by reload_dependencies(), so they're only ever read through a
+# single snapshot and a request never mixes one version's model with another's catalogue
+artifacts: Optional[ArtifactBundle] = None
+inference_executor = None
+inference_batcher = None
+result_cache = None
+reload_in_progress = False
+
+
+class ModelReloadInProgressException(Exception):
+    pass
+
+
+class ModelReloadFailedException(Exception):
+    pass
+
+
+@lru_cache()
+def get_properties():
+    return Properties()
 
 
 def initialize_dependencies():
     logging.info("Initializing dependencies")
     start_time = time.time()
-    global book_id_to_f_book_id
-    global user_id_to_f_user_id
-    global user_to_books_read
-    global model
-    global model_properties
-    global books_df
-
-    book_id_to_f_book_id = pickle.load(open(root_path / "book_id_to_f_book_id.p", "rb"))
-    user_id_to_f_user_id = pickle.load(open(root_path / "user_id_to_f_user_id.p", "rb"))
-    model_properties = pickle.load(open(root_path / "model_properties.p", "rb"))
-
-    books_df = pandas.read_csv(root_path / "books.csv")
-    books_df = books_df[books_df['num_ratings'] < books_df['num_ratings'].quantile(QUANTILE_CUTOFF)]
-
-    # Stand up model and load weights
-    model_weights = torch.load(root_path / "model_weights.pth")
-    model = NCF(pd.DataFrame, model_properties.get("num_users"), model_properties.get("num_books"))
-    model.load_state_dict(model_weights)
-    model.eval()
+    global artifacts
+    global inference_executor
+    global inference_batcher
+    global result_cache
+
+    artifacts = _load_artifacts(root_path)
+
+    properties = get_properties()
+    if properties.web_concurrency > 1 and not is_bundle(root_path):
+        logging.warning("Running %d workers from %s, each worker holds its own copy of the model. Build a bundle "
+                        "with python -m src.artifact_bundle to share one between them",
+                        properties.web_concurrency, root_path)
+    torch_num_threads = properties.torch_num_threads or max(
+        1, (os.cpu_count() or 1) // (properties.inference_workers * properties.web_concurrency))
+    torch.set_num_threads(torch_num_threads)
+    inference_executor = InferenceExecutor(properties.inference_workers, properties.inference_max_queue_size)
+    logging.info("Inference executor started with %d workers using %d torch threads",
+                 properties.inference_workers, torch_num_threads)
+    if properties.inference_batch_max_size > 1:
+        inference_batcher = InferenceBatcher(properties.inference_batch_max_size,
+                                             properties.inference_batch_max_wait_ms, inference_executor)
+    if properties.result_cache_max_size > 0:
+        result_cache = ResultCache(properties.result_cache_max_size, properties.result_cache_ttl_seconds)
 
     logging.info("Dependencies initialized in %s seconds", time.time() - start_time)
 
 
-def validate_dependencies():
-    assert len(get_book_id_to_f_book_id()) > 0, "book_id_to_f_book_id not initialized"
-    assert len(get_user_id_to_f_user_id()) > 0, "user_id_to_f_user_id not initialized"
-    assert len(get_model_properties()) > 0, "model_properties not initialized"
-    assert type(get_model()) == NCF, "model not initialized"
-    assert get_books_df() is not None, "books_df not initialized"
+async def reload_dependencies(path: Optional[Path] = None) -> ArtifactBundle:
+    """
+    Loads the model at path (MODEL_FOLDER by default) on a background thread while the current one keeps serving,
+    validates it, and then swaps it in. Requests already in flight finish on the version they started with, since they
+    hold on to their own references to it. Cached rankings are tied to the model and catalogue they came from, so
+    nothing has to be invalidated by hand.
+    """
+    global artifacts
+    global reload_in_progress
+    if reload_in_progress:
+        raise ModelReloadInProgressException("A model reload is already in progress")
+    reload_in_progress = True
+    try:
+        path = path or root_path
+        previous_version = artifacts.version if artifacts is not None else None
+        try:
+            new_artifacts = await asyncio.get_running_loop().run_in_executor(None, _load_artifacts, path)
+            validate_dependencies(new_artifacts)
+        except Exception as e:
+            logging.exception("Failed to reload the model from %s, still serving version %s", path, previous_version)
+            raise ModelReloadFailedException(f"Failed to reload the model from {path}: {e!r}") from e
+
+        artifacts = new_artifacts
+        logging.warning("Reloaded model version %s from %s, replacing version %s", artifacts.version, path,
+                        previous_version)
+        return artifacts
+    finally:
+        reload_in_progress = False
+
+
+def _load_artifacts(path: Path) -> ArtifactBundle:
+    start_time = time.time()
+    # A compiled bundle is memory-mapped, anything else is parsed from the original pickles and books.csv
+    loaded = load_artifacts(path)
+    # The item tower was already computed at full precision, only what runs per request is quantized
+    properties = get_properties()
+    loaded.model = quantize_model(loaded.model, properties.inference_linear_precision,
+                                  properties.inference_embedding_precision)
+    if properties.inference_torchscript:
+        loaded.inference_model = export_inference_model(loaded.model)
+    if properties.retrieval_depth > 0:
+        loaded.retrieval_index = RetrievalIndex.build(loaded.candidate_store, properties.retrieval_depth,
+                                                      properties.retrieval_clusters or None)
+    if properties.score_store_folder:
+        loaded.score_store = _load_score_store(Path(properties.score_store_folder), loaded, properties)
+    # The first few calls through a TorchScript model are profiled and optimized, better here than on a request
+    warm_up_rows = np.arange(min(len(loaded.candidate_store), 64))
+    for _ in range(3):
+        score_candidates(loaded.inference_model, loaded.candidate_store, [0], warm_up_rows)
+    logging.info("Loaded model version %s with %d candidates from %s in %s seconds (bundle: %s, linear layers: %s, "
+                 "embeddings: %s, torchscript: %s)", loaded.version, len(loaded.candidate_store), path,
+                 time.time() - start_time, is_bundle(path), properties.inference_linear_precision,
+                 properties.inference_embedding_precision, properties.inference_torchscript)
+    return loaded
+
+
+def _load_score_store(path: Path, loaded: ArtifactBundle, properties: Properties) -> Optional[ScoreStore]:
+    """
+    Returns the score store at path, unless it is missing or was precomputed for another model, catalogue or precision,
+    in which case every request is scored live
+    """
+    try:
+        score_store = ScoreStore.load(path)
+    except (OSError, ValueError) as e:
+        logging.warning("Not serving precomputed scores, failed to load them from %s: %r", path, e)
+        return None
+    if not score_store.matches(loaded.version, len(loaded.candidate_store), properties.inference_linear_precision,
+                               properties.inference_embedding_precision):
+        logging.warning("Not serving precomputed scores from %s, they were computed for model version %s with %d "
+                        "candidates (linear layers: %s, embeddings: %s) rather than %s with %d (linear layers: %s, "
+                        "embeddings: %s)", path, score_store.model_version, score_store.num_candidates,
+                        score_store.linear_precision, score_store.embedding_precision, loaded.version,
+                        len(loaded.candidate_store), properties.inference_linear_precision,
+                        properties.inference_embedding_precision)
+        return None
+    logging.info("Serving precomputed top %d scores of %d users from %s", score_store.top_n, len(score_store), path)
+    return score_store
+
+
+def shutdown_dependencies():
+    if inference_executor is not None:
+        inference_executor.shutdown()
+
+
+def validate_dependencies(to_validate: Optional[ArtifactBundle] = None):
+    """
+    Validates the given artifacts, or the ones currently being served
+    """
+    to_validate = to_validate or get_artifacts()
+    assert to_validate is not None, "artifacts not initialized"
+    assert len(to_validate.book_id_to_f_book_id) > 0, "book_id_to_f_book_id not initialized"
+    assert len(to_validate.user_id_to_f_user_id) > 0, "user_id_to_f_user_id not initialized"
+    assert len(to_validate.model_properties) > 0, "model_properties not initialized"
+    assert type(to_validate.model) == NCFInference, "model not initialized"
+    assert to_validate.inference_model is not None, "inference_model not initialized"
+    assert to_validate.candidate_store is not None, "candidate_store not initialized"
+    assert get_inference_executor() is not None, "inference_executor not initialized"
     logging.warning("Dependencies validated! Ready to Rock!")
 
 
-def get_book_id_to_f_book_id() -> dict:
-    return book_id_to_f_book_id
+def get_artifacts() -> ArtifactBundle:
+    return artifacts
+
+
+# Everything below derives from the same get_artifacts() snapshot, which FastAPI resolves once per request
+
+def get_book_id_to_f_book_id(snapshot: ArtifactBundle = Depends(get_artifacts)) -> CompactIdMap:
+    return snapshot.book_id_to_f_book_id
+
+
+def get_user_id_to_f_user_id(snapshot: ArtifactBundle = Depends(get_artifacts)) -> CompactIdMap:
+    return snapshot.user_id_to_f_user_id
+
+
+def get_model_properties(snapshot: ArtifactBundle = Depends(get_artifacts)) -> dict:
+    return snapshot.model_properties
+
+
+def get_model(snapshot: ArtifactBundle = Depends(get_artifacts)) -> InferenceModel:
+    return snapshot.inference_model
+
+
+def get_books_df(snapshot: ArtifactBundle = Depends(get_artifacts)) -> Optional[pd.DataFrame]:
+    """
+    Only available when serving straight from the original model folder rather than a bundle
+    """
+    return snapshot.books_df
+
+
+def get_candidate_store(snapshot: ArtifactBundle = Depends(get_artifacts)) -> CandidateStore:
+    return snapshot.candidate_store
+
+
+def get_retrieval_index(snapshot: ArtifactBundle = Depends(get_artifacts)) -> Optional[RetrievalIndex]:
+    return snapshot.retrieval_index
 
 
-def get_user_id_to_f_user_id() -> dict:
-    return user_id_to_f_user_id
+def get_score_store(snapshot: ArtifactBundle = Depends(get_artifacts)) -> Optional[ScoreStore]:
+    return snapshot.score_store
 
 
-def get_model_properties() -> dict:
-    return model_properties
+def get_inference_executor() -> InferenceExecutor:
+    return inference_executor
 
 
-def get_model() -> NCF:
-    return model
+def get_inference_batcher() -> InferenceBatcher:
+    return inference_batcher
 
 
-def get_books_df() -> pd.DataFrame:
-    return books_df
+def get_result_cache() -> ResultCache:
+    return result_cache
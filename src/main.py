@@ -4,14 +4,20 @@ import logging.config
 import uuid
 from os import path
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Depends
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from starlette import status
 
-from src.dependencies import initialize_dependencies, get_model_properties, validate_dependencies
-from src.routers import predict
+from src.artifact_bundle import ArtifactBundle
+from src.dependencies import initialize_dependencies, validate_dependencies, shutdown_dependencies, get_result_cache, \
+    get_artifacts, ModelReloadInProgressException, ModelReloadFailedException
+from src.routers import predict, admin
+from src.service import metrics
+from src.service.inference_executor import InferenceQueueFullException
 from src.service.prediction_service import UserNotFoundException
+from src.service.user_info_client import initialize_user_info_client, shutdown_user_info_client, \
+    get_user_info_client
 
 # setup loggers to display more information
 log_file_path = path.join(path.dirname(path.abspath(__file__)), "logging.conf")
@@ -28,6 +34,13 @@ app = FastAPI()
 def startup():
     initialize_dependencies()
     validate_dependencies()
+    initialize_user_info_client()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await shutdown_user_info_client()
+    shutdown_dependencies()
 
 
 @app.get("/", tags=["welcome"])
@@ -36,8 +49,28 @@ def welcome():
 
 
 @app.get("/info")
-def model_info():
-    return get_model_properties()
+def model_info(artifacts: ArtifactBundle = Depends(get_artifacts)):
+    return artifacts.info()
+
+
+@app.get("/stats")
+def cache_stats():
+    books_read_cache = get_user_info_client().cache
+    result_cache = get_result_cache()
+    return {"books_read_cache": books_read_cache.stats() if books_read_cache is not None else None,
+            "result_cache": result_cache.stats() if result_cache is not None else None}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Stage latencies, candidate and books read counts and cache stats of this worker, in the Prometheus text format
+    """
+    cache_lines = []
+    for name, cache in (("books_read_cache", get_user_info_client().cache), ("result_cache", get_result_cache())):
+        if cache is not None:
+            cache_lines += metrics.render_cache_stats(name, cache.stats())
+    return PlainTextResponse(metrics.render(cache_lines), media_type=metrics.CONTENT_TYPE)
 
 
 @app.exception_handler(RequestValidationError)
@@ -62,4 +95,38 @@ async def user_not_found_exception_handler(request: Request, exc: UserNotFoundEx
     )
 
 
+@app.exception_handler(InferenceQueueFullException)
+async def inference_queue_full_exception_handler(request: Request, exc: InferenceQueueFullException):
+    uuid_str = str(uuid.uuid4())
+    exc_str = f"{uuid_str} - {exc}".replace("\n", " ").replace("   ", " ")
+    logger.warning(exc_str)
+    content = {"status_code": status.HTTP_503_SERVICE_UNAVAILABLE, "message": exc_str}
+    return JSONResponse(
+        content=content, status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+
+@app.exception_handler(ModelReloadInProgressException)
+async def model_reload_in_progress_exception_handler(request: Request, exc: ModelReloadInProgressException):
+    uuid_str = str(uuid.uuid4())
+    exc_str = f"{uuid_str} - {exc}".replace("\n", " ").replace("   ", " ")
+    logger.warning(exc_str)
+    content = {"status_code": status.HTTP_409_CONFLICT, "message": exc_str}
+    return JSONResponse(
+        content=content, status_code=status.HTTP_409_CONFLICT
+    )
+
+
+@app.exception_handler(ModelReloadFailedException)
+async def model_reload_failed_exception_handler(request: Request, exc: ModelReloadFailedException):
+    uuid_str = str(uuid.uuid4())
+    exc_str = f"{uuid_str} - {exc}".replace("\n", " ").replace("   ", " ")
+    logger.error(exc_str)
+    content = {"status_code": status.HTTP_500_INTERNAL_SERVER_ERROR, "message": exc_str}
+    return JSONResponse(
+        content=content, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+    )
+
+
 app.include_router(predict.router)
+app.include_router(admin.router)
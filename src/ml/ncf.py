@@ -37,11 +37,11 @@ class NCF(pl.LightningModule):
         vector = torch.cat([user_embedded, item_embedded, book_details, book_meta], dim=-1)
 
         # Pass through dense layer
-        vector = nn.ReLU()(self.fc1(vector))
-        vector = nn.ReLU()(self.fc2(vector))
+        vector = torch.relu(self.fc1(vector))
+        vector = torch.relu(self.fc2(vector))
 
         # Output layer
-        pred = nn.Sigmoid()(self.output(vector))
+        pred = torch.sigmoid(self.output(vector))
 
         return pred
 
@@ -0,0 +1,95 @@
+"""
+Serving side definition of the NCF model. It only depends on torch, so serving doesn't have to import
+pytorch_lightning and torchmetrics (see src.ml.ncf for the training side) for what is only ever a forward pass.
+"""
+from typing import Optional, Union
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch import Tensor
+from torch.nn.utils import skip_init
+
+# Must match src.ml.ncf.NCF, whose state dicts are loaded as they are
+USER_EMBEDDING_DIM = 16
+BOOK_EMBEDDING_DIM = 14
+# Both embeddings, 4 scaled features and 40 genre flags
+FEATURES_DIM = 74
+
+
+class NCFInference(nn.Module):
+    """
+    Inference only version of NCF: the same embeddings and linear layers under the same names, so it loads NCF's
+    state dict as it is, without any of the Lightning machinery, training dataset or metrics, and with the activations
+    applied as plain functions.
+
+    Its parameters start out uninitialized, rather than randomly initialized only to be overwritten when the trained
+    weights are loaded. Small enough to be compiled with TorchScript, see export_inference_model().
+    """
+
+    def __init__(self, num_users: int, num_books: int):
+        super().__init__()
+        self.user_id_embedding = skip_init(nn.Embedding, num_embeddings=num_users, embedding_dim=USER_EMBEDDING_DIM)
+        self.book_id_embedding = skip_init(nn.Embedding, num_embeddings=num_books, embedding_dim=BOOK_EMBEDDING_DIM)
+
+        self.fc1 = skip_init(nn.Linear, in_features=FEATURES_DIM, out_features=140)
+        self.fc2 = skip_init(nn.Linear, in_features=140, out_features=70)
+        self.output = skip_init(nn.Linear, in_features=70, out_features=1)
+        self.user_dim: int = USER_EMBEDDING_DIM
+
+    @classmethod
+    def from_state_dict(cls, state_dict: dict) -> "NCFInference":
+        model = cls(state_dict["user_id_embedding.weight"].shape[0], state_dict["book_id_embedding.weight"].shape[0])
+        model.load_state_dict(state_dict)
+        return model.eval()
+
+    def forward(self, user_input: Tensor, item_input: Tensor, item_details: Tensor, item_meta: Tensor) -> Tensor:
+        """
+        Same as NCF.forward()
+        """
+        vector = torch.cat([self.user_id_embedding(user_input), self.book_id_embedding(item_input), item_details,
+                            item_meta.to(item_details.dtype)], dim=-1)
+        vector = torch.relu(self.fc1(vector))
+        vector = torch.relu(self.fc2(vector))
+        return torch.sigmoid(self.output(vector))
+
+    @torch.jit.ignore
+    @torch.no_grad()
+    def item_tower(self, item_input: Tensor, item_details: Tensor, item_meta: Tensor) -> Tensor:
+        """
+        Precomputes the item side of fc1, W_item · [item_embedded, item_details, item_meta] + bias, for a set of books.
+        None of it depends on the user, so it can be computed once for the whole catalogue at load time and fed to
+        forward_from_item_tower() instead of running the full forward pass on every request.
+        """
+        vector = torch.cat([self.book_id_embedding(item_input), item_details, item_meta.to(item_details.dtype)],
+                           dim=-1)
+        return F.linear(vector, self.fc1.weight[:, self.user_dim:], self.fc1.bias)
+
+    @torch.jit.export
+    def forward_from_item_tower(self, user_input: Tensor, item_tower: Tensor,
+                                user_index: Optional[Tensor] = None) -> Tensor:
+        """
+        Same output as forward(), but only computes the user side of fc1 and adds it onto the cached item tower. The
+        user side broadcasts, so a single user ID scores every row of the tower. To score several users at once, pass
+        their IDs as user_input and, in user_index, the position in user_input of the user each tower row belongs to.
+        The user side is then still only computed once per user.
+        """
+        user_vector = F.linear(self.user_id_embedding(user_input), self.fc1.weight[:, :self.user_dim])
+        if user_index is not None:
+            user_vector = user_vector[user_index]
+        vector = torch.relu(user_vector + item_tower)
+        vector = torch.relu(self.fc2(vector))
+        return torch.sigmoid(self.output(vector))
+
+
+# What the service scores candidates with, score_candidates() only relies on forward() and forward_from_item_tower()
+InferenceModel = Union[NCFInference, torch.jit.ScriptModule]
+
+
+def export_inference_model(model: NCFInference) -> torch.jit.ScriptModule:
+    """
+    Scripts and freezes the model, which inlines its weights (without copying them) and drops most of the Python and
+    dispatch overhead of every call. That overhead dominates when only a few hundred candidates are scored.
+    """
+    scripted = torch.jit.script(model.eval())
+    return torch.jit.freeze(scripted, preserved_attrs=["forward_from_item_tower"])
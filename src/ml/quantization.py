@@ -0,0 +1,67 @@
+import copy
+from typing import Optional
+
+import torch
+import torch.nn as nn
+
+from src.ml.ncf_inference import NCFInference
+
+LINEAR_PRECISIONS = ("fp32", "int8")
+EMBEDDING_PRECISIONS = ("fp32", "fp16", "int8")
+
+
+class LowPrecisionEmbedding(nn.Module):
+    """
+    Read-only stand-in for nn.Embedding, with the table stored in float16, or in int8 with a float32 scale per row.
+    Looked up rows come back as float32, so the rest of the model doesn't notice the difference.
+    """
+
+    def __init__(self, weight: torch.Tensor, scale: Optional[torch.Tensor] = None):
+        super().__init__()
+        self.num_embeddings, self.embedding_dim = weight.shape
+        self.register_buffer("weight", weight)
+        self.register_buffer("scale", scale)
+
+    @classmethod
+    def from_embedding(cls, embedding: nn.Embedding, precision: str) -> "LowPrecisionEmbedding":
+        weight = embedding.weight.detach()
+        if precision == "fp16":
+            return cls(weight.half())
+        # Symmetric per row quantization, so a few large rows don't cost every other row its precision
+        scale = weight.abs().amax(dim=1, keepdim=True) / 127
+        scale[scale == 0] = 1
+        return cls(torch.round(weight / scale).to(torch.int8), scale)
+
+    def forward(self, input):
+        rows = self.weight[input].float()
+        if self.scale is not None:
+            rows = rows * self.scale[input]
+        return rows
+
+
+def quantize_model(model: NCFInference, linear_precision: str = "fp32",
+                   embedding_precision: str = "fp32") -> NCFInference:
+    """
+    Returns a low precision copy of the model for serving, or the model itself when both precisions are fp32.
+
+    int8 dynamically quantizes fc2 and output, weights are stored in int8 and activations are quantized on the fly.
+    fc1 stays in float32: its book side is precomputed into the candidate store's item tower, and
+    forward_from_item_tower() slices its weight for the user side, which a quantized layer can't do.
+    """
+    if linear_precision not in LINEAR_PRECISIONS:
+        raise ValueError(f"Unknown linear precision {linear_precision}, expected one of {LINEAR_PRECISIONS}")
+    if embedding_precision not in EMBEDDING_PRECISIONS:
+        raise ValueError(f"Unknown embedding precision {embedding_precision}, expected one of {EMBEDDING_PRECISIONS}")
+    if linear_precision == "fp32" and embedding_precision == "fp32":
+        return model
+
+    quantized = copy.deepcopy(model)
+    if linear_precision == "int8":
+        torch.ao.quantization.quantize_dynamic(quantized, {"fc2", "output"}, dtype=torch.qint8, inplace=True)
+    if embedding_precision != "fp32":
+        quantized.user_id_embedding = LowPrecisionEmbedding.from_embedding(model.user_id_embedding,
+                                                                           embedding_precision)
+        quantized.book_id_embedding = LowPrecisionEmbedding.from_embedding(model.book_id_embedding,
+                                                                           embedding_precision)
+    quantized.eval()
+    return quantized
@@ -0,0 +1,60 @@
+"""
+Precomputes the top N of the whole catalogue for a set of users (typically the most active ones), so the service can
+serve them with a lookup instead of scoring them on every request:
+
+    MODEL_FOLDER=/path/to/model python -m src.precompute_scores --users active_users.txt --top-n 500 --output /scores
+
+The users file holds one user ID per line. Serve the output by pointing SCORE_STORE_FOLDER at it. Rankings are only
+served for the model version (and precision) they were computed with, so rerun this whenever the model changes.
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from src.artifact_bundle import load_artifacts
+from src.dependencies import root_path, get_properties
+from src.ml.quantization import quantize_model
+from src.service.id_map import MISSING_ID
+from src.service.score_store import ScoreStore
+
+logger = logging.getLogger(__name__)
+
+# Enough for a request for the most recommendations to be served after a fair share of the ranking is filtered away
+DEFAULT_TOP_N = 500
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Precompute the top N books of a set of users")
+    parser.add_argument("--users", type=argparse.FileType("r"), default=sys.stdin,
+                        help="User IDs to precompute, one per line, defaults to stdin")
+    parser.add_argument("--top-n", type=int, default=DEFAULT_TOP_N, help="Books kept per user")
+    parser.add_argument("--output", type=Path, required=True, help="Folder to write the score store to")
+    parsed = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    with parsed.users:
+        user_ids = np.array([int(line) for line in parsed.users if line.strip()], dtype=np.int64)
+
+    artifacts = load_artifacts(root_path)
+    # Scores have to be the ones the service would compute, so at the precision it serves at
+    properties = get_properties()
+    model = quantize_model(artifacts.model, properties.inference_linear_precision,
+                           properties.inference_embedding_precision)
+    f_user_ids = artifacts.user_id_to_f_user_id.get_many(user_ids)
+    missing = np.count_nonzero(f_user_ids == MISSING_ID)
+    if missing:
+        logger.warning("Skipping %d users that don't exist in training data", missing)
+
+    score_store = ScoreStore.build(model, artifacts.candidate_store, f_user_ids[f_user_ids != MISSING_ID],
+                                   parsed.top_n, artifacts.model.user_id_embedding.num_embeddings, artifacts.version,
+                                   properties.inference_linear_precision, properties.inference_embedding_precision)
+    score_store.save(parsed.output)
+    logger.info("Saved the top %d of %d users for model version %s to %s", score_store.top_n, len(score_store),
+                artifacts.version, parsed.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compares a low precision copy of the model against the full precision one on the model being served, to decide whether
+the latency and memory it saves are worth what it costs in ranking quality:
+
+    MODEL_FOLDER=/path/to/model python -m src.quantization_report --linear int8 --embeddings fp16 --users 500 --k 20
+
+Prints a JSON report with the overlap between both models' top k, how far their scores drift apart and how long each
+takes to score the whole catalogue for one user.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from typing import Sequence
+
+import numpy as np
+
+from src.artifact_bundle import load_artifacts
+from src.dependencies import root_path
+from src.ml.ncf_inference import NCFInference
+from src.ml.quantization import quantize_model, LINEAR_PRECISIONS, EMBEDDING_PRECISIONS
+from src.service.candidate_store import CandidateStore
+from src.service.scoring import score_candidates
+
+
+def compare_top_k(reference: NCFInference, candidate: NCFInference, candidate_store: CandidateStore,
+                  f_user_ids: Sequence[int], k: int = 20) -> dict:
+    """
+    Scores the whole catalogue with both models for each user, and reports how many of the reference model's top k
+    the candidate model also ranks in its top k
+    """
+    rows = np.arange(len(candidate_store))
+    k = min(k, len(rows))
+    overlaps, score_diffs, reference_ms, candidate_ms = [], [], [], []
+    for f_user_id in f_user_ids:
+        start_time = time.perf_counter()
+        reference_scores = score_candidates(reference, candidate_store, [f_user_id], rows)
+        reference_ms.append((time.perf_counter() - start_time) * 1000)
+        start_time = time.perf_counter()
+        candidate_scores = score_candidates(candidate, candidate_store, [f_user_id], rows)
+        candidate_ms.append((time.perf_counter() - start_time) * 1000)
+
+        overlap = np.intersect1d(_top_k(reference_scores, k), _top_k(candidate_scores, k))
+        overlaps.append(len(overlap) / k if k else 1.0)
+        score_diffs.append(float(np.abs(reference_scores - candidate_scores).max(initial=0)))
+
+    return {
+        "users": len(f_user_ids),
+        "k": k,
+        "mean_top_k_overlap": float(np.mean(overlaps)),
+        "min_top_k_overlap": float(np.min(overlaps)),
+        "max_abs_score_diff": float(np.max(score_diffs)),
+        "reference_mean_ms": float(np.mean(reference_ms)),
+        "candidate_mean_ms": float(np.mean(candidate_ms)),
+    }
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    return np.argpartition(-scores, k - 1)[:k] if k else np.empty(0, dtype=np.int64)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Compare a low precision copy of the model against full precision")
+    parser.add_argument("--linear", choices=LINEAR_PRECISIONS, default="int8", help="Precision of the linear layers")
+    parser.add_argument("--embeddings", choices=EMBEDDING_PRECISIONS, default="fp32",
+                        help="Precision of the embedding tables")
+    parser.add_argument("--users", type=int, default=200, help="Users sampled to compare rankings for")
+    parser.add_argument("--k", type=int, default=20, help="Size of the rankings compared")
+    parser.add_argument("--seed", type=int, default=0)
+    parsed = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    artifacts = load_artifacts(root_path)
+    candidate = quantize_model(artifacts.model, parsed.linear, parsed.embeddings)
+    num_users = artifacts.model.user_id_embedding.num_embeddings
+    f_user_ids = np.random.default_rng(parsed.seed).choice(num_users, min(parsed.users, num_users), replace=False)
+
+    report = compare_top_k(artifacts.model, candidate, artifacts.candidate_store, f_user_ids.tolist(), parsed.k)
+    print(json.dumps({"model_version": artifacts.version, "linear": parsed.linear, "embeddings": parsed.embeddings,
+                      **report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Measures the recall of candidate retrieval against scoring every candidate, on the model being served, to pick a
+retrieval depth (and number of clusters) that is fast enough without losing too many of the best books:
+
+    MODEL_FOLDER=/path/to/model python -m src.retrieval_report --depth 2000 --users 500 --k 20
+
+Prints a JSON report with the share of the exhaustive top k that retrieval keeps, and how long each takes per user.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from typing import Sequence
+
+import numpy as np
+
+from src.artifact_bundle import load_artifacts
+from src.dependencies import root_path
+from src.ml.ncf_inference import InferenceModel, export_inference_model
+from src.service.retrieval_index import RetrievalIndex
+from src.service.scoring import score_candidates
+
+
+def retrieval_recall(model: InferenceModel, retrieval_index: RetrievalIndex, f_user_ids: Sequence[int],
+                     k: int = 20) -> dict:
+    """
+    Ranks the whole catalogue for each user, once by scoring every book and once by scoring only what the index
+    retrieves, and reports how many of the exhaustive top k the retrieved top k holds
+    """
+    candidate_store = retrieval_index.candidate_store
+    candidate_mask = np.ones(len(candidate_store), dtype=bool)
+    all_rows = np.arange(len(candidate_store))
+    k = min(k, len(all_rows))
+    recalls, retrieved, exhaustive_ms, retrieval_ms = [], [], [], []
+    for f_user_id in f_user_ids:
+        start_time = time.perf_counter()
+        exhaustive_top_k = all_rows[_top_k(score_candidates(model, candidate_store, [f_user_id], all_rows), k)]
+        exhaustive_ms.append((time.perf_counter() - start_time) * 1000)
+
+        start_time = time.perf_counter()
+        rows = retrieval_index.retrieve(model, f_user_id, candidate_mask)
+        retrieved_top_k = rows[_top_k(score_candidates(model, candidate_store, [f_user_id], rows), k)]
+        retrieval_ms.append((time.perf_counter() - start_time) * 1000)
+
+        recalls.append(len(np.intersect1d(exhaustive_top_k, retrieved_top_k)) / k if k else 1.0)
+        retrieved.append(len(rows))
+
+    return {
+        "users": len(f_user_ids),
+        "k": k,
+        "candidates": len(candidate_store),
+        "depth": retrieval_index.depth,
+        "clusters": len(retrieval_index),
+        "mean_recall": float(np.mean(recalls)),
+        "min_recall": float(np.min(recalls)),
+        "mean_retrieved": float(np.mean(retrieved)),
+        "exhaustive_mean_ms": float(np.mean(exhaustive_ms)),
+        "retrieval_mean_ms": float(np.mean(retrieval_ms)),
+    }
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    return np.argpartition(-scores, k - 1)[:k] if k else np.empty(0, dtype=np.int64)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Measure the recall of candidate retrieval against scoring them all")
+    parser.add_argument("--depth", type=int, default=2000, help="Candidates retrieved per user")
+    parser.add_argument("--clusters", type=int, default=0,
+                        help="Clusters the catalogue is split into, defaults to the square root of its size")
+    parser.add_argument("--users", type=int, default=200, help="Users sampled to compare rankings for")
+    parser.add_argument("--k", type=int, default=20, help="Size of the rankings compared")
+    parser.add_argument("--seed", type=int, default=0)
+    parsed = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    artifacts = load_artifacts(root_path)
+    model = export_inference_model(artifacts.model)
+    retrieval_index = RetrievalIndex.build(artifacts.candidate_store, parsed.depth, parsed.clusters or None)
+    num_users = artifacts.model.user_id_embedding.num_embeddings
+    f_user_ids = np.random.default_rng(parsed.seed).choice(num_users, min(parsed.users, num_users), replace=False)
+
+    report = retrieval_recall(model, retrieval_index, f_user_ids.tolist(), parsed.k)
+    print(json.dumps({"model_version": artifacts.version, **report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
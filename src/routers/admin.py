@@ -0,0 +1,97 @@
+import logging
+import secrets
+from pathlib import Path as FilePath
+from typing import Optional
+
+from fastapi import APIRouter, Body, Depends, Header, HTTPException
+from fastapi.responses import Response
+from pydantic import BaseModel, Field, root_validator
+from starlette import status
+
+from src.dependencies import Properties, get_properties, reload_dependencies
+from src.service.request_profiler import RequestProfiler, get_request_profiler
+
+logger = logging.getLogger(__name__)
+
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None),
+                        properties: Properties = Depends(get_properties)):
+    if not properties.admin_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Admin endpoints are disabled")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, properties.admin_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token")
+
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin_token)])
+
+
+class ProfileRequest(BaseModel):
+    # Profile the next requests requests, or else a sample_rate share of them until profiling is stopped
+    requests: Optional[int] = Field(None, gt=0)
+    sample_rate: float = Field(0.0, ge=0, le=1)
+    # Also profile forward passes with torch.profiler
+    torch: bool = True
+
+    @root_validator(skip_on_failure=True)
+    def check_requests_or_sample_rate(cls, values):
+        if values.get("requests") is None and values.get("sample_rate") == 0:
+            raise ValueError("Either requests or sample_rate has to be given")
+        return values
+
+
+class ReloadRequest(BaseModel):
+    # Defaults to MODEL_FOLDER. A bundle being served is memory-mapped, so a new one has to be built into a new folder
+    # (or swapped in with an atomic rename of the folder), never written over the files of the one being served
+    model_folder: Optional[str] = None
+
+
+@router.post("/reload", status_code=200)
+async def reload_model(reload_request: ReloadRequest = Body(ReloadRequest())) -> dict:
+    """
+    Loads and validates a new model while the current one keeps serving, then swaps it in. Only this worker process
+    is reloaded.
+    """
+    model_folder = FilePath(reload_request.model_folder) if reload_request.model_folder else None
+    artifacts = await reload_dependencies(model_folder)
+    return artifacts.info()
+
+
+@router.post("/profile", status_code=200)
+def start_profiling(profile_request: ProfileRequest = Body(),
+                    profiler: RequestProfiler = Depends(get_request_profiler)) -> dict:
+    """
+    Starts profiling predictions made by this worker process, dropping the results of any previous profiling
+    """
+    profiler.start(profile_request.sample_rate, profile_request.requests, profile_request.torch)
+    return profiler.status()
+
+
+@router.get("/profile", status_code=200)
+def profiling_status(profiler: RequestProfiler = Depends(get_request_profiler)) -> dict:
+    return profiler.status()
+
+
+@router.delete("/profile", status_code=200)
+def stop_profiling(profiler: RequestProfiler = Depends(get_request_profiler)) -> dict:
+    profiler.stop()
+    return profiler.status()
+
+
+@router.get("/profile/pstats", status_code=200, response_class=Response)
+def download_profile(profiler: RequestProfiler = Depends(get_request_profiler)):
+    """
+    The cProfile stats of every profiled request added up, to load with pstats, snakeviz or flameprof
+    """
+    content = profiler.pstats_bytes()
+    if content is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No request has been profiled yet")
+    return Response(content, media_type="application/octet-stream",
+                    headers={"Content-Disposition": 'attachment; filename="predict.pstats"'})
+
+
+@router.get("/profile/torch", status_code=200)
+def torch_profile(profiler: RequestProfiler = Depends(get_request_profiler)) -> list:
+    """
+    Time spent in each torch op during the profiled forward passes, the most expensive first
+    """
+    return profiler.torch_ops()
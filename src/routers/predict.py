@@ -1,16 +1,55 @@
 import logging
 from typing import List
 
-from fastapi import APIRouter, Query, Path, Depends
+from fastapi import APIRouter, Query, Path, Depends, Body, Request
+from fastapi.responses import StreamingResponse, ORJSONResponse
 
 from src.models.genre_list import GenreList
-from src.service.prediction_service import PredictionService, get_prediction_service, PredictionServiceResponse
+from src.service.bulk_prediction import stream_predictions, iter_lines
+from src.service.prediction_service import PredictionService, get_prediction_service, PredictionServiceResponse, \
+    DebugPredictionServiceResponse, BatchPredictionRequest, BatchPredictionResponse
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/predict")
 
 
-@router.get("/{user_id}", tags=["prediction"], status_code=200)
+class _DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse listens for the client disconnecting by reading from the request, which would swallow the
+    request body we're still streaming in. Reading the body already raises ClientDisconnect, so we don't need it.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+@router.post("/batch", tags=["prediction"], status_code=200, response_model=BatchPredictionResponse)
+async def get_batch_book_predictions(
+        batch_request: BatchPredictionRequest = Body(),
+        prediction_service: PredictionService = Depends(get_prediction_service)) -> ORJSONResponse:
+    """
+    Get recommendations for many users at once, each with their own genres and count. Users we've never seen before
+    get a 404 error in their own result instead of failing the whole batch.
+    """
+    return ORJSONResponse(await prediction_service.predict_batch(batch_request.requests))
+
+
+@router.post("/stream", tags=["prediction"], status_code=200, response_class=StreamingResponse)
+async def stream_book_predictions(
+        request: Request,
+        prediction_service: PredictionService = Depends(get_prediction_service)):
+    """
+    Bulk recommendations as newline delimited JSON. Every line of the request body is a request for a single user, like
+    {"user_id": 1, "genres": ["fantasy"], "count": 20}, and every line of the response is the result for the request
+    on the same line. Both sides are streamed, so the body can be arbitrarily large.
+    """
+    return _DuplexStreamingResponse(stream_predictions(prediction_service, iter_lines(request.stream())),
+                                    media_type="application/x-ndjson")
+
+
+@router.get("/{user_id}", tags=["prediction"], status_code=200, response_model=PredictionServiceResponse)
 async def get_book_predictions(
         user_id: int = Path(
             title="The user ID from the Goodreads profile",
@@ -18,8 +57,18 @@ async def get_book_predictions(
             example=2189273),
         genres: List[GenreList] = Query(list()),
         count: int = Query(20, gt=0, le=100),
-        prediction_service: PredictionService = Depends(get_prediction_service)) -> PredictionServiceResponse:
+        debug_timings: bool = Query(False, description="Add how long each stage of the prediction took, in ms"),
+        prediction_service: PredictionService = Depends(get_prediction_service)) -> ORJSONResponse:
     """
-    Get recommendations for a given user ID, if we've never seen the user before, it'll throw a 404.
+    Get recommendations for a given user ID, if we've never seen the user before, it'll throw a 404. If the server is
+    already busy with too many predictions, it'll throw a 503.
     """
-    return prediction_service.predict(user_id, genres, count)
+    response = await prediction_service.predict(user_id, genres, count)
+    if debug_timings:
+        response = DebugPredictionServiceResponse(items=response.items, count=response.count,
+                                                  took_ms=response.took_ms,
+                                                  timings_ms=prediction_service.timings.as_ms())
+    # Serialized straight to bytes by orjson, rather than validated and encoded again by FastAPI, and timed like every
+    # other stage
+    with prediction_service.timings.stage("serialize"):
+        return ORJSONResponse(response)
@@ -0,0 +1,96 @@
+import logging
+from typing import AsyncIterator, Iterable, List, Tuple, Union
+
+import orjson
+from pydantic import ValidationError
+
+from src.service.inference_executor import InferenceQueueFullException
+from src.service.prediction_service import PredictionService, BatchPredictionRequestItem
+
+logger = logging.getLogger(__name__)
+
+# Requests read, scored and written out at a time, so memory use doesn't depend on how big the input is
+BULK_PREDICTION_BATCH_SIZE = 256
+
+
+async def stream_predictions(prediction_service: PredictionService,
+                             lines: AsyncIterator[Union[str, bytes]],
+                             batch_size: int = BULK_PREDICTION_BATCH_SIZE) -> AsyncIterator[str]:
+    """
+    Turns newline delimited JSON requests ({"user_id": 1, "genres": [...], "count": 20} per line) into newline
+    delimited JSON results, in the same order. Only batch_size requests are held at a time, each working batch goes
+    through PredictionService.predict_batch() before the next one is read.
+
+    Lines which aren't a valid request produce {"line": <line number>, "error": {...}} instead of a result, and so
+    does every request of a working batch that fails as a whole (503 when the inference queue is full, 500 otherwise).
+    The response has long been sent as a 200 by then, so the stream carries on with the next batch.
+    """
+    batch: List[Tuple[int, BatchPredictionRequestItem]] = []
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            batch.append((line_number, BatchPredictionRequestItem.parse_raw(line)))
+        except ValidationError as e:
+            # Results stay in input order, so anything already parsed has to go out before the error does
+            async for result in _predict(prediction_service, batch):
+                yield result
+            batch = []
+            yield _error_line(line_number, str(e))
+            continue
+
+        if len(batch) >= batch_size:
+            async for result in _predict(prediction_service, batch):
+                yield result
+            batch = []
+
+    async for result in _predict(prediction_service, batch):
+        yield result
+
+
+async def _predict(prediction_service: PredictionService,
+                   batch: List[Tuple[int, BatchPredictionRequestItem]]) -> AsyncIterator[str]:
+    if not batch:
+        return
+    try:
+        response = await prediction_service.predict_batch([request for _, request in batch])
+    except InferenceQueueFullException as e:
+        logger.warning("Failed to stream predictions for lines %d to %d: %r", batch[0][0], batch[-1][0], e)
+        for line_number, _ in batch:
+            yield _error_line(line_number, str(e), status_code=503)
+        return
+    except Exception as e:
+        logger.exception("Failed to stream predictions for lines %d to %d", batch[0][0], batch[-1][0])
+        for line_number, _ in batch:
+            yield _error_line(line_number, repr(e), status_code=500)
+        return
+    logger.info("Streamed predictions for %d users in %d ms", len(batch), response.took_ms)
+    for result in response.results:
+        yield orjson.dumps(result).decode() + "\n"
+
+
+def _error_line(line_number: int, message: str, status_code: int = 422) -> str:
+    message = message.replace("\n", " ")
+    return orjson.dumps({"line": line_number, "error": {"status_code": status_code, "message": message}}).decode() \
+        + "\n"
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Splits a stream of arbitrarily sized byte chunks (like a request body) into lines
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+async def aiter_sync(lines: Iterable) -> AsyncIterator:
+    for line in lines:
+        yield line
@@ -0,0 +1,169 @@
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+import torch
+
+from src.service.genre_index import GenreIndex
+from src.service.id_map import MISSING_ID
+
+
+class PackedStrings:
+    """
+    Read-only array of strings packed into a single UTF-8 buffer plus offsets, so that (unlike a numpy object array)
+    they can be saved to and memory-mapped from .npy files. Missing strings come back as None.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = _freeze(data)
+        # String i is data[offsets[i]:offsets[i + 1]]
+        self.offsets = _freeze(offsets)
+
+    @classmethod
+    def from_strings(cls, values: Iterable) -> "PackedStrings":
+        encoded = [value.encode("utf-8") if isinstance(value, str) else b"" for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8).copy(), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def take(self, rows) -> List[Optional[str]]:
+        data = self.data
+        offsets = self.offsets
+        return [bytes(data[offsets[row]:offsets[row + 1]]).decode("utf-8") or None for row in rows]
+
+
+class CandidateStore:
+    """
+    Immutable, columnar view of the books catalogue that the model can score. It is built once at startup from the
+    books dataframe, so that requests can be served with index arrays and boolean masks instead of copying and
+    re-querying the dataframe on every call.
+
+    Rows are aligned across every array, and books that have no factorized ID are dropped at build time since the
+    model can't score them anyway.
+    """
+
+    def __init__(self,
+                 book_ids: np.ndarray,
+                 f_book_ids: np.ndarray,
+                 titles: PackedStrings,
+                 features: np.ndarray,
+                 genre_flags: np.ndarray,
+                 genre_index: GenreIndex,
+                 item_tower: Optional[np.ndarray] = None):
+        self.book_ids = _freeze(book_ids)
+        self.f_book_ids = _freeze(f_book_ids)
+        self.titles = titles
+        # The scaled_* columns, fed into the model as item_details
+        self.features = _freeze(features)
+        # Every genre_* column, fed into the model as item_meta
+        self.genre_flags = _freeze(genre_flags)
+        # Per GenreList member bitsets over the rows, used for filtering only
+        self.genre_index = genre_index
+        # The item side of the model's first layer for every row, see NCFInference.item_tower()
+        self.item_tower = _freeze(item_tower) if item_tower is not None else None
+
+    def __len__(self):
+        return len(self.book_ids)
+
+    @classmethod
+    def from_dataframe(cls, books_df: pd.DataFrame,
+                       factorize_book_ids: Callable[[np.ndarray], np.ndarray],
+                       model=None) -> "CandidateStore":
+        """
+        factorize_book_ids maps a whole array of book IDs at once, with MISSING_ID for books that have no factorized
+        ID (see FactorizationService.factorize_book_ids()).
+
+        If a model is given, its item tower is precomputed for every row so requests only pay for the user side
+        """
+        f_book_ids = np.asarray(factorize_book_ids(books_df['book_id'].values.astype(np.int64)), dtype=np.int64)
+        # If any rows don't have a factorized book ID, remove them
+        has_f_book_id = f_book_ids != MISSING_ID
+        books_df = books_df[has_f_book_id]
+
+        scaled_columns = [col for col in books_df if col.startswith('scaled')]
+        genre_columns = [col for col in books_df if col.startswith('genre')]
+
+        f_book_ids = np.ascontiguousarray(f_book_ids[has_f_book_id])
+        features = np.ascontiguousarray(books_df[scaled_columns].values, dtype=np.float32)
+        genre_flags = np.ascontiguousarray(books_df[genre_columns].values.astype(bool))
+
+        item_tower = None
+        if model is not None:
+            item_tower = model.item_tower(torch.from_numpy(f_book_ids), torch.from_numpy(features),
+                                          torch.from_numpy(genre_flags)).numpy()
+
+        return cls(
+            book_ids=np.ascontiguousarray(books_df['book_id'].values, dtype=np.int64),
+            f_book_ids=f_book_ids,
+            titles=PackedStrings.from_strings(books_df['book_title'].values),
+            features=features,
+            genre_flags=genre_flags,
+            genre_index=GenreIndex.from_dataframe(books_df),
+            item_tower=item_tower,
+        )
+
+    def save(self, directory: Path):
+        """
+        Writes every column as a .npy file, so the store can be memory-mapped back in by load()
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, array in self._arrays().items():
+            np.save(directory / f"{name}.npy", array)
+
+    @classmethod
+    def load(cls, directory: Path, mmap_mode: Optional[str] = "r") -> "CandidateStore":
+        def load_array(name):
+            path = directory / f"{name}.npy"
+            return np.load(path, mmap_mode=mmap_mode) if path.exists() else None
+
+        book_ids = load_array("book_ids")
+        return cls(
+            book_ids=book_ids,
+            f_book_ids=load_array("f_book_ids"),
+            titles=PackedStrings(load_array("titles_data"), load_array("titles_offsets")),
+            features=load_array("features"),
+            genre_flags=load_array("genre_flags"),
+            genre_index=GenreIndex(load_array("genre_bitsets"), len(book_ids)),
+            item_tower=load_array("item_tower"),
+        )
+
+    def _arrays(self) -> dict:
+        arrays = {
+            "book_ids": self.book_ids,
+            "f_book_ids": self.f_book_ids,
+            "titles_data": self.titles.data,
+            "titles_offsets": self.titles.offsets,
+            "features": self.features,
+            "genre_flags": self.genre_flags,
+            "genre_bitsets": self.genre_index.bitsets,
+        }
+        if self.item_tower is not None:
+            arrays["item_tower"] = self.item_tower
+        return arrays
+
+    def candidate_mask(self, genres, books_read) -> np.ndarray:
+        """
+        Boolean mask over the store's rows of books which match every requested genre and haven't been read yet
+        """
+        mask = self.genre_index.mask(genres)
+        if len(books_read) > 0:
+            mask &= ~np.isin(self.book_ids, np.asarray(books_read, dtype=np.int64))
+        return mask
+
+    def rows_mask(self, rows: np.ndarray, genres, books_read) -> np.ndarray:
+        """
+        Same as candidate_mask(), but only over the given rows rather than the whole store
+        """
+        mask = self.genre_index.contains(rows, genres)
+        if len(books_read) > 0:
+            mask &= ~np.isin(self.book_ids[rows], np.asarray(books_read, dtype=np.int64))
+        return mask
+
+
+def _freeze(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
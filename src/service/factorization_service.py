@@ -1,8 +1,10 @@
-from typing import Dict
+from typing import Dict, Union
 
+import numpy as np
 from fastapi import Depends
 
 from src.dependencies import get_user_id_to_f_user_id, get_book_id_to_f_book_id
+from src.service.id_map import CompactIdMap, compact_id_map
 
 
 class FactorizationService:
@@ -10,15 +12,16 @@ class FactorizationService:
     Support class to factorize and defactorize user and book IDs. Factorization is a technique to lower the
     dimensionality and size of a model, and is used in the NCF model to shrink the size of the embedding matrix.
 
-    These dictionaries are loaded at startup of this app, and are shipped along with the model definitions as a pickle.
+    The mappings are shipped along with the model definitions, and are loaded at startup of this app. Dicts are
+    converted to compact array backed maps (see src.service.id_map), which take a fraction of the memory.
     """
 
     def __init__(self,
-                 user_to_factorized: Dict[int, int],
-                 book_to_factorized: Dict[int, int],
+                 user_to_factorized: Union[Dict[int, int], CompactIdMap],
+                 book_to_factorized: Union[Dict[int, int], CompactIdMap],
                  ):
-        self.user_to_factorize = user_to_factorized
-        self.book_to_factorize = book_to_factorized
+        self.user_to_factorize = compact_id_map(user_to_factorized)
+        self.book_to_factorize = compact_id_map(book_to_factorized)
 
     def factorize_user_id(self, user_id):
         return self.user_to_factorize.get(user_id)
@@ -26,9 +29,21 @@ class FactorizationService:
     def factorize_book_id(self, book_id):
         return self.book_to_factorize.get(book_id)
 
+    def factorize_user_ids(self, user_ids: np.ndarray) -> np.ndarray:
+        """
+        Vectorized factorize_user_id(), unknown users come back as MISSING_ID
+        """
+        return self.user_to_factorize.get_many(user_ids)
+
+    def factorize_book_ids(self, book_ids: np.ndarray) -> np.ndarray:
+        """
+        Vectorized factorize_book_id(), unknown books come back as MISSING_ID
+        """
+        return self.book_to_factorize.get_many(book_ids)
+
 
 def get_factorization_service(
-        user_to_factorized: Dict[int, int] = Depends(get_user_id_to_f_user_id),
-        book_to_factorized: Dict[int, int] = Depends(get_book_id_to_f_book_id),
+        user_to_factorized: CompactIdMap = Depends(get_user_id_to_f_user_id),
+        book_to_factorized: CompactIdMap = Depends(get_book_id_to_f_book_id),
 ):
     return FactorizationService(user_to_factorized, book_to_factorized)
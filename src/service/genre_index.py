@@ -0,0 +1,67 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from src.models.genre_list import GenreList
+
+# Number of set bits for every possible byte value, used to count matches without unpacking the bitsets
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+class GenreIndex:
+    """
+    Inverted index from each GenreList member to the catalogue rows tagged with it. Every genre is stored as a packed
+    bitset over the rows, so a multi-genre request is a handful of byte-wise ANDs rather than a dataframe query, and
+    the number of matches can be counted before anything gets unpacked or scored.
+    """
+
+    def __init__(self, bitsets: np.ndarray, num_rows: int):
+        # Shape (len(GenreList), ceil(num_rows / 8)), one row per genre in declaration order
+        self.bitsets = bitsets
+        self.bitsets.flags.writeable = False
+        self.num_rows = num_rows
+        self._genre_positions = {genre: position for position, genre in enumerate(GenreList)}
+        self._all_rows = np.packbits(np.ones(num_rows, dtype=bool), bitorder="little")
+
+    @classmethod
+    def from_dataframe(cls, books_df: pd.DataFrame) -> "GenreIndex":
+        num_rows = len(books_df)
+        bitsets = np.zeros((len(GenreList), (num_rows + 7) // 8), dtype=np.uint8)
+        for position, genre in enumerate(GenreList):
+            # A genre missing from the catalogue simply matches nothing
+            if genre.name in books_df:
+                bitsets[position] = np.packbits(books_df[genre.name].values.astype(bool), bitorder="little")
+        return cls(bitsets, num_rows)
+
+    def intersect(self, genres: List[GenreList]) -> np.ndarray:
+        """
+        Packed bitset of the rows tagged with every one of the genres
+        """
+        if len(genres) == 0:
+            return self._all_rows
+        positions = sorted({self._genre_positions[genre] for genre in genres})
+        return np.bitwise_and.reduce(self.bitsets[positions], axis=0)
+
+    def count(self, genres: List[GenreList]) -> int:
+        if len(genres) == 0:
+            return self.num_rows
+        return int(_POPCOUNT[self.intersect(genres)].sum(dtype=np.int64))
+
+    def mask(self, genres: List[GenreList]) -> np.ndarray:
+        """
+        Boolean mask over the rows tagged with every one of the genres
+        """
+        if len(genres) == 0:
+            return np.ones(self.num_rows, dtype=bool)
+        return np.unpackbits(self.intersect(genres), count=self.num_rows, bitorder="little").view(bool)
+
+    def contains(self, rows: np.ndarray, genres: List[GenreList]) -> np.ndarray:
+        """
+        Boolean mask over the given rows of those tagged with every one of the genres, without unpacking the bitsets
+        of the rest of the catalogue
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(genres) == 0:
+            return np.ones(len(rows), dtype=bool)
+        return ((self.intersect(genres)[rows >> 3] >> (rows & 7)) & 1).astype(bool)
@@ -0,0 +1,128 @@
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+# Returned by get_many() for keys which aren't in the map, factorized IDs are never negative
+MISSING_ID = -1
+
+# A dense map is used when its array would be at most this many times longer than the number of keys. At 2 it is
+# never bigger than a sorted map of the same keys, and lookups are a single index instead of a binary search.
+DENSE_MAX_SPAN_RATIO = 2
+
+
+class IdMap:
+    """
+    Read-only int -> int mapping backed by a sorted array of keys and an aligned array of values, looked up with a
+    binary search. Unlike a dict, it can be saved to and memory-mapped from .npy files.
+    """
+
+    def __init__(self, keys: np.ndarray, values: np.ndarray):
+        self.keys = keys
+        self.values = values
+
+    @classmethod
+    def from_dict(cls, mapping: Dict[int, int]) -> "IdMap":
+        keys = np.fromiter(mapping.keys(), dtype=np.int64, count=len(mapping))
+        values = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+        order = np.argsort(keys)
+        return cls(keys[order].astype(_int_dtype(keys)), values[order].astype(_int_dtype(values)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key, default: Optional[int] = None) -> Optional[int]:
+        position = np.searchsorted(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            return int(self.values[position])
+        return default
+
+    def get_many(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Vectorized get(), MISSING_ID stands in for keys which aren't in the map
+        """
+        keys = np.asarray(keys)
+        if len(self.keys) == 0:
+            return np.full(keys.shape, MISSING_ID, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[positions] == keys, self.values[positions], MISSING_ID).astype(np.int64)
+
+    def save(self, directory: Path, name: str):
+        np.save(directory / f"{name}_keys.npy", self.keys)
+        np.save(directory / f"{name}_values.npy", self.values)
+
+
+class DenseIdMap:
+    """
+    Read-only int -> int mapping for keys which are close to contiguous, values[key - offset] holds the value of each
+    key and MISSING_ID the gaps in between.
+    """
+
+    def __init__(self, offset: int, values: np.ndarray, size: Optional[int] = None):
+        self.offset = offset
+        self.values = values
+        self.size = int(np.count_nonzero(values != MISSING_ID)) if size is None else size
+
+    @classmethod
+    def from_id_map(cls, id_map: IdMap) -> "DenseIdMap":
+        offset = int(id_map.keys[0]) if len(id_map) else 0
+        span = int(id_map.keys[-1]) - offset + 1 if len(id_map) else 0
+        values = np.full(span, MISSING_ID, dtype=_int_dtype(id_map.values))
+        values[np.asarray(id_map.keys, dtype=np.int64) - offset] = id_map.values
+        return cls(offset, values, len(id_map))
+
+    def __len__(self):
+        return self.size
+
+    def get(self, key, default: Optional[int] = None) -> Optional[int]:
+        index = key - self.offset
+        if 0 <= index < len(self.values) and self.values[index] != MISSING_ID:
+            return int(self.values[index])
+        return default
+
+    def get_many(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Vectorized get(), MISSING_ID stands in for keys which aren't in the map
+        """
+        indexes = np.asarray(keys, dtype=np.int64) - self.offset
+        in_range = (indexes >= 0) & (indexes < len(self.values))
+        values = np.full(indexes.shape, MISSING_ID, dtype=np.int64)
+        values[in_range] = self.values[indexes[in_range]]
+        return values
+
+    def save(self, directory: Path, name: str):
+        np.save(directory / f"{name}_dense_offset.npy", np.array(self.offset, dtype=np.int64))
+        np.save(directory / f"{name}_dense_values.npy", self.values)
+
+
+CompactIdMap = Union[IdMap, DenseIdMap]
+
+
+def compact_id_map(mapping: Union[Dict[int, int], CompactIdMap]) -> CompactIdMap:
+    """
+    Converts a dict into whichever of IdMap and DenseIdMap suits its keys best, maps are returned as they are
+    """
+    if isinstance(mapping, (IdMap, DenseIdMap)):
+        return mapping
+    id_map = IdMap.from_dict(mapping)
+    if len(id_map) and int(id_map.keys[-1]) - int(id_map.keys[0]) + 1 <= DENSE_MAX_SPAN_RATIO * len(id_map):
+        return DenseIdMap.from_id_map(id_map)
+    return id_map
+
+
+def load_id_map(directory: Path, name: str, mmap_mode: Optional[str] = "r") -> CompactIdMap:
+    if (directory / f"{name}_dense_values.npy").exists():
+        return DenseIdMap(int(np.load(directory / f"{name}_dense_offset.npy")),
+                          np.load(directory / f"{name}_dense_values.npy", mmap_mode=mmap_mode))
+    return IdMap(np.load(directory / f"{name}_keys.npy", mmap_mode=mmap_mode),
+                 np.load(directory / f"{name}_values.npy", mmap_mode=mmap_mode))
+
+
+def _int_dtype(values: np.ndarray) -> np.dtype:
+    """
+    int32 whenever the values fit, which halves the size of the map
+    """
+    int32 = np.iinfo(np.int32)
+    if len(values) == 0 or (int32.min <= values.min() and values.max() <= int32.max):
+        return np.dtype(np.int32)
+    return np.dtype(np.int64)
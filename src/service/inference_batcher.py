@@ -0,0 +1,141 @@
+import asyncio
+import logging
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+
+from src.ml.ncf_inference import InferenceModel
+from src.service.candidate_store import CandidateStore
+from src.service.inference_executor import InferenceExecutor
+from src.service.scoring import score_candidates
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingScore:
+    def __init__(self, model: InferenceModel, candidate_store: CandidateStore, f_user_id: int,
+                 select_candidates: Callable[[], np.ndarray], rank: Callable[[np.ndarray, np.ndarray], Any],
+                 future: asyncio.Future):
+        self.model = model
+        self.candidate_store = candidate_store
+        self.f_user_id = f_user_id
+        self.select_candidates = select_candidates
+        self.rank = rank
+        self.future = future
+
+
+class InferenceBatcher:
+    """
+    Fuses the scoring of concurrent prediction requests into a single forward pass. Requests are collected until
+    either max_batch_size of them are waiting, or max_wait_ms has passed since the first one arrived, and then every
+    (user, candidate) pair in the batch is scored in one go on the inference executor. Each request gets back the
+    scores for its own candidates.
+
+    With rank(), picking each request's candidates and making its result out of their scores happen in that same
+    job, so a request takes up one slot of the executor's queue however many steps it has.
+
+    Requests are only fused with others scoring against the same model and candidate store.
+    """
+
+    def __init__(self, max_batch_size: int, max_wait_ms: float, inference_executor: Optional[InferenceExecutor] = None):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.inference_executor = inference_executor
+        self._pending: List[_PendingScore] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # Keeps a reference to running batches, the event loop only keeps weak ones
+        self._running = set()
+
+    async def score(self, model: InferenceModel, candidate_store: CandidateStore, f_user_id: int,
+                    candidate_rows: np.ndarray) -> np.ndarray:
+        return await self.rank(model, candidate_store, f_user_id, lambda: candidate_rows,
+                               lambda _, scores: scores)
+
+    async def rank(self, model: InferenceModel, candidate_store: CandidateStore, f_user_id: int,
+                   select_candidates: Callable[[], np.ndarray], rank: Callable[[np.ndarray, np.ndarray], Any]) -> Any:
+        """
+        Scores the candidate store rows select_candidates() returns for the user, and returns what rank(rows, scores)
+        makes of them. Both are called from the batch job, on the inference executor.
+        """
+        loop = asyncio.get_running_loop()
+        pending = _PendingScore(model, candidate_store, f_user_id, select_candidates, rank, loop.create_future())
+        self._pending.append(pending)
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await pending.future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch: List[_PendingScore]):
+        try:
+            if self.inference_executor is None:
+                results = _score_batch(batch)
+            else:
+                results = await self.inference_executor.run(_score_batch, batch)
+        except Exception as e:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+
+        for pending, result in zip(batch, results):
+            if pending.future.done():
+                continue
+            if isinstance(result, _Failed):
+                pending.future.set_exception(result.exception)
+            else:
+                pending.future.set_result(result)
+
+
+class _Failed:
+    """
+    A request of the batch whose own step failed, the others still get their results
+    """
+
+    def __init__(self, exception: Exception):
+        self.exception = exception
+
+
+def _score_batch(batch: List[_PendingScore]) -> List[Any]:
+    results = [None] * len(batch)
+    candidate_rows = [None] * len(batch)
+
+    groups = {}
+    for position, pending in enumerate(batch):
+        try:
+            candidate_rows[position] = pending.select_candidates()
+        except Exception as e:
+            results[position] = _Failed(e)
+            continue
+        groups.setdefault((id(pending.model), id(pending.candidate_store)), []).append(position)
+
+    for positions in groups.values():
+        model = batch[positions[0]].model
+        candidate_store = batch[positions[0]].candidate_store
+        lengths = [len(candidate_rows[position]) for position in positions]
+
+        # Stack every user's candidates into one long list of (user, book) pairs
+        f_user_ids = np.array([batch[position].f_user_id for position in positions], dtype=np.int64)
+        user_index = np.repeat(np.arange(len(positions)), lengths)
+        scores = score_candidates(model, candidate_store, f_user_ids,
+                                  np.concatenate([candidate_rows[position] for position in positions]), user_index)
+
+        for position, user_scores in zip(positions, np.split(scores, np.cumsum(lengths)[:-1])):
+            try:
+                results[position] = batch[position].rank(candidate_rows[position], user_scores)
+            except Exception as e:
+                results[position] = _Failed(e)
+
+    logger.debug("Scored a batch of %d requests", len(batch))
+    return results
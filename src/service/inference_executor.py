@@ -0,0 +1,42 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceQueueFullException(Exception):
+    pass
+
+
+class InferenceExecutor:
+    """
+    Dedicated thread pool for the blocking parts of a prediction, so they don't run on (and stall) the event loop.
+
+    The pool accepts at most max_workers running plus max_queue_size waiting calls. Anything beyond that is rejected
+    straight away with an InferenceQueueFullException rather than queueing up, so that a burst of traffic sheds load
+    instead of dragging the latency of every request up with it.
+    """
+
+    def __init__(self, max_workers: int, max_queue_size: int):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue_size)
+
+    async def run(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            logger.warning("Inference queue is full (%d workers, %d queued), shedding request",
+                           self.max_workers, self.max_queue_size)
+            raise InferenceQueueFullException("Inference queue is full, try again later")
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
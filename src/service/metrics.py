@@ -0,0 +1,128 @@
+"""
+Latency and size histograms of the prediction hot path, rendered in the Prometheus text format on /metrics. They're
+kept in memory per process, so with several uvicorn workers every scrape only sees the worker that answered it, like
+/stats.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds of the histogram buckets, observations above the last one only show in +Inf
+STAGE_BUCKETS_SECONDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10_000, 50_000, 100_000, 500_000, 1_000_000)
+
+
+class Histogram:
+    """
+    Cumulative histogram with one series per combination of label values. Observations may come from any thread.
+    """
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.label_names = label_names
+        # Label values to [count per bucket (not cumulative, the last one being +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        position = len(self.buckets)
+        for bucket, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                position = bucket
+                break
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][position] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((label_values, list(counts), total) for label_values, (counts, total)
+                            in self._series.items())
+        for label_values, counts, total in series:
+            labels = [f'{name}="{value}"' for name, value in zip(self.label_names, label_values)]
+            cumulative = 0
+            for upper_bound, count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += count
+                bucket_labels = ",".join([*labels, f'le="{upper_bound}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = "{" + ",".join(labels) + "}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._histograms: List[Histogram] = []
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float],
+                  label_names: Tuple[str, ...] = ()) -> Histogram:
+        histogram = Histogram(name, documentation, buckets, label_names)
+        self._histograms.append(histogram)
+        return histogram
+
+    def render(self) -> List[str]:
+        return [line for histogram in self._histograms for line in histogram.render()]
+
+
+registry = MetricsRegistry()
+
+PREDICTION_STAGE_SECONDS = registry.histogram(
+    "prediction_stage_seconds", "Time spent in each stage of a prediction", STAGE_BUCKETS_SECONDS, ("stage",))
+PREDICTION_CANDIDATES = registry.histogram(
+    "prediction_candidates", "Candidates left to score once filtered by genres and books read", SIZE_BUCKETS)
+PREDICTION_BOOKS_READ = registry.histogram(
+    "prediction_books_read", "Books read by the users predictions are made for", SIZE_BUCKETS)
+
+
+class StageTimings:
+    """
+    How long each stage of a prediction took, added up when a stage runs more than once. Every stage is also
+    recorded into PREDICTION_STAGE_SECONDS as it completes.
+    """
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_time)
+
+    def record(self, name: str, seconds: float):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        PREDICTION_STAGE_SECONDS.observe(seconds, name)
+
+    def as_ms(self) -> Dict[str, float]:
+        return {name: seconds * 1000 for name, seconds in self.seconds.items()}
+
+
+def render_cache_stats(name: str, stats: dict) -> List[str]:
+    """
+    Renders a cache's stats() (see TtlLruCache) as counters of its hits, misses... and gauges of its size and hit ratio
+    """
+    lines = []
+    for key, value in stats.items():
+        if value is None:
+            continue
+        if key in ("size", "max_size", "ttl_seconds", "hit_ratio"):
+            lines += [f"# TYPE {name}_{key} gauge", f"{name}_{key} {value}"]
+        else:
+            lines += [f"# TYPE {name}_{key}_total counter", f"{name}_{key}_total {value}"]
+    return lines
+
+
+def render(extra_lines: Iterable[str] = ()) -> str:
+    return "\n".join([*registry.render(), *extra_lines]) + "\n"
@@ -1,38 +1,97 @@
+import asyncio
 import logging
 import time
-from typing import List, Optional
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 
 import numpy as np
-import pandas as pd
-import torch
 from fastapi import Depends
-from pydantic import BaseSettings
+from pydantic import BaseModel, Field, conlist
 
-from src.dependencies import get_model, get_books_df
-from src.ml.ncf import NCF
+from src.dependencies import get_model, get_candidate_store, get_inference_executor, get_inference_batcher, \
+    get_result_cache, get_retrieval_index, get_score_store
+from src.ml.ncf_inference import InferenceModel
 from src.models.genre_list import GenreList
+from src.service.candidate_store import CandidateStore
 from src.service.factorization_service import FactorizationService, get_factorization_service
+from src.service.inference_batcher import InferenceBatcher
+from src.service.inference_executor import InferenceExecutor
+from src.service.metrics import StageTimings, PREDICTION_BOOKS_READ, PREDICTION_CANDIDATES
+from src.service.request_profiler import RequestProfiler, request_profiler
+from src.service.result_cache import ResultCache
+from src.service.retrieval_index import RetrievalIndex
+from src.service.score_store import ScoreStore
+from src.service.scoring import score_candidates
 from src.service.user_info_client import UserInfoClient, get_user_info_client, UserInfoClientException, \
     UserInfoServerException
 
 logger = logging.getLogger(__name__)
 
 MAX_RECOMMENDATION_COUNT = 100
+# Most users a single batch prediction request may ask for
+MAX_BATCH_PREDICTION_SIZE = 1000
+# Users of a batch that are scored together in one go on the inference executor
+BATCH_SCORING_CHUNK_SIZE = 32
+# User IDs are echoed back in batch results, and orjson only serializes 64-bit integers
+MAX_USER_ID = 2 ** 63 - 1
 
 
-class PredictionServiceItem(BaseSettings):
+# Responses are plain dataclasses rather than pydantic models, as up to MAX_RECOMMENDATION_COUNT items are built for
+# every user and nothing needs validating: they're all built right here. orjson serializes them as they are.
+
+@dataclass(slots=True, kw_only=True)
+class PredictionServiceItem:
     book_id: int
     book_title: Optional[str] = None
     author: Optional[str] = None
     score: float
 
 
-class PredictionServiceResponse(BaseSettings):
+@dataclass(slots=True, kw_only=True)
+class PredictionServiceResponse:
     items: List[PredictionServiceItem]
     count: int = 20
     took_ms: int
 
 
+@dataclass(slots=True, kw_only=True)
+class DebugPredictionServiceResponse(PredictionServiceResponse):
+    # How long each stage of the prediction took, short of serializing the response itself
+    timings_ms: Dict[str, float]
+
+
+class BatchPredictionRequestItem(BaseModel):
+    user_id: int = Field(gt=0, le=MAX_USER_ID)
+    genres: List[GenreList] = []
+    count: int = Field(20, gt=0, le=MAX_RECOMMENDATION_COUNT)
+
+
+class BatchPredictionRequest(BaseModel):
+    requests: conlist(BatchPredictionRequestItem, min_items=1, max_items=MAX_BATCH_PREDICTION_SIZE)
+
+
+@dataclass(slots=True)
+class BatchPredictionError:
+    status_code: int
+    message: str
+
+
+@dataclass(slots=True)
+class BatchPredictionResult:
+    user_id: int
+    items: List[PredictionServiceItem] = field(default_factory=list)
+    count: int = 0
+    error: Optional[BatchPredictionError] = None
+
+
+@dataclass(slots=True)
+class BatchPredictionResponse:
+    results: List[BatchPredictionResult]
+    count: int
+    took_ms: int
+
+
 class UserNotFoundException(Exception):
     pass
 
@@ -44,83 +103,295 @@ class PredictionService:
     to get it to work, so apologies for the complexity here.
     """
 
-    def __init__(self, model: NCF, books_dataframe: pd.DataFrame, user_info_client: UserInfoClient,
-                 factorization_service: FactorizationService):
+    def __init__(self, model: InferenceModel, candidate_store: CandidateStore, user_info_client: UserInfoClient,
+                 factorization_service: FactorizationService, inference_executor: Optional[InferenceExecutor] = None,
+                 inference_batcher: Optional[InferenceBatcher] = None, result_cache: Optional[ResultCache] = None,
+                 retrieval_index: Optional[RetrievalIndex] = None, score_store: Optional[ScoreStore] = None,
+                 profiler: Optional[RequestProfiler] = None):
         self.model = model
-        self.books_dataframe = books_dataframe
+        self.candidate_store = candidate_store
         self.user_info_client = user_info_client
         self.factorization_service = factorization_service
+        # Without an executor the blocking work runs inline, which is only really useful for tests
+        self.inference_executor = inference_executor
+        # Without a batcher every request runs its own forward pass
+        self.inference_batcher = inference_batcher
+        # Without a result cache every request is scored from scratch
+        self.result_cache = result_cache
+        # Without a retrieval index every candidate is scored, an index over a different store can't be used either
+        self.retrieval_index = retrieval_index if retrieval_index is not None and \
+            retrieval_index.candidate_store is candidate_store else None
+        # Without a score store every user is scored live
+        self.score_store = score_store
+        # Only set when this request was sampled for profiling
+        self.profiler = profiler
+        self.timings = StageTimings()
 
-    def predict(self, user_id, genres: List[GenreList] = list(), count: int = 20) -> PredictionServiceResponse:
+    async def predict(self, user_id, genres: List[GenreList] = list(),
+                      count: int = 20) -> PredictionServiceResponse:
         start_time = time.time()
         logger.info("Getting %d book predictions for user %s with genres: %s", count, user_id, genres)
 
-        books_read = self._get_books_read(user_id)
-        candidate_df = self._filter_candidates(genres, books_read)
-        if candidate_df.empty:
+        if self.candidate_store.genre_index.count(genres) == 0:
+            # Nothing in the catalogue matches every genre, so don't bother fetching the books read or scoring
+            logger.info("No books match genres: %s", genres)
             scored_items = []
         else:
-            scored_candidates = self._score_candidates_for_user(candidate_df, user_id)
-            scored_items = [PredictionServiceItem(**item) for item in scored_candidates][:count]
+            books_read = await self._get_books_read(user_id)
+            scored_items = (await self._get_scored_items(user_id, genres, books_read, count))[:count]
 
-        took_ms = (time.time() - start_time) * 1000
+        took_ms = int((time.time() - start_time) * 1000)
         return PredictionServiceResponse(items=scored_items, count=len(scored_items), took_ms=took_ms)
 
-    def _get_books_read(self, user_id):
+    async def predict_batch(self, requests: List[BatchPredictionRequestItem]) -> BatchPredictionResponse:
+        """
+        Predictions for many users at once. The books read of every user are fetched concurrently, and the users are
+        then scored in chunks, each one a single forward pass over all of its (user, candidate) pairs. Problems with
+        an individual user, like not being in the training data or the Book Recommender API failing to return their
+        books read, are reported in that user's result rather than failing the whole batch.
+        """
+        start_time = time.time()
+        logger.info("Getting batch predictions for %d users", len(requests))
+
+        results = [BatchPredictionResult(user_id=request.user_id) for request in requests]
+        with self.timings.stage("factorize"):
+            factorized_user_ids = [self.factorization_service.factorize_user_id(request.user_id)
+                                   for request in requests]
+
+        to_fetch = []
+        for position, (request, factorized_user_id) in enumerate(zip(requests, factorized_user_ids)):
+            if factorized_user_id is None:
+                results[position].error = BatchPredictionError(
+                    status_code=404, message=f"User ID does not exist in training data: {request.user_id}")
+            elif self.candidate_store.genre_index.count(request.genres) > 0:
+                to_fetch.append(position)
+        books_reads = await asyncio.gather(*[self._get_books_read(requests[position].user_id, fail_open=False)
+                                             for position in to_fetch])
+
+        to_score = []
+        for position, books_read in zip(to_fetch, books_reads):
+            request = requests[position]
+            if books_read is None:
+                # Scoring without them would recommend books the user has already read
+                results[position].error = BatchPredictionError(
+                    status_code=503, message=f"Could not get the books read by user: {request.user_id}")
+                continue
+            scored_items = self._precomputed_items(factorized_user_ids[position], request.genres, books_read,
+                                                   request.count)
+            if scored_items is not None:
+                results[position].items = scored_items
+                continue
+            cache_key = None
+            if self.result_cache is not None:
+                cache_key = ResultCache.key(factorized_user_ids[position], request.genres, books_read)
+                scored_items = self.result_cache.get(self.model, self.candidate_store, cache_key)
+                if scored_items is not None:
+                    results[position].items = scored_items[:request.count]
+                    continue
+            limit = MAX_RECOMMENDATION_COUNT if cache_key is not None else request.count
+            to_score.append((position, factorized_user_ids[position], request.genres, books_read, limit, cache_key))
+
+        for chunk_start in range(0, len(to_score), BATCH_SCORING_CHUNK_SIZE):
+            chunk = to_score[chunk_start:chunk_start + BATCH_SCORING_CHUNK_SIZE]
+            ranked = await self._run_blocking(self._rank_candidates_for_users, [
+                (factorized_user_id, genres, books_read, limit)
+                for _, factorized_user_id, genres, books_read, limit, _ in chunk])
+            for (position, _, _, _, _, cache_key), scored_items in zip(chunk, ranked):
+                if cache_key is not None:
+                    self.result_cache.put(self.model, self.candidate_store, cache_key, scored_items)
+                results[position].items = scored_items[:requests[position].count]
+
+        for result in results:
+            result.count = len(result.items)
+        took_ms = int((time.time() - start_time) * 1000)
+        return BatchPredictionResponse(results=results, count=len(results), took_ms=took_ms)
+
+    async def _get_books_read(self, user_id, fail_open: bool = True):
+        """
+        Returns the IDs of the books the user has read. When the Book Recommender API fails, those are taken to be none
+        so that the user still gets recommendations, unless fail_open is False and None is returned instead.
+        """
         try:
-            books_read = self.user_info_client.get_books_read(user_id)
+            with self.timings.stage("books_read"):
+                books_read = await self.user_info_client.get_books_read(user_id)
             logger.info("User %s has read %d books", user_id, len(books_read.book_ids))
+            PREDICTION_BOOKS_READ.observe(len(books_read.book_ids))
             return books_read.book_ids
-        except (UserInfoClientException, UserInfoServerException):
+        except UserInfoClientException:
             return []
+        except UserInfoServerException:
+            return [] if fail_open else None
 
-    def _filter_candidates(self, genres: List[GenreList], books_read: List[int]):
-        all_candidates = self.books_dataframe.copy()
+    async def _get_scored_items(self, user_id, genres: List[GenreList], books_read: List[int],
+                                count: int) -> List[PredictionServiceItem]:
+        """
+        Returns the top scoring items, from the user's precomputed ranking if it holds enough of them, or straight
+        from the result cache if this exact request has been scored before. The cache holds the top
+        MAX_RECOMMENDATION_COUNT so that every count can be served as a slice of the same ranking, without it only the
+        top count items are ever selected.
+        """
+        cache_key = None
+        limit = count
+        with self.timings.stage("factorize"):
+            factorized_user_id = self.factorization_service.factorize_user_id(user_id)
+        scored_items = self._precomputed_items(factorized_user_id, genres, books_read, count)
+        if scored_items is not None:
+            logger.info("Serving precomputed predictions for user %s", user_id)
+            return scored_items
+        if self.result_cache is not None and factorized_user_id is not None:
+            cache_key = ResultCache.key(factorized_user_id, genres, books_read)
+            limit = MAX_RECOMMENDATION_COUNT
+            scored_items = self.result_cache.get(self.model, self.candidate_store, cache_key)
+            if scored_items is not None:
+                logger.info("Serving cached predictions for user %s", user_id)
+                return scored_items
+
+        # A profiled request is scored on its own, for its forward pass to be profiled rather than shared with others
+        if self.inference_batcher is not None and self.profiler is None:
+            scored_items = await self._rank_candidates_batched(user_id, genres, books_read, limit)
+        else:
+            # Filtering and scoring are CPU bound, so they run on the inference executor rather than the loop
+            scored_items = await self._run_blocking(self._rank_candidates, user_id, genres, books_read, limit)
 
-        # Filter out genres they don't want to read
-        if len(genres) > 0:
-            query = " & ".join(f"{genre.name} == 1" for genre in genres)
-            all_candidates.query(query, inplace=True)
+        if cache_key is not None:
+            self.result_cache.put(self.model, self.candidate_store, cache_key, scored_items)
+        return scored_items
 
-        # Remove books already read
-        all_candidates = all_candidates[~all_candidates['book_id'].isin(books_read)]
-        return all_candidates
+    def _precomputed_items(self, factorized_user_id: Optional[int], genres: List[GenreList], books_read: List[int],
+                           count: int) -> Optional[List[PredictionServiceItem]]:
+        """
+        Returns the top count items out of the user's precomputed ranking of the whole catalogue, once filtered by
+        genres and books read. Those are the same as scoring the filtered candidates would return, unless the filters
+        leave fewer than count of them and the ranking doesn't cover the whole catalogue: then, like when the user has
+        no precomputed ranking at all, None is returned and the user has to be scored live.
+        """
+        if self.score_store is None or factorized_user_id is None:
+            return None
+        rows, scores = self.score_store.top(factorized_user_id)
+        if len(rows) == 0:
+            return None
+        count = min(count, MAX_RECOMMENDATION_COUNT)
+        kept = np.flatnonzero(self.candidate_store.rows_mask(rows, genres, books_read))[:count]
+        if len(kept) < count and len(rows) < len(self.candidate_store):
+            return None
+        return self._items(rows[kept], scores[kept])
+
+    async def _run_blocking(self, fn, *args):
+        if self.profiler is not None:
+            fn, args = self.profiler.run, (fn, *args)
+        if self.inference_executor is None:
+            return fn(*args)
+        return await self.inference_executor.run(fn, *args)
+
+    def _profile_forward(self):
+        return self.profiler.profile_forward() if self.profiler is not None else nullcontext()
+
+    def _rank_candidates(self, user_id, genres: List[GenreList], books_read: List[int],
+                         limit: int) -> List[PredictionServiceItem]:
+        candidate_rows = self._filter_candidates(genres, books_read,
+                                                 self.factorization_service.factorize_user_id(user_id))
+        if len(candidate_rows) == 0:
+            return []
+        return self._score_candidates_for_user(candidate_rows, user_id, limit)
 
-    def _score_candidates_for_user(self, candidate_df: pd.DataFrame, user_id: int):
+    async def _rank_candidates_batched(self, user_id, genres: List[GenreList], books_read: List[int],
+                                       limit: int) -> List[PredictionServiceItem]:
+        # Unknown users are turned away before any work is queued on the executor for them
+        factorized_user_id = self._factorize_user_id(user_id)
+        # Filtering and top-k run in the batch job too, so the request only takes up one slot of the executor's queue.
+        # Forward covers the whole job, filter and top_k within it, and waiting for the rest of the batch.
+        with self.timings.stage("forward"):
+            return await self.inference_batcher.rank(
+                self.model, self.candidate_store, factorized_user_id,
+                lambda: self._filter_candidates(genres, books_read, factorized_user_id),
+                lambda candidate_rows, predicted_labels: self._top_candidates(candidate_rows, predicted_labels, limit))
+
+    def _rank_candidates_for_users(self, users) -> List[List[PredictionServiceItem]]:
+        """
+        Ranks candidates for several (factorized user ID, genres, books read, limit) at once, with every user's
+        candidates stacked into a single forward pass
+        """
+        candidate_rows = [self._filter_candidates(genres, books_read, factorized_user_id)
+                          for factorized_user_id, genres, books_read, _ in users]
+        lengths = [len(rows) for rows in candidate_rows]
+        f_user_ids = np.array([factorized_user_id for factorized_user_id, _, _, _ in users], dtype=np.int64)
+        user_index = np.repeat(np.arange(len(users)), lengths)
+        with self.timings.stage("forward"), self._profile_forward():
+            scores = score_candidates(
+                self.model, self.candidate_store, f_user_ids,
+                np.concatenate(candidate_rows) if candidate_rows else np.array([], dtype=np.int64), user_index)
+        return [self._top_candidates(rows, user_scores, limit) if len(rows) > 0 else []
+                for rows, user_scores, (_, _, _, limit) in
+                zip(candidate_rows, np.split(scores, np.cumsum(lengths)[:-1]), users)]
+
+    def _filter_candidates(self, genres: List[GenreList], books_read: List[int],
+                           factorized_user_id: Optional[int] = None) -> np.ndarray:
+        """
+        Returns the candidate store row indices of books matching the genres which haven't already been read. With a
+        retrieval index, only those the index retrieves for the user are returned.
+        """
+        with self.timings.stage("filter"):
+            candidate_mask = self.candidate_store.candidate_mask(genres, books_read)
+            if self.retrieval_index is not None and factorized_user_id is not None:
+                candidate_rows = self.retrieval_index.retrieve(self.model, factorized_user_id, candidate_mask)
+            else:
+                candidate_rows = np.flatnonzero(candidate_mask)
+        PREDICTION_CANDIDATES.observe(len(candidate_rows))
+        return candidate_rows
+
+    def _factorize_user_id(self, user_id: int) -> int:
         factorized_user_id = self.factorization_service.factorize_user_id(user_id)
         if factorized_user_id is None:
             raise UserNotFoundException(f"User ID does not exist in training data: {user_id}, cannot make predictions")
+        return factorized_user_id
+
+    def _score_candidates_for_user(self, candidate_rows: np.ndarray, user_id: int,
+                                   limit: int = MAX_RECOMMENDATION_COUNT) -> List[PredictionServiceItem]:
+        factorized_user_id = self._factorize_user_id(user_id)
+        with self.timings.stage("forward"), self._profile_forward():
+            predicted_labels = score_candidates(self.model, self.candidate_store, [factorized_user_id],
+                                                candidate_rows)
+        return self._top_candidates(candidate_rows, predicted_labels, limit)
+
+    def _top_candidates(self, candidate_rows: np.ndarray, predicted_labels: np.ndarray,
+                        limit: int) -> List[PredictionServiceItem]:
+        """
+        Returns the limit (capped at MAX_RECOMMENDATION_COUNT) highest scoring candidates, best first. Only those are
+        ever sorted, the rest of the catalogue is just partitioned away.
+        """
+        with self.timings.stage("top_k"):
+            limit = min(limit, MAX_RECOMMENDATION_COUNT, len(predicted_labels))
+            if limit < len(predicted_labels):
+                top_positions = np.argpartition(-predicted_labels, limit - 1)[:limit]
+            else:
+                top_positions = np.arange(len(predicted_labels))
+            top_positions = top_positions[np.argsort(-predicted_labels[top_positions], kind='stable')]
+
+            return self._items(candidate_rows[top_positions], predicted_labels[top_positions])
+
+    def _items(self, rows: np.ndarray, scores: np.ndarray) -> List[PredictionServiceItem]:
+        store = self.candidate_store
+        return [PredictionServiceItem(book_id=book_id, book_title=book_title, score=score)
+                for book_id, book_title, score in
+                zip(store.book_ids[rows].tolist(), store.titles.take(rows), scores.tolist())]
+
 
-        # Use .copy() because pandas throws a SettingWithCopyWarning otherwise
-        scored_df = candidate_df.copy()
-        scored_df.insert(0, 'f_user_id', factorized_user_id)
-        scored_df['f_book_id'] = candidate_df['book_id'].map(self.factorization_service.factorize_book_id)
-        # If any rows don't have a factorized book ID, remove them
-        scored_df = scored_df[scored_df['f_book_id'].notna()]
-        # Force column to int (it breaks the model if it's a float)
-        scored_df['f_book_id'] = pd.to_numeric(scored_df['f_book_id'], downcast='integer').astype(int)
-
-        predicted_labels = np.squeeze(self.model(
-            torch.tensor(scored_df.loc[:, "f_user_id"].values),
-            torch.tensor(scored_df.loc[:, "f_book_id"].values),
-            torch.FloatTensor(scored_df.loc[:, [col for col in scored_df if col.startswith('scaled')]].values),
-            torch.BoolTensor(
-                scored_df.loc[:, [col for col in scored_df if col.startswith('genre')]].values.astype(bool))
-        ).detach().numpy())
-
-        scored_df.loc[:, 'score'] = predicted_labels
-        # Returns the top N books with the highest score into a list of dictionaries
-        return scored_df.nlargest(MAX_RECOMMENDATION_COUNT, 'score')[['book_id', 'book_title', 'score']].to_dict(
-            orient='records')
-
-
-def get_prediction_service(model: NCF = Depends(get_model),
-                           books_df: pd.DataFrame = Depends(get_books_df),
+def get_prediction_service(model: InferenceModel = Depends(get_model),
+                           candidate_store: CandidateStore = Depends(get_candidate_store),
                            user_info_client: UserInfoClient = Depends(get_user_info_client),
-                           factorization_service: FactorizationService = Depends(get_factorization_service)
+                           factorization_service: FactorizationService = Depends(get_factorization_service),
+                           inference_executor: InferenceExecutor = Depends(get_inference_executor),
+                           inference_batcher: InferenceBatcher = Depends(get_inference_batcher),
+                           result_cache: ResultCache = Depends(get_result_cache),
+                           retrieval_index: RetrievalIndex = Depends(get_retrieval_index),
+                           score_store: ScoreStore = Depends(get_score_store)
                            ) -> PredictionService:
     """
     Used for FastAPI dependency injection
     """
-    return PredictionService(model=model, books_dataframe=books_df, user_info_client=user_info_client,
-                             factorization_service=factorization_service)
+    # While profiling is off, checking this flag is all it costs
+    profiler = request_profiler if request_profiler.enabled and request_profiler.sample() else None
+    return PredictionService(model=model, candidate_store=candidate_store, user_info_client=user_info_client,
+                             factorization_service=factorization_service, inference_executor=inference_executor,
+                             inference_batcher=inference_batcher, result_cache=result_cache,
+                             retrieval_index=retrieval_index, score_store=score_store, profiler=profiler)
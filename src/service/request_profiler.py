@@ -0,0 +1,150 @@
+"""
+Opt-in profiling of live predictions, switched on through /admin/profile. Requests sampled for profiling run the
+blocking part of their prediction (filtering, the forward pass and top-k) under cProfile, and their forward passes
+under torch.profiler, with the results of every such request added up until they're downloaded. Requests that aren't
+sampled pay for nothing but checking a flag.
+"""
+import cProfile
+import logging
+import marshal
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class RequestProfiler:
+    """
+    Profiles either the next `requests` requests, or a sample_rate share of them until it's stopped. Only the worker
+    process that's asked to is profiled.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.remaining: Optional[int] = None
+        self.profile_torch = True
+        self.profiled_requests = 0
+        self.started_at: Optional[float] = None
+        self._stats: Optional[pstats.Stats] = None
+        self._torch_ops: Dict[str, dict] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # torch.profiler can't profile two forward passes at once, the other one simply isn't profiled
+        self._torch_lock = threading.Lock()
+
+    def start(self, sample_rate: float = 0.0, requests: Optional[int] = None, profile_torch: bool = True):
+        """
+        Starts profiling afresh, dropping whatever was collected before
+        """
+        with self._lock:
+            self.sample_rate = sample_rate
+            self.remaining = requests
+            self.profile_torch = profile_torch
+            self.profiled_requests = 0
+            self.started_at = time.time()
+            self._stats = None
+            self._torch_ops = {}
+            self.enabled = True
+        logger.warning("Profiling %s", f"the next {requests} requests" if requests is not None
+                       else f"{sample_rate:.2%} of requests")
+
+    def stop(self):
+        """
+        Stops sampling requests, what was collected so far can still be downloaded
+        """
+        with self._lock:
+            self.enabled = False
+
+    def sample(self) -> bool:
+        """
+        Whether the request about to be made should be profiled
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            if not self.enabled:
+                return False
+            if self.remaining is not None:
+                self.remaining -= 1
+                if self.remaining <= 0:
+                    self.enabled = False
+            elif self._random.random() >= self.sample_rate:
+                return False
+            self.profiled_requests += 1
+            return True
+
+    def run(self, fn, *args):
+        """
+        Calls fn(*args) under cProfile, adding its stats to those collected so far
+        """
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running on this thread
+            return fn(*args)
+        try:
+            return fn(*args)
+        finally:
+            profile.disable()
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+
+    @contextmanager
+    def profile_forward(self):
+        """
+        Runs the body under torch.profiler, adding the time spent in every torch op to that collected so far
+        """
+        if not self.profile_torch or not self._torch_lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU]) as profile:
+                yield
+            events = profile.key_averages()
+        finally:
+            self._torch_lock.release()
+        with self._lock:
+            for event in events:
+                op = self._torch_ops.setdefault(event.key, {"op": event.key, "calls": 0, "self_cpu_us": 0.0,
+                                                            "cpu_us": 0.0})
+                op["calls"] += event.count
+                op["self_cpu_us"] += event.self_cpu_time_total
+                op["cpu_us"] += event.cpu_time_total
+
+    def pstats_bytes(self) -> Optional[bytes]:
+        """
+        The collected cProfile stats in the format pstats.Stats(), snakeviz or flameprof load from a file, None before
+        anything was profiled
+        """
+        with self._lock:
+            return marshal.dumps(self._stats.stats) if self._stats is not None else None
+
+    def torch_ops(self) -> List[dict]:
+        """
+        Time spent in each torch op during the profiled forward passes, the most expensive first
+        """
+        with self._lock:
+            return sorted((dict(op) for op in self._torch_ops.values()), key=lambda op: -op["self_cpu_us"])
+
+    def status(self) -> dict:
+        return {"enabled": self.enabled, "sample_rate": self.sample_rate, "remaining": self.remaining,
+                "profile_torch": self.profile_torch, "profiled_requests": self.profiled_requests,
+                "started_at": self.started_at}
+
+
+request_profiler = RequestProfiler()
+
+
+def get_request_profiler() -> RequestProfiler:
+    return request_profiler
@@ -0,0 +1,51 @@
+import hashlib
+from typing import Any, Hashable, List
+
+import numpy as np
+
+from src.models.genre_list import GenreList
+from src.service.ttl_lru_cache import TtlLruCache
+
+
+class ResultCache:
+    """
+    Caches the ranking returned for a (user, genres, books read) combination. For a given model and catalogue the
+    ranking is deterministic, so the only thing that can make an entry stale is a new model or catalogue: every lookup
+    passes the ones it would score against, and the whole cache is dropped as soon as either of them changes.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.cache = TtlLruCache(max_size, ttl_seconds)
+        self.invalidations = 0
+        # Strong references rather than IDs, so a reloaded model can never be mistaken for the one it replaced
+        self._model = None
+        self._candidate_store = None
+
+    @staticmethod
+    def key(f_user_id: int, genres: List[GenreList], books_read: List[int]) -> Hashable:
+        books_read_digest = hashlib.blake2b(np.unique(np.asarray(books_read, dtype=np.int64)).tobytes(),
+                                           digest_size=16).digest()
+        return f_user_id, tuple(sorted({genre.name for genre in genres})), books_read_digest
+
+    def get(self, model, candidate_store, key: Hashable) -> Any:
+        self._check_version(model, candidate_store)
+        return self.cache.get(key)
+
+    def put(self, model, candidate_store, key: Hashable, value: Any):
+        # Results computed against a model that has since been swapped out are dropped
+        if model is self._model and candidate_store is self._candidate_store:
+            self.cache.put(key, value)
+
+    def invalidate(self):
+        self.cache.clear()
+        self.invalidations += 1
+
+    def _check_version(self, model, candidate_store):
+        if model is not self._model or candidate_store is not self._candidate_store:
+            if len(self.cache) > 0:
+                self.invalidate()
+            self._model = model
+            self._candidate_store = candidate_store
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "invalidations": self.invalidations}
@@ -0,0 +1,116 @@
+import logging
+import math
+import time
+from typing import Optional
+
+import numpy as np
+import torch
+
+from src.ml.ncf_inference import InferenceModel
+from src.service.candidate_store import CandidateStore
+
+logger = logging.getLogger(__name__)
+
+# k-means is fitted on a sample of the catalogue (at least this many books per cluster), assigning every book to its
+# nearest centroid afterwards is cheap
+KMEANS_SAMPLE_SIZE = 20_000
+KMEANS_SAMPLES_PER_CLUSTER = 40
+KMEANS_ITERATIONS = 10
+# Caps the size of the distance matrix computed at a time while assigning books to centroids
+KMEANS_CHUNK_SIZE = 1 << 14
+
+
+class RetrievalIndex:
+    """
+    Approximate first stage of a retrieve-then-rank pipeline, an IVF style index over the candidate store's item tower,
+    which is the book embedding and features as the model's first layer sees them.
+
+    Books are clustered by their item tower at load time. To retrieve candidates for a user, only the cluster
+    centroids go through the model, and the books of the best scoring clusters are taken until there are at least
+    depth of them. Only those are then scored exactly. Books close to each other in the item tower get similar scores
+    from any user, so the best books tend to be in the best clusters. How often they are depends on the model and the
+    depth, measure it with src.retrieval_report before relying on it.
+    """
+
+    def __init__(self, candidate_store: CandidateStore, centroids: np.ndarray, order: np.ndarray,
+                 offsets: np.ndarray, depth: int):
+        # Rows of a different store mean nothing to this index
+        self.candidate_store = candidate_store
+        # Item tower of each cluster's centroid
+        self.centroids = centroids
+        # Rows of the candidate store sorted by cluster, cluster c is order[offsets[c]:offsets[c + 1]]
+        self.order = order
+        self.offsets = offsets
+        self.depth = depth
+
+    @classmethod
+    def build(cls, candidate_store: CandidateStore, depth: int, num_clusters: Optional[int] = None,
+              seed: int = 0) -> "RetrievalIndex":
+        """
+        num_clusters defaults to the square root of the size of the catalogue
+        """
+        if candidate_store.item_tower is None:
+            raise ValueError("A retrieval index needs a candidate store with an item tower")
+        start_time = time.time()
+        # Copied, since the item tower is read-only and may well be memory-mapped
+        vectors = torch.from_numpy(np.array(candidate_store.item_tower, dtype=np.float32))
+        num_clusters = min(num_clusters or max(1, round(math.sqrt(len(vectors)))), max(1, len(vectors)))
+
+        centroids = _kmeans(vectors, num_clusters, np.random.default_rng(seed))
+        assignments = _nearest_centroids(vectors, centroids).numpy()
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.searchsorted(assignments[order], np.arange(num_clusters + 1))
+
+        logger.info("Built a retrieval index of %d clusters over %d candidates in %s seconds", num_clusters,
+                    len(vectors), time.time() - start_time)
+        return cls(candidate_store, centroids.numpy(), order, offsets, depth)
+
+    def __len__(self):
+        return len(self.centroids)
+
+    @torch.inference_mode()
+    def retrieve(self, model: InferenceModel, f_user_id: int, candidate_mask: np.ndarray) -> np.ndarray:
+        """
+        Returns the rows, out of those set in candidate_mask, of the books in the clusters that score best for the
+        user, at least depth of them. When there aren't more than depth candidates to begin with, they're all returned.
+        """
+        if np.count_nonzero(candidate_mask) <= self.depth:
+            return np.flatnonzero(candidate_mask)
+
+        centroid_scores = model.forward_from_item_tower(torch.tensor([f_user_id]),
+                                                        torch.from_numpy(self.centroids)).reshape(-1).numpy()
+        ranked_clusters = np.argsort(-centroid_scores, kind="stable")
+
+        # How many candidates each cluster holds once filtered, and how many clusters it takes to reach depth
+        candidates_so_far = np.concatenate([[0], np.cumsum(candidate_mask[self.order])])
+        cluster_sizes = candidates_so_far[self.offsets[1:]] - candidates_so_far[self.offsets[:-1]]
+        num_probed = np.searchsorted(np.cumsum(cluster_sizes[ranked_clusters]), self.depth) + 1
+
+        rows = np.concatenate([self.order[self.offsets[cluster]:self.offsets[cluster + 1]]
+                               for cluster in ranked_clusters[:num_probed]])
+        return np.sort(rows[candidate_mask[rows]])
+
+
+def _kmeans(vectors: torch.Tensor, num_clusters: int, rng: np.random.Generator) -> torch.Tensor:
+    sample_size = max(KMEANS_SAMPLE_SIZE, KMEANS_SAMPLES_PER_CLUSTER * num_clusters)
+    sample = vectors[torch.from_numpy(rng.permutation(len(vectors))[:sample_size])]
+    centroids = sample[torch.from_numpy(rng.choice(len(sample), num_clusters, replace=False))].clone()
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = _nearest_centroids(sample, centroids)
+        sums = torch.zeros_like(centroids).index_add_(0, assignments, sample)
+        counts = torch.bincount(assignments, minlength=num_clusters)
+        # Empty clusters keep their previous centroid
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty].unsqueeze(1)
+    return centroids
+
+
+def _nearest_centroids(vectors: torch.Tensor, centroids: torch.Tensor) -> torch.Tensor:
+    centroid_norms = (centroids * centroids).sum(dim=1)
+    assignments = torch.empty(len(vectors), dtype=torch.int64)
+    for start in range(0, len(vectors), KMEANS_CHUNK_SIZE):
+        chunk = vectors[start:start + KMEANS_CHUNK_SIZE]
+        # |v - c|² without the |v|² term, which is the same for every centroid
+        distances = centroid_norms - 2 * chunk @ centroids.T
+        assignments[start:start + len(chunk)] = distances.argmin(dim=1)
+    return assignments
@@ -0,0 +1,129 @@
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.ml.ncf_inference import InferenceModel
+from src.service.candidate_store import CandidateStore
+from src.service.scoring import score_candidates
+
+logger = logging.getLogger(__name__)
+
+SCORE_STORE_MANIFEST_FILE = "manifest.json"
+# Bumped whenever the layout of a score store changes, so old stores are rejected rather than misread
+SCORE_STORE_FORMAT_VERSION = 1
+
+
+class ScoreStore:
+    """
+    Precomputed rankings of the whole candidate store for a set of users, the top_n best scoring rows of each, best
+    first. Built offline by python -m src.precompute_scores and memory-mapped at load time, so serving a user that has
+    one is a lookup and a filter instead of a forward pass over the catalogue.
+
+    Rows and scores only mean something for the model version and catalogue they were computed with, which is why the
+    store records the version it was built for.
+    """
+
+    def __init__(self, offsets: np.ndarray, rows: np.ndarray, scores: np.ndarray, top_n: int, model_version: str,
+                 num_candidates: int, linear_precision: str = "fp32", embedding_precision: str = "fp32"):
+        # User f's ranking is rows[offsets[f]:offsets[f + 1]], which is empty for users that weren't precomputed
+        self.offsets = offsets
+        # Candidate store rows and their scores, flattened across every user
+        self.rows = rows
+        self.scores = scores
+        self.top_n = top_n
+        self.model_version = model_version
+        self.num_candidates = num_candidates
+        self.linear_precision = linear_precision
+        self.embedding_precision = embedding_precision
+
+    @classmethod
+    def build(cls, model: InferenceModel, candidate_store: CandidateStore, f_user_ids: Sequence[int], top_n: int,
+              num_users: int, model_version: str, linear_precision: str = "fp32",
+              embedding_precision: str = "fp32") -> "ScoreStore":
+        """
+        Scores every candidate for each of the factorized user IDs and keeps their top_n. num_users is how many users
+        the model knows about, every one of them gets an entry in the offsets even if it is empty.
+        """
+        start_time = time.time()
+        all_rows = np.arange(len(candidate_store))
+        top_n = min(top_n, len(all_rows))
+        precomputed = np.zeros(num_users, dtype=bool)
+        precomputed[np.asarray(f_user_ids, dtype=np.int64)] = True
+        f_user_ids = np.flatnonzero(precomputed)
+
+        offsets = np.zeros(num_users + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(precomputed * top_n)
+        rows = np.empty(len(f_user_ids) * top_n, dtype=np.int32)
+        scores = np.empty(len(f_user_ids) * top_n, dtype=np.float32)
+        for position, f_user_id in enumerate(f_user_ids.tolist()):
+            user_scores = score_candidates(model, candidate_store, [f_user_id], all_rows)
+            top_rows = np.argpartition(-user_scores, top_n - 1)[:top_n] if top_n else all_rows[:0]
+            top_rows = top_rows[np.argsort(-user_scores[top_rows], kind="stable")]
+            rows[position * top_n:(position + 1) * top_n] = top_rows
+            scores[position * top_n:(position + 1) * top_n] = user_scores[top_rows]
+            if (position + 1) % 1000 == 0:
+                logger.info("Precomputed the top %d of %d/%d users", top_n, position + 1, len(f_user_ids))
+
+        logger.info("Precomputed the top %d of %d users in %s seconds", top_n, len(f_user_ids),
+                    time.time() - start_time)
+        return cls(offsets, rows, scores, top_n, model_version, len(candidate_store), linear_precision,
+                   embedding_precision)
+
+    def __len__(self):
+        """
+        Number of users with a precomputed ranking
+        """
+        return int(np.count_nonzero(np.diff(self.offsets)))
+
+    def top(self, f_user_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The user's precomputed candidate store rows and scores, best first, both empty if there aren't any
+        """
+        if not 0 <= f_user_id < len(self.offsets) - 1:
+            return self.rows[:0], self.scores[:0]
+        start, end = self.offsets[f_user_id], self.offsets[f_user_id + 1]
+        return self.rows[start:end], self.scores[start:end]
+
+    def save(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / "offsets.npy", self.offsets)
+        np.save(directory / "rows.npy", self.rows)
+        np.save(directory / "scores.npy", self.scores)
+        manifest = {
+            "format_version": SCORE_STORE_FORMAT_VERSION,
+            "model_version": self.model_version,
+            "num_candidates": self.num_candidates,
+            "top_n": self.top_n,
+            "users": len(self),
+            "linear_precision": self.linear_precision,
+            "embedding_precision": self.embedding_precision,
+            "created_at": int(time.time()),
+        }
+        # Written last, so a half written store is never mistaken for a complete one
+        with open(directory / SCORE_STORE_MANIFEST_FILE, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    @classmethod
+    def load(cls, directory: Path, mmap_mode: Optional[str] = "r") -> "ScoreStore":
+        with open(directory / SCORE_STORE_MANIFEST_FILE) as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != SCORE_STORE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported score store format {manifest.get('format_version')} at {directory}, "
+                             f"expected {SCORE_STORE_FORMAT_VERSION}")
+        return cls(np.load(directory / "offsets.npy", mmap_mode=mmap_mode),
+                   np.load(directory / "rows.npy", mmap_mode=mmap_mode),
+                   np.load(directory / "scores.npy", mmap_mode=mmap_mode),
+                   manifest["top_n"], manifest["model_version"], manifest["num_candidates"],
+                   manifest["linear_precision"], manifest["embedding_precision"])
+
+    def matches(self, model_version: str, num_candidates: int, linear_precision: str,
+                embedding_precision: str) -> bool:
+        """
+        Whether the store was precomputed with the model and catalogue being served, at the precision being served
+        """
+        return (self.model_version, self.num_candidates, self.linear_precision, self.embedding_precision) == \
+            (model_version, num_candidates, linear_precision, embedding_precision)
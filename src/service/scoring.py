@@ -0,0 +1,45 @@
+from typing import Optional
+
+import numpy as np
+import torch
+
+from src.ml.ncf_inference import InferenceModel
+from src.service.candidate_store import CandidateStore
+
+# Caps how many (user, book) pairs go through the model in one forward pass, so that scoring a large catalogue (or a
+# large batch of users) doesn't materialize an equally large activation matrix
+MAX_PAIRS_PER_FORWARD = 1 << 17
+
+
+@torch.inference_mode()
+def score_candidates(model: InferenceModel,
+                     candidate_store: CandidateStore,
+                     f_user_ids: np.ndarray,
+                     candidate_rows: np.ndarray,
+                     user_index: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Scores rows of the candidate store for factorized user IDs, returning one score per candidate row.
+
+    With a single user, every row is scored for that user. With several users, user_index gives the position in
+    f_user_ids of the user each candidate row should be scored for.
+    """
+    f_user_ids = torch.from_numpy(np.asarray(f_user_ids, dtype=np.int64))
+    scores = np.empty(len(candidate_rows), dtype=np.float32)
+
+    for start in range(0, len(candidate_rows), MAX_PAIRS_PER_FORWARD):
+        rows = candidate_rows[start:start + MAX_PAIRS_PER_FORWARD]
+        users = torch.from_numpy(user_index[start:start + MAX_PAIRS_PER_FORWARD]) if user_index is not None else None
+
+        if candidate_store.item_tower is not None:
+            # Only the user side of the first layer has to be computed, the book side was cached at startup
+            predictions = model.forward_from_item_tower(
+                f_user_ids, torch.from_numpy(candidate_store.item_tower[rows]), users)
+        else:
+            predictions = model(
+                f_user_ids[users] if users is not None else f_user_ids.expand(len(rows)),
+                torch.from_numpy(candidate_store.f_book_ids[rows]),
+                torch.from_numpy(candidate_store.features[rows]),
+                torch.from_numpy(candidate_store.genre_flags[rows]))
+
+        scores[start:start + len(rows)] = predictions.reshape(-1).numpy()
+    return scores
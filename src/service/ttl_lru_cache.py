@@ -0,0 +1,99 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+_MISSING = object()
+
+
+class TtlLruCache:
+    """
+    Bounded in-process cache where entries expire after ttl_seconds, and the least recently used entry is evicted
+    once max_size is reached.
+
+    Loads go through get_or_load(), which coalesces concurrent misses for the same key into a single call to the
+    loader. Failed loads are never cached, every waiting caller gets the exception and the next call tries again.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._get_fresh(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        return value
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = self._get_fresh(key)
+        if value is not _MISSING:
+            return value
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            # Shielded, so one caller being cancelled doesn't cancel the load for everybody else waiting on it
+            return await asyncio.shield(in_flight)
+
+        self.misses += 1
+        task = asyncio.ensure_future(loader())
+        self._in_flight[key] = task
+        # Stored by the task itself rather than by this caller, which may be cancelled before the load completes
+        task.add_done_callback(lambda done: self._finish_load(key, done))
+        return await asyncio.shield(task)
+
+    def _finish_load(self, key: Hashable, task: asyncio.Future):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+
+    def _get_fresh(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.expirations += 1
+            return _MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self._entries[key] = (self._clock() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
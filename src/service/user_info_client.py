@@ -1,17 +1,13 @@
+import asyncio
 import logging
-from functools import lru_cache
-from typing import List
+from dataclasses import dataclass
 
 import httpx
-from fastapi import Depends
-from pydantic import BaseSettings, Extra
+import numpy as np
+import orjson
 
-from src.dependencies import Properties
-
-
-@lru_cache()
-def get_properties():
-    return Properties()
+from src.dependencies import get_properties
+from src.service.ttl_lru_cache import TtlLruCache
 
 
 class UserInfoClient(object):
@@ -19,17 +15,39 @@ class UserInfoClient(object):
     Client wrappper around the Book Recommender API. This API will be used to determine
     the books that a user has read. This information will be used to exclude books that
     the user has already read from the recommendations.
+
+    A single instance is created at startup and shared between requests, so that its connection pool (and the
+    keep-alive connections in it) are reused rather than reconnecting on every call. Users tend to come back
+    several times in a row (e.g. while paging through genres), so the books read are also cached for a while.
     """
 
     def __init__(self, properties):
         self.base_url = properties.book_recommender_api_base_url
-
-    def get_books_read(self, user_id):
+        self.http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(properties.user_info_read_timeout,
+                                  connect=properties.user_info_connect_timeout),
+            limits=httpx.Limits(max_connections=properties.user_info_max_connections,
+                                max_keepalive_connections=properties.user_info_max_keepalive_connections),
+        )
+        # httpx only waits for a free connection as long as the read timeout, so a burst bigger than the pool (a
+        # batch fetching a thousand users at once) would time out while still queued. They queue here instead.
+        self._connection_slots = asyncio.Semaphore(properties.user_info_max_connections)
+        self.cache = None
+        if properties.books_read_cache_max_size > 0:
+            self.cache = TtlLruCache(properties.books_read_cache_max_size, properties.books_read_cache_ttl_seconds)
+
+    async def get_books_read(self, user_id):
+        if self.cache is None:
+            return await self._fetch_books_read(user_id)
+        return await self.cache.get_or_load(user_id, lambda: self._fetch_books_read(user_id))
+
+    async def _fetch_books_read(self, user_id):
         url = self.base_url + "/users/" + str(user_id) + "/book-ids"
         try:
-            response = httpx.get(url)
+            async with self._connection_slots:
+                response = await self.http_client.get(url)
             if not response.is_error:
-                return BooksReadResponse(**response.json())
+                return BooksReadResponse.parse(response.content)
             elif response.is_client_error:
                 logging.warning(
                     "{} status code encountered when querying {} "
@@ -45,13 +63,24 @@ class UserInfoClient(object):
         except httpx.HTTPError as e:
             logging.error("Uncaught Exception:{} encountered when querying {} for user_id: {}".format(e, url, user_id))
             raise UserInfoServerException("Uncaught Exception encountered for user_id: {}".format(user_id))
+        except (KeyError, TypeError, ValueError) as e:
+            logging.error("Invalid response:{} encountered when querying {} for user_id: {}".format(e, url, user_id))
+            raise UserInfoServerException("Invalid response encountered for user_id: {}".format(user_id))
+
+    async def close(self):
+        await self.http_client.aclose()
 
 
-class BooksReadResponse(BaseSettings):
-    book_ids: List[int]
+@dataclass(slots=True)
+class BooksReadResponse:
+    book_ids: np.ndarray
 
-    class Config:
-        extra = Extra.ignore
+    @classmethod
+    def parse(cls, content: bytes) -> "BooksReadResponse":
+        """
+        Parses the Book Recommender API's JSON straight into an array of book IDs, ignoring anything else in it
+        """
+        return cls(book_ids=np.array(orjson.loads(content)["book_ids"], dtype=np.int64))
 
 
 class UserInfoClientException(Exception):
@@ -62,8 +91,21 @@ class UserInfoServerException(Exception):
     pass
 
 
-def get_user_info_client(properties: Properties = Depends(get_properties)) -> UserInfoClient:
+user_info_client = None
+
+
+def initialize_user_info_client():
+    global user_info_client
+    user_info_client = UserInfoClient(properties=get_properties())
+
+
+async def shutdown_user_info_client():
+    if user_info_client is not None:
+        await user_info_client.close()
+
+
+def get_user_info_client() -> UserInfoClient:
     """
     Used for FastAPI dependency injection
     """
-    return UserInfoClient(properties=properties)
+    return user_info_client
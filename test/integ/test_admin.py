@@ -0,0 +1,104 @@
+import pytest
+from assertpy import assert_that
+from fastapi.testclient import TestClient
+
+from src import dependencies
+from src.dependencies import Properties, get_properties, get_artifacts
+from src.main import app
+
+ADMIN_TOKEN = "let-me-in"
+
+
+@pytest.fixture(autouse=True)
+def admin_token():
+    app.dependency_overrides[get_properties] = lambda: Properties(admin_token=ADMIN_TOKEN)
+    yield
+    app.dependency_overrides = {}
+
+
+def test_admin_endpoints_are_disabled_without_a_token(test_client: TestClient):
+    # Given
+    app.dependency_overrides[get_properties] = lambda: Properties(admin_token="")
+
+    # When
+    response = test_client.post("/admin/reload", headers={"X-Admin-Token": ""})
+
+    # Then
+    assert_that(response.status_code).is_equal_to(404)
+
+
+def test_reload_requires_the_admin_token(test_client: TestClient):
+    # When
+    response = test_client.post("/admin/reload", headers={"X-Admin-Token": "guess"})
+
+    # Then
+    assert_that(response.status_code).is_equal_to(403)
+
+
+def test_reload_swaps_in_a_new_model(test_client: TestClient):
+    # Given
+    previous = get_artifacts()
+    assert_that(test_client.get("/predict/100").status_code).is_equal_to(200)
+
+    # When
+    response = test_client.post("/admin/reload", headers={"X-Admin-Token": ADMIN_TOKEN})
+
+    # Then
+    assert_that(response.status_code).is_equal_to(200)
+    assert_that(get_artifacts()).is_not_same_as(previous)
+    assert_that(get_artifacts().model).is_not_same_as(previous.model)
+    assert_that(response.json()).contains_entry({"model_version": previous.version})
+    assert_that(test_client.get("/info").json()).contains_entry(
+        {"model_loaded_at": response.json()["model_loaded_at"]})
+    assert_that(test_client.get("/predict/100").status_code).is_equal_to(200)
+
+
+def test_failed_reload_keeps_serving_the_current_model(test_client: TestClient, tmp_path):
+    # Given
+    previous = get_artifacts()
+
+    # When
+    response = test_client.post("/admin/reload", headers={"X-Admin-Token": ADMIN_TOKEN},
+                                json={"model_folder": tmp_path.as_posix()})
+
+    # Then
+    assert_that(response.status_code).is_equal_to(500)
+    assert_that(get_artifacts()).is_same_as(previous)
+
+
+def test_concurrent_reloads_are_rejected(test_client: TestClient, monkeypatch):
+    # Given
+    monkeypatch.setattr(dependencies, "reload_in_progress", True)
+
+    # When
+    response = test_client.post("/admin/reload", headers={"X-Admin-Token": ADMIN_TOKEN})
+
+    # Then
+    assert_that(response.status_code).is_equal_to(409)
+
+
+def test_profiling_the_next_requests(test_client: TestClient):
+    # Given
+    headers = {"X-Admin-Token": ADMIN_TOKEN}
+    start = test_client.post("/admin/profile", json={"requests": 1}, headers=headers)
+
+    # When
+    test_client.get("/predict/200?count=3")
+    test_client.get("/predict/300?count=3")
+    download = test_client.get("/admin/profile/pstats", headers=headers)
+
+    # Then
+    assert_that(start.status_code).is_equal_to(200)
+    assert_that(test_client.get("/admin/profile", headers=headers).json()).contains_entry(
+        {"enabled": False}, {"profiled_requests": 1})
+    assert_that(download.status_code).is_equal_to(200)
+    assert_that(download.headers["content-disposition"]).contains("predict.pstats")
+    assert_that(test_client.get("/admin/profile/torch", headers=headers).json()).is_not_empty()
+
+
+def test_profiling_needs_requests_or_a_sample_rate(test_client: TestClient):
+    # When
+    response = test_client.post("/admin/profile", json={}, headers={"X-Admin-Token": ADMIN_TOKEN})
+
+    # Then
+    assert_that(response.status_code).is_equal_to(422)
@@ -12,3 +12,24 @@ def test_reading_model_properties(test_client: TestClient):
     response = test_client.get("/info")
     assert_that(response.status_code).is_equal_to(200)
     assert_that(response.json()).contains_entry({"source_folder": "test_folder/2002-01-01"})
+    assert_that(response.json()).contains_key("model_version", "model_loaded_at")
+
+
+def test_reading_cache_stats(test_client: TestClient):
+    response = test_client.get("/stats")
+    assert_that(response.status_code).is_equal_to(200)
+    assert_that(response.json().get("books_read_cache")).contains_key("hits", "misses", "evictions")
+
+
+def test_reading_metrics(test_client: TestClient):
+    # Given
+    test_client.get("/predict/100")
+
+    # When
+    response = test_client.get("/metrics")
+
+    # Then
+    assert_that(response.status_code).is_equal_to(200)
+    assert_that(response.headers["content-type"]).starts_with("text/plain; version=0.0.4")
+    assert_that(response.text).contains('prediction_stage_seconds_count{stage="books_read"}',
+                                        "prediction_candidates_count", "books_read_cache_hit_ratio")
@@ -1,12 +1,18 @@
-from unittest.mock import MagicMock
+import json
+from unittest.mock import MagicMock, AsyncMock
 
 import pandas as pd
 import pytest
 from assertpy import assert_that
 from fastapi.testclient import TestClient
 
-from src.dependencies import get_books_df, get_book_id_to_f_book_id, get_user_id_to_f_user_id, Properties
+from src.dependencies import get_books_df, get_book_id_to_f_book_id, get_user_id_to_f_user_id, Properties, \
+    get_candidate_store, get_inference_executor, get_inference_batcher
 from src.main import app
+from src.service.candidate_store import CandidateStore
+from src.service.id_map import compact_id_map
+from src.service.inference_batcher import InferenceBatcher
+from src.service.inference_executor import InferenceQueueFullException
 from src.service.user_info_client import UserInfoClient, get_user_info_client, BooksReadResponse, \
     UserInfoServerException, UserInfoClientException
 
@@ -14,7 +20,7 @@ from src.service.user_info_client import UserInfoClient, get_user_info_client, B
 @pytest.fixture()
 def user_info_client_mock():
     user_info_client = UserInfoClient(Properties())
-    user_info_client.get_books_read = MagicMock(return_value=BooksReadResponse(book_ids=[4, 5, 6]))
+    user_info_client.get_books_read = AsyncMock(return_value=BooksReadResponse(book_ids=[4, 5, 6]))
     yield user_info_client
 
 
@@ -47,6 +53,18 @@ def test_count_works_to_limit_results(test_client: TestClient):
     assert_that(response.json().get("items")).is_length(1)
 
 
+def test_debug_timings_add_a_breakdown_of_every_stage(test_client: TestClient):
+    # When
+    response = test_client.get("/predict/1?debug_timings=true")
+    plain_response = test_client.get("/predict/1")
+
+    # Then
+    assert_that(response.json().get("timings_ms")).contains_key("books_read", "factorize", "filter", "forward",
+                                                                 "top_k")
+    assert_that(response.json().get("items")).is_equal_to(plain_response.json().get("items"))
+    assert_that(plain_response.json()).does_not_contain_key("timings_ms")
+
+
 def test_unknown_user_throws_exception(test_client: TestClient):
     response = test_client.get("/predict/99999999?count=1")
     assert_that(response.status_code).is_equal_to(404)
@@ -71,7 +89,7 @@ def test_previous_books_read_correctly_removes_book_from_suggestions(books_read,
                                                                      user_info_client_mock: UserInfoClient,
                                                                      test_client: TestClient):
     # Given
-    user_info_client_mock.get_books_read = MagicMock(return_value=BooksReadResponse(book_ids=books_read))
+    user_info_client_mock.get_books_read = AsyncMock(return_value=BooksReadResponse(book_ids=books_read))
 
     # When
     response = test_client.get("/predict/1?")
@@ -84,7 +102,7 @@ def test_user_info_service_throwing_server_exception_doesnt_block_prediction(
         user_info_client_mock: UserInfoClient,
         test_client: TestClient):
     # Given
-    user_info_client_mock.get_books_read = MagicMock(side_effect=UserInfoServerException("Boom"))
+    user_info_client_mock.get_books_read = AsyncMock(side_effect=UserInfoServerException("Boom"))
 
     # When
     response = test_client.get("/predict/1?")
@@ -97,7 +115,7 @@ def test_user_info_service_throwing_client_exception_doesnt_block_prediction(
         user_info_client_mock: UserInfoClient,
         test_client: TestClient):
     # Given
-    user_info_client_mock.get_books_read = MagicMock(side_effect=UserInfoClientException("Boom"))
+    user_info_client_mock.get_books_read = AsyncMock(side_effect=UserInfoClientException("Boom"))
 
     # When
     response = test_client.get("/predict/1?")
@@ -106,6 +124,74 @@ def test_user_info_service_throwing_client_exception_doesnt_block_prediction(
     assert_that(response.json().get("items")).is_length(3)
 
 
+def test_batch_reports_unknown_users_inline(test_client: TestClient):
+    # When
+    response = test_client.post("/predict/batch", json={"requests": [{"user_id": 1},
+                                                                      {"user_id": 99999999},
+                                                                      {"user_id": 1, "count": 1}]})
+
+    # Then
+    assert_that(response.status_code).is_equal_to(200)
+    results = response.json().get("results")
+    assert_that([result["count"] for result in results]).is_equal_to([3, 0, 1])
+    assert_that(results[0].get("error")).is_none()
+    assert_that(results[1].get("error")).contains_entry({"status_code": 404})
+
+
+@pytest.mark.parametrize("genre_list, expected_count", [([], 3),
+                                                        (["young_adult"], 1),
+                                                        (["young_adult", "science"], 0)])
+def test_batch_applies_genres_per_user(genre_list, expected_count, test_client: TestClient):
+    # When
+    response = test_client.post("/predict/batch", json={"requests": [{"user_id": 1, "genres": genre_list}]})
+
+    # Then
+    assert_that(response.json().get("results")[0].get("items")).is_length(expected_count)
+
+
+@pytest.mark.parametrize("body", [{"requests": []},
+                                  {"requests": [{"user_id": 0}]},
+                                  {"requests": [{"user_id": 2 ** 63}]},
+                                  {"requests": [{"user_id": 1, "count": 101}]},
+                                  {"requests": [{"user_id": 1, "genres": ["not_a_genre"]}]}])
+def test_batch_request_validation(body, test_client: TestClient):
+    # When
+    response = test_client.post("/predict/batch", json=body)
+
+    # Then
+    assert_that(response.status_code).is_equal_to(422)
+
+
+def test_stream_returns_one_ndjson_result_per_line(test_client: TestClient):
+    # Given
+    body = '{"user_id": 1}\n{"user_id": 99999999}\n{"user_id": 1, "genres": ["young_adult"]}\n'
+
+    # When
+    response = test_client.post("/predict/stream", content=body, headers={"Content-Type": "application/x-ndjson"})
+
+    # Then
+    assert_that(response.status_code).is_equal_to(200)
+    assert_that(response.headers["content-type"]).starts_with("application/x-ndjson")
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert_that([result["count"] for result in results]).is_equal_to([3, 0, 1])
+    assert_that(results[1]["error"]).contains_entry({"status_code": 404})
+
+
+def test_full_inference_queue_sheds_load_with_503(test_client: TestClient):
+    # Given
+    inference_executor = MagicMock()
+    inference_executor.run = AsyncMock(side_effect=InferenceQueueFullException("Queue full"))
+    app.dependency_overrides[get_inference_executor] = lambda: inference_executor
+    batcher = InferenceBatcher(max_batch_size=4, max_wait_ms=1, inference_executor=inference_executor)
+    app.dependency_overrides[get_inference_batcher] = lambda: batcher
+
+    # When
+    response = test_client.get("/predict/1")
+
+    # Then
+    assert_that(response.status_code).is_equal_to(503)
+
+
 def _stub_dataframe_dependency():
     input_books = [[1, "The Proposal", 3.49, 103443, 325.0, 52240, 59474,
                     "https://www.goodreads.com/author/show/16287225.Jasmine_Guillory", 1,
@@ -146,11 +232,18 @@ def _stub_dataframe_dependency():
                                       "genre_christian", "genre_fiction", "genre_sports", "scaled_num_pages",
                                       "scaled_avg_rating", "scaled_promoters", "scaled_detractors"])
 
+    book_id_to_f_book_id = compact_id_map(_get_stub_book_id_to_f_book_id())
+    candidate_store = CandidateStore.from_dataframe(dataframe, book_id_to_f_book_id.get_many)
     app.dependency_overrides[get_books_df] = lambda: dataframe
+    app.dependency_overrides[get_candidate_store] = lambda: candidate_store
 
 
 def _stub_book_id_to_f_book_id():
-    app.dependency_overrides[get_book_id_to_f_book_id] = lambda: {1: 1, 2: 2, 3: 3}
+    app.dependency_overrides[get_book_id_to_f_book_id] = _get_stub_book_id_to_f_book_id
+
+
+def _get_stub_book_id_to_f_book_id():
+    return {1: 1, 2: 2, 3: 3}
 
 
 def _stub_user_id_to_f_user_id():
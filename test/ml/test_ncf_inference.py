@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+import torch
+from assertpy import assert_that
+
+from src.dependencies import get_artifacts
+from src.ml.ncf import NCF
+from src.ml.ncf_inference import NCFInference, export_inference_model
+from src.ml.quantization import quantize_model
+from test.conftest import cwd
+
+
+@pytest.fixture(scope="module")
+def trained_model():
+    state_dict = torch.load(cwd / "files" / "model_weights.pth")
+    model = NCF(pd.DataFrame, state_dict["user_id_embedding.weight"].shape[0],
+                state_dict["book_id_embedding.weight"].shape[0])
+    model.load_state_dict(state_dict)
+    yield model.eval()
+
+
+@pytest.fixture()
+def inputs():
+    generator = torch.Generator().manual_seed(42)
+    yield (torch.tensor([1, 2, 1, 2, 1]), torch.tensor([0, 1, 2, 3, 4]), torch.rand(5, 4, generator=generator),
+           torch.rand(5, 40, generator=generator) < 0.2)
+
+
+def _export_eager(model: NCFInference):
+    return model
+
+
+@pytest.mark.parametrize("export", [_export_eager, export_inference_model], ids=["eager", "torchscript"])
+def test_inference_model_matches_the_trained_model(trained_model: NCF, inputs, export):
+    # Given
+    inference_model = export(NCFInference.from_state_dict(trained_model.state_dict()))
+    user_input, item_input, item_details, item_meta = inputs
+
+    # When
+    with torch.inference_mode():
+        expected = trained_model(user_input, item_input, item_details, item_meta.float())
+        predictions = inference_model(user_input, item_input, item_details, item_meta)
+
+    # Then
+    torch.testing.assert_close(predictions, expected)
+
+
+@pytest.mark.parametrize("export", [_export_eager, export_inference_model], ids=["eager", "torchscript"])
+def test_inference_model_matches_the_trained_model_from_the_item_tower(trained_model: NCF, inputs, export):
+    # Given
+    model = NCFInference.from_state_dict(trained_model.state_dict())
+    _, item_input, item_details, item_meta = inputs
+    user_ids = torch.tensor([1, 2])
+    user_index = torch.tensor([0, 1, 0, 1, 1])
+
+    # When
+    with torch.inference_mode():
+        item_tower = model.item_tower(item_input, item_details, item_meta)
+        expected = trained_model(user_ids[user_index], item_input, item_details, item_meta.float())
+        predictions = export(model).forward_from_item_tower(user_ids, item_tower, user_index)
+
+    # Then
+    torch.testing.assert_close(predictions, expected)
+
+
+def test_quantized_models_can_be_exported(inputs):
+    # Given
+    model = get_artifacts().model
+    quantized = quantize_model(model, "int8", "int8")
+    _, item_input, item_details, item_meta = inputs
+    item_tower = model.item_tower(item_input, item_details, item_meta)
+
+    # When
+    with torch.inference_mode():
+        expected = quantized.forward_from_item_tower(torch.tensor([1]), item_tower)
+        predictions = export_inference_model(quantized).forward_from_item_tower(torch.tensor([1]), item_tower)
+
+    # Then
+    torch.testing.assert_close(predictions, expected)
+
+
+def test_served_model_is_compiled():
+    # When / Then
+    assert_that(get_artifacts().inference_model).is_instance_of(torch.jit.ScriptModule)
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+from assertpy import assert_that
+
+from src.dependencies import get_artifacts
+from src.ml.ncf import NCF
+from src.ml.quantization import quantize_model, LowPrecisionEmbedding
+from src.quantization_report import compare_top_k
+from src.service.candidate_store import CandidateStore
+from src.service.scoring import score_candidates
+
+
+@pytest.fixture()
+def model():
+    yield get_artifacts().model
+
+
+@pytest.fixture(params=[False, True], ids=["full_forward", "item_tower"])
+def candidate_store(request, model: NCF):
+    yield CandidateStore.from_dataframe(_get_books_dataframe(200), lambda book_ids: book_ids,
+                                        model if request.param else None)
+
+
+def test_full_precision_serves_the_model_itself(model: NCF):
+    # When / Then
+    assert_that(quantize_model(model, "fp32", "fp32")).is_same_as(model)
+
+
+def test_unknown_precisions_are_rejected(model: NCF):
+    # When / Then
+    with pytest.raises(ValueError):
+        quantize_model(model, "int4")
+    with pytest.raises(ValueError):
+        quantize_model(model, embedding_precision="bf8")
+
+
+@pytest.mark.parametrize("linear_precision, embedding_precision", [("int8", "fp32"), ("fp32", "fp16"),
+                                                                   ("int8", "int8")])
+def test_quantized_scores_stay_close(model: NCF, candidate_store: CandidateStore, linear_precision,
+                                     embedding_precision):
+    # Given
+    quantized = quantize_model(model, linear_precision, embedding_precision)
+    rows = np.arange(len(candidate_store))
+
+    # When
+    expected = score_candidates(model, candidate_store, [1], rows)
+    scores = score_candidates(quantized, candidate_store, [1], rows)
+
+    # Then
+    assert_that(quantized).is_not_same_as(model)
+    assert_that(model.fc2).is_instance_of(torch.nn.Linear)
+    np.testing.assert_allclose(scores, expected, atol=0.02)
+
+
+def test_int8_embedding_rows_round_trip_within_their_scale():
+    # Given
+    embedding = torch.nn.Embedding(10, 4)
+
+    # When
+    quantized = LowPrecisionEmbedding.from_embedding(embedding, "int8")
+
+    # Then
+    indexes = torch.tensor([0, 3, 9])
+    error = (quantized(indexes) - embedding(indexes)).abs().detach()
+    assert_that(quantized.weight.dtype).is_equal_to(torch.int8)
+    assert_that(bool((error <= quantized.scale[indexes] / 2 + 1e-6).all())).is_true()
+
+
+def test_top_k_overlap_of_a_model_with_itself_is_complete(model: NCF, candidate_store: CandidateStore):
+    # When
+    report = compare_top_k(model, model, candidate_store, [1, 2, 3], k=10)
+
+    # Then
+    assert_that(report).contains_entry({"users": 3}, {"k": 10}, {"mean_top_k_overlap": 1.0},
+                                       {"max_abs_score_diff": 0.0})
+
+
+def _get_books_dataframe(num_books):
+    # Same layout the model expects: 4 scaled features and 40 genre flags
+    dataframe = pd.DataFrame({"book_id": np.arange(1, num_books + 1),
+                              "book_title": [f"Book {idx}" for idx in range(1, num_books + 1)]})
+    random = np.random.default_rng(42)
+    for idx in range(4):
+        dataframe[f"scaled_{idx}"] = random.normal(size=num_books)
+    for idx in range(40):
+        dataframe[f"genre_{idx}"] = random.random(num_books) < 0.2
+    return dataframe
@@ -0,0 +1,125 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock
+
+import pandas as pd
+import pytest
+from assertpy import assert_that
+
+from src.dependencies import get_artifacts
+from src.service.bulk_prediction import stream_predictions, iter_lines, aiter_sync
+from src.service.candidate_store import CandidateStore
+from src.service.factorization_service import FactorizationService
+from src.service.inference_executor import InferenceQueueFullException
+from src.service.prediction_service import PredictionService
+from src.service.user_info_client import BooksReadResponse
+
+
+@pytest.fixture()
+def prediction_service():
+    books_df = pd.DataFrame({"book_id": [1, 2, 3], "book_title": ["Book 1", "Book 2", "Book 3"],
+                             **{f"scaled_{idx}": [0.1, 0.2, 0.3] for idx in range(4)},
+                             **{f"genre_{idx}": [True, False, True] for idx in range(40)}})
+    user_info_client = AsyncMock()
+    user_info_client.get_books_read.return_value = BooksReadResponse(book_ids=[])
+    factorization_service = FactorizationService({1: 1, 2: 2}, {1: 1, 2: 2, 3: 3})
+    candidate_store = CandidateStore.from_dataframe(books_df, factorization_service.factorize_book_ids)
+    yield PredictionService(get_artifacts().model, candidate_store, user_info_client, factorization_service)
+
+
+def test_results_are_streamed_in_input_order(prediction_service: PredictionService):
+    # Given
+    lines = ['{"user_id": 1, "count": 1}', '{"user_id": 2}', "", '{"user_id": 3}', '{"user_id": 1, "count": 2}']
+
+    # When
+    results = _collect(stream_predictions(prediction_service, aiter_sync(lines), batch_size=2))
+
+    # Then
+    assert_that([result["user_id"] for result in results]).is_equal_to([1, 2, 3, 1])
+    assert_that([result["count"] for result in results]).is_equal_to([1, 3, 0, 2])
+    assert_that(results[2]["error"]).contains_entry({"status_code": 404})
+
+
+def test_invalid_lines_are_reported_inline(prediction_service: PredictionService):
+    # Given
+    lines = ['{"user_id": 1}', 'not json', '{"user_id": 2, "count": 500}', '{"user_id": 2}']
+
+    # When
+    results = _collect(stream_predictions(prediction_service, aiter_sync(lines)))
+
+    # Then
+    assert_that(results).is_length(4)
+    assert_that(results[0]["user_id"]).is_equal_to(1)
+    assert_that(results[1]).contains_entry({"line": 2})
+    assert_that(results[2]).contains_entry({"line": 3})
+    assert_that(results[2]["error"]).contains_entry({"status_code": 422})
+    assert_that(results[3]["user_id"]).is_equal_to(2)
+
+
+def test_user_ids_too_big_to_serialize_are_reported_inline(prediction_service: PredictionService):
+    # Given
+    lines = ['{"user_id": 1}', '{"user_id": %d}' % 2 ** 64, '{"user_id": 2}']
+
+    # When
+    results = _collect(stream_predictions(prediction_service, aiter_sync(lines)))
+
+    # Then
+    assert_that(results).is_length(3)
+    assert_that(results[1]).contains_entry({"line": 2})
+    assert_that(results[1]["error"]).contains_entry({"status_code": 422})
+    assert_that([results[0]["user_id"], results[2]["user_id"]]).is_equal_to([1, 2])
+
+
+def test_failed_batches_are_reported_inline_and_the_stream_carries_on(prediction_service: PredictionService):
+    # Given
+    lines = ['{"user_id": 1}', '{"user_id": 2}', '{"user_id": 1}', '{"user_id": 2}', '{"user_id": 1}']
+    failures = [InferenceQueueFullException("Inference queue is full"), RuntimeError("Boom")]
+    predict_batch = prediction_service.predict_batch
+
+    async def failing_predict_batch(requests):
+        if failures:
+            raise failures.pop(0)
+        return await predict_batch(requests)
+
+    prediction_service.predict_batch = failing_predict_batch
+
+    # When
+    results = _collect(stream_predictions(prediction_service, aiter_sync(lines), batch_size=2))
+
+    # Then
+    assert_that([result.get("line") for result in results]).is_equal_to([1, 2, 3, 4, None])
+    assert_that([result["error"]["status_code"] for result in results[:4]]).is_equal_to([503, 503, 500, 500])
+    assert_that(results[4]["user_id"]).is_equal_to(1)
+
+
+def test_working_batches_are_bounded(prediction_service: PredictionService):
+    # Given
+    lines = ['{"user_id": 1}'] * 10
+    predict_batch = AsyncMock(wraps=prediction_service.predict_batch)
+    prediction_service.predict_batch = predict_batch
+
+    # When
+    results = _collect(stream_predictions(prediction_service, aiter_sync(lines), batch_size=4))
+
+    # Then
+    assert_that(results).is_length(10)
+    assert_that([len(call.args[0]) for call in predict_batch.call_args_list]).is_equal_to([4, 4, 2])
+
+
+def test_iter_lines_splits_chunks_on_newlines():
+    # Given
+    chunks = [b'{"user_id"', b': 1}\n{"user_id": 2}\n\n{"us', b'er_id": 3}']
+
+    # When
+    lines = asyncio.run(_to_list(iter_lines(aiter_sync(chunks))))
+
+    # Then
+    assert_that(lines).is_equal_to([b'{"user_id": 1}', b'{"user_id": 2}', b'', b'{"user_id": 3}'])
+
+
+def _collect(results):
+    return [json.loads(result) for result in asyncio.run(_to_list(results))]
+
+
+async def _to_list(async_iterator):
+    return [item async for item in async_iterator]
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+from assertpy import assert_that
+
+from src.models.genre_list import GenreList
+from src.service.candidate_store import CandidateStore
+from src.service.id_map import MISSING_ID
+
+
+def test_books_without_factorized_id_are_dropped():
+    # Given
+    dataframe = _get_books_dataframe()
+    factorize_book_ids = lambda book_ids: np.where(book_ids == 2, MISSING_ID, book_ids * 10)
+
+    # When
+    candidate_store = CandidateStore.from_dataframe(dataframe, factorize_book_ids)
+
+    # Then
+    assert_that(candidate_store.book_ids.tolist()).is_equal_to([1, 3])
+    assert_that(candidate_store.f_book_ids.tolist()).is_equal_to([10, 30])
+    assert_that(candidate_store.titles.take(range(2))).is_equal_to(["Book 1", "Book 3"])
+
+
+def test_model_inputs_keep_every_scaled_and_genre_column():
+    # When
+    candidate_store = CandidateStore.from_dataframe(_get_books_dataframe(), lambda book_ids: book_ids)
+
+    # Then
+    assert_that(candidate_store.features.shape).is_equal_to((3, 2))
+    assert_that(candidate_store.features.dtype).is_equal_to(np.float32)
+    # genre_suspense isn't a GenreList member, but the model still expects it
+    assert_that(candidate_store.genre_flags.shape).is_equal_to((3, 3))
+
+
+def test_store_arrays_are_read_only():
+    # Given
+    candidate_store = CandidateStore.from_dataframe(_get_books_dataframe(), lambda book_ids: book_ids)
+
+    # When / Then
+    assert_that(candidate_store.f_book_ids.flags.writeable).is_false()
+    assert_that(candidate_store.genre_index.bitsets.flags.writeable).is_false()
+
+
+def test_candidate_mask_requires_every_genre():
+    # Given
+    candidate_store = CandidateStore.from_dataframe(_get_books_dataframe(), lambda book_ids: book_ids)
+
+    # When
+    fantasy = candidate_store.candidate_mask([GenreList.genre_fantasy], [])
+    fantasy_and_horror = candidate_store.candidate_mask([GenreList.genre_fantasy, GenreList.genre_horror], [])
+
+    # Then
+    assert_that(fantasy.tolist()).is_equal_to([True, True, False])
+    assert_that(fantasy_and_horror.tolist()).is_equal_to([False, True, False])
+
+
+def test_candidate_mask_removes_books_read():
+    # Given
+    candidate_store = CandidateStore.from_dataframe(_get_books_dataframe(), lambda book_ids: book_ids)
+
+    # When
+    mask = candidate_store.candidate_mask([], [3, 99])
+
+    # Then
+    assert_that(mask.tolist()).is_equal_to([True, True, False])
+
+
+def test_rows_mask_matches_candidate_mask_on_the_given_rows():
+    # Given
+    candidate_store = CandidateStore.from_dataframe(_get_books_dataframe(), lambda book_ids: book_ids)
+    rows = np.array([2, 0, 1])
+
+    # When
+    mask = candidate_store.rows_mask(rows, [GenreList.genre_fantasy], [2])
+
+    # Then
+    assert_that(mask.tolist()).is_equal_to(
+        candidate_store.candidate_mask([GenreList.genre_fantasy], [2])[rows].tolist())
+
+
+def test_saved_store_is_memory_mapped_back(tmp_path):
+    # Given
+    dataframe = _get_books_dataframe()
+    dataframe.loc[1, "book_title"] = "Bøøk 2"
+    candidate_store = CandidateStore.from_dataframe(dataframe, lambda book_ids: book_ids)
+
+    # When
+    candidate_store.save(tmp_path)
+    loaded = CandidateStore.load(tmp_path)
+
+    # Then
+    assert_that(loaded.book_ids.tolist()).is_equal_to([1, 2, 3])
+    assert_that(loaded.titles.take([2, 1])).is_equal_to(["Book 3", "Bøøk 2"])
+    assert_that(loaded.features.tolist()).is_equal_to(candidate_store.features.tolist())
+    assert_that(loaded.candidate_mask([GenreList.genre_fantasy], []).tolist()).is_equal_to([True, True, False])
+    assert_that(loaded.item_tower).is_none()
+
+
+def _get_books_dataframe():
+    return pd.DataFrame({
+        "book_id": [1, 2, 3],
+        "book_title": ["Book 1", "Book 2", "Book 3"],
+        "genre_fantasy": [True, True, False],
+        "genre_horror": [False, True, False],
+        "genre_suspense": [False, False, True],
+        "scaled_num_pages": [0.1, 0.2, 0.3],
+        "scaled_avg_rating": [-0.1, -0.2, -0.3],
+    })
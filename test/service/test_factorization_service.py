@@ -1,6 +1,8 @@
+import numpy as np
 from assertpy import assert_that
 
 from src.service.factorization_service import FactorizationService
+from src.service.id_map import MISSING_ID
 
 
 def test_factorize_user_id_returns_when_exists():
@@ -53,3 +55,15 @@ def test_factorize_book_id_returns_none_when_not_exists():
 
     # Then
     assert_that(factorized_book_id).is_equal_to(expected_factorized_book_id)
+
+
+def test_factorize_book_ids_maps_whole_arrays():
+    # Given
+    factorization_service = FactorizationService(user_to_factorized={1: 2}, book_to_factorized={1: 2, 5: 6})
+    book_ids = np.array([5, 3, 1])
+
+    # When
+    factorized_book_ids = factorization_service.factorize_book_ids(book_ids)
+
+    # Then
+    assert_that(factorized_book_ids.tolist()).is_equal_to([6, MISSING_ID, 2])
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+from assertpy import assert_that
+
+from src.models.genre_list import GenreList
+from src.service.genre_index import GenreIndex
+
+
+@pytest.fixture()
+def genre_index():
+    # 10 rows so the bitsets spill over into a second byte
+    yield GenreIndex.from_dataframe(pd.DataFrame({
+        "genre_fantasy": [True, True, False, True, False, False, False, False, True, True],
+        "genre_horror": [False, True, False, True, False, False, False, False, False, True],
+        "genre_romance": [False, False, True, False, False, False, False, False, False, False],
+    }))
+
+
+@pytest.mark.parametrize("genres, expected_rows", [([], list(range(10))),
+                                                   ([GenreList.genre_fantasy], [0, 1, 3, 8, 9]),
+                                                   ([GenreList.genre_fantasy, GenreList.genre_horror], [1, 3, 9]),
+                                                   ([GenreList.genre_fantasy, GenreList.genre_romance], []),
+                                                   ([GenreList.genre_science], [])])
+def test_mask_and_count_intersect_every_genre(genres, expected_rows, genre_index: GenreIndex):
+    # When
+    mask = genre_index.mask(genres)
+    count = genre_index.count(genres)
+
+    # Then
+    assert_that(mask.nonzero()[0].tolist()).is_equal_to(expected_rows)
+    assert_that(count).is_equal_to(len(expected_rows))
+
+
+def test_duplicate_genres_are_ignored(genre_index: GenreIndex):
+    # When
+    count = genre_index.count([GenreList.genre_horror, GenreList.genre_horror])
+
+    # Then
+    assert_that(count).is_equal_to(3)
+
+
+@pytest.mark.parametrize("genres", [[], [GenreList.genre_fantasy], [GenreList.genre_fantasy, GenreList.genre_horror]])
+def test_contains_matches_mask_on_the_given_rows(genres, genre_index: GenreIndex):
+    # Given
+    rows = [9, 0, 3, 8, 2]
+
+    # When
+    contained = genre_index.contains(rows, genres)
+
+    # Then
+    assert_that(contained.tolist()).is_equal_to(genre_index.mask(genres)[rows].tolist())
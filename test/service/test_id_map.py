@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from assertpy import assert_that
+
+from src.service.id_map import IdMap, DenseIdMap, MISSING_ID, compact_id_map, load_id_map
+
+
+def test_contiguous_keys_get_a_dense_map():
+    # When
+    id_map = compact_id_map({10: 1, 11: 2, 13: 3})
+
+    # Then
+    assert_that(id_map).is_instance_of(DenseIdMap)
+    assert_that(id_map.values.dtype).is_equal_to(np.int32)
+    assert_that(len(id_map)).is_equal_to(3)
+
+
+def test_sparse_keys_get_a_sorted_map():
+    # When
+    id_map = compact_id_map({1_000_000: 1, 5: 2, 2 ** 40: 3})
+
+    # Then
+    assert_that(id_map).is_instance_of(IdMap)
+    assert_that(id_map.keys.tolist()).is_equal_to([5, 1_000_000, 2 ** 40])
+    assert_that(id_map.keys.dtype).is_equal_to(np.int64)
+
+
+@pytest.mark.parametrize("mapping", [{10: 1, 11: 2, 13: 3}, {10: 1, 11_000: 2, 13_000_000: 3}])
+def test_lookups_match_the_dict(mapping):
+    # Given
+    id_map = compact_id_map(mapping)
+    keys = [10, 11, 12, 13, 11_000, 13_000_000, 0, -5, 2 ** 40]
+
+    # When
+    values = [id_map.get(key) for key in keys]
+    many = id_map.get_many(np.array(keys))
+
+    # Then
+    assert_that(values).is_equal_to([mapping.get(key) for key in keys])
+    assert_that(many.tolist()).is_equal_to([mapping.get(key, MISSING_ID) for key in keys])
+
+
+@pytest.mark.parametrize("mapping", [{10: 1, 11: 2, 13: 3}, {10: 1, 11_000: 2, 13_000_000: 3}])
+def test_saved_map_is_memory_mapped_back(mapping, tmp_path):
+    # Given
+    compact_id_map(mapping).save(tmp_path, "ids")
+
+    # When
+    id_map = load_id_map(tmp_path, "ids")
+
+    # Then
+    assert_that(len(id_map)).is_equal_to(3)
+    assert_that(id_map.get_many(np.array(list(mapping))).tolist()).is_equal_to(list(mapping.values()))
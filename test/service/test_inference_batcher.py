@@ -0,0 +1,112 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+from assertpy import assert_that
+
+from src.dependencies import get_artifacts
+from src.ml.ncf import NCF
+from src.service.candidate_store import CandidateStore
+from src.service.inference_batcher import InferenceBatcher
+from src.service.scoring import score_candidates
+
+
+@pytest.fixture()
+def model():
+    yield get_artifacts().model
+
+
+@pytest.fixture(params=[False, True], ids=["full_forward", "item_tower"])
+def candidate_store(request, model: NCF):
+    yield CandidateStore.from_dataframe(_get_books_dataframe(30), lambda book_ids: book_ids,
+                                        model if request.param else None)
+
+
+def test_batched_scores_match_scoring_each_user_alone(model: NCF, candidate_store: CandidateStore):
+    # Given
+    batcher = InferenceBatcher(max_batch_size=8, max_wait_ms=5)
+    requests = [(1, np.arange(30)), (2, np.array([3, 7, 11])), (3, np.arange(0, 30, 2)), (1, np.array([], int))]
+
+    async def score_concurrently():
+        return await asyncio.gather(*[batcher.score(model, candidate_store, f_user_id, rows)
+                                      for f_user_id, rows in requests])
+
+    # When
+    results = asyncio.run(score_concurrently())
+
+    # Then
+    for (f_user_id, rows), scores in zip(requests, results):
+        expected = score_candidates(model, candidate_store, [f_user_id], rows)
+        np.testing.assert_allclose(scores, expected, rtol=1e-5)
+
+
+def test_full_batch_is_flushed_without_waiting(model: NCF, candidate_store: CandidateStore):
+    # Given
+    batcher = InferenceBatcher(max_batch_size=2, max_wait_ms=60_000)
+
+    async def score_two():
+        return await asyncio.wait_for(asyncio.gather(batcher.score(model, candidate_store, 1, np.arange(5)),
+                                                     batcher.score(model, candidate_store, 2, np.arange(5))), 5)
+
+    # When
+    results = asyncio.run(score_two())
+
+    # Then
+    assert_that(results).is_length(2)
+
+
+def test_scoring_errors_are_raised_to_every_request(candidate_store: CandidateStore):
+    # Given
+    batcher = InferenceBatcher(max_batch_size=8, max_wait_ms=1)
+
+    class BrokenModel:
+        def __call__(self, *args):
+            raise RuntimeError("Boom")
+
+        forward_from_item_tower = __call__
+
+    async def score_concurrently():
+        return await asyncio.gather(*[batcher.score(BrokenModel(), candidate_store, 1, np.arange(5))
+                                      for _ in range(3)], return_exceptions=True)
+
+    # When
+    results = asyncio.run(score_concurrently())
+
+    # Then
+    assert_that([type(result) for result in results]).is_equal_to([RuntimeError] * 3)
+
+
+def test_candidates_are_selected_and_ranked_in_the_batch_job(model: NCF, candidate_store: CandidateStore):
+    # Given
+    batcher = InferenceBatcher(max_batch_size=8, max_wait_ms=1)
+
+    def broken_selection():
+        raise RuntimeError("Boom")
+
+    async def rank_concurrently():
+        return await asyncio.gather(
+            batcher.rank(model, candidate_store, 1, lambda: np.arange(10),
+                         lambda rows, scores: rows[np.argmax(scores)]),
+            batcher.rank(model, candidate_store, 2, broken_selection, lambda rows, scores: rows),
+            return_exceptions=True)
+
+    # When
+    best_row, failure = asyncio.run(rank_concurrently())
+
+    # Then
+    expected = score_candidates(model, candidate_store, [1], np.arange(10))
+    assert_that(best_row).is_equal_to(np.argmax(expected))
+    assert_that(failure).is_instance_of(RuntimeError)
+
+
+def _get_books_dataframe(num_books):
+    # Same layout the model expects: 4 scaled features and 40 genre flags
+    dataframe = pd.DataFrame({"book_id": np.arange(1, num_books + 1),
+                              "book_title": [f"Book {idx}" for idx in range(1, num_books + 1)]})
+    random = np.random.default_rng(42)
+    for idx in range(4):
+        dataframe[f"scaled_{idx}"] = random.normal(size=num_books)
+    for idx in range(40):
+        dataframe[f"genre_{idx}"] = random.random(num_books) < 0.2
+    return dataframe
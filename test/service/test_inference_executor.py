@@ -0,0 +1,64 @@
+import asyncio
+import threading
+
+import pytest
+from assertpy import assert_that
+
+from src.service.inference_executor import InferenceExecutor, InferenceQueueFullException
+
+
+@pytest.fixture()
+def inference_executor():
+    executor = InferenceExecutor(max_workers=1, max_queue_size=1)
+    yield executor
+    executor.shutdown()
+
+
+def test_runs_function_on_executor_thread(inference_executor: InferenceExecutor):
+    # When
+    thread_name = asyncio.run(inference_executor.run(lambda: threading.current_thread().name))
+
+    # Then
+    assert_that(thread_name).starts_with("inference")
+
+
+def test_exceptions_are_raised_to_caller(inference_executor: InferenceExecutor):
+    # Given
+    def boom():
+        raise ValueError("Boom")
+
+    # When / Then
+    with pytest.raises(ValueError):
+        asyncio.run(inference_executor.run(boom))
+
+
+def test_requests_beyond_queue_size_are_rejected(inference_executor: InferenceExecutor):
+    # Given
+    release = threading.Event()
+
+    async def saturate_then_submit():
+        # One call running, one waiting in the queue
+        running = asyncio.ensure_future(inference_executor.run(release.wait))
+        queued = asyncio.ensure_future(inference_executor.run(release.wait))
+        await asyncio.sleep(0)
+        try:
+            with pytest.raises(InferenceQueueFullException):
+                await inference_executor.run(release.wait)
+        finally:
+            release.set()
+        return await asyncio.gather(running, queued)
+
+    # When
+    results = asyncio.run(saturate_then_submit())
+
+    # Then
+    assert_that(results).is_equal_to([True, True])
+
+
+def test_slots_are_released_once_calls_finish(inference_executor: InferenceExecutor):
+    # When
+    async def run_sequentially():
+        return [await inference_executor.run(lambda value=value: value) for value in range(5)]
+
+    # Then
+    assert_that(asyncio.run(run_sequentially())).is_equal_to([0, 1, 2, 3, 4])
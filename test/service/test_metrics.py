@@ -0,0 +1,47 @@
+from assertpy import assert_that
+
+from src.service.metrics import Histogram, StageTimings, render_cache_stats, PREDICTION_STAGE_SECONDS
+
+
+def test_histogram_buckets_are_cumulative_per_label():
+    # Given
+    histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0), label_names=("stage",))
+
+    # When
+    histogram.observe(0.05, "filter")
+    histogram.observe(0.5, "filter")
+    histogram.observe(5.0, "filter")
+    histogram.observe(0.5, "forward")
+
+    # Then
+    assert_that(histogram.render()).contains(
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{stage="filter",le="0.1"} 1',
+        'latency_seconds_bucket{stage="filter",le="1.0"} 2',
+        'latency_seconds_bucket{stage="filter",le="+Inf"} 3',
+        'latency_seconds_sum{stage="filter"} 5.55',
+        'latency_seconds_count{stage="filter"} 3',
+        'latency_seconds_count{stage="forward"} 1')
+
+
+def test_stage_timings_add_up_repeated_stages_and_record_them():
+    # Given
+    timings = StageTimings()
+
+    # When
+    timings.record("test_stage", 0.002)
+    with timings.stage("test_stage"):
+        pass
+
+    # Then
+    assert_that(timings.as_ms()["test_stage"]).is_greater_than_or_equal_to(2.0)
+    assert_that(PREDICTION_STAGE_SECONDS.render()).contains('prediction_stage_seconds_count{stage="test_stage"} 2')
+
+
+def test_cache_stats_are_rendered_as_counters_and_gauges():
+    # When
+    lines = render_cache_stats("result_cache", {"size": 3, "ttl_seconds": None, "hits": 4, "hit_ratio": 0.5})
+
+    # Then
+    assert_that(lines).contains("result_cache_size 3", "result_cache_hits_total 4", "result_cache_hit_ratio 0.5")
+    assert_that(lines).does_not_contain("result_cache_ttl_seconds None")
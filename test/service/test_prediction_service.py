@@ -1,20 +1,30 @@
-from unittest.mock import patch
+import asyncio
+from unittest.mock import patch, AsyncMock, MagicMock
 
+import numpy as np
 import pandas as pd
 import pytest
 from assertpy import assert_that
 
-from src.dependencies import get_model
+from src.dependencies import get_artifacts
 from src.ml.ncf import NCF
+from src.service.candidate_store import CandidateStore
 from src.service.factorization_service import FactorizationService
-from src.service.prediction_service import PredictionService, UserNotFoundException
-from src.service.user_info_client import UserInfoClient, BooksReadResponse
+from src.service.id_map import MISSING_ID
+from src.service.inference_batcher import InferenceBatcher
+from src.models.genre_list import GenreList
+from src.service.prediction_service import PredictionService, UserNotFoundException, BatchPredictionRequestItem
+from src.service.result_cache import ResultCache
+from src.service.retrieval_index import RetrievalIndex
+from src.service.score_store import ScoreStore
+from src.service.user_info_client import UserInfoClient, BooksReadResponse, UserInfoServerException, \
+    UserInfoClientException
 
 
 @pytest.fixture()
 def user_info_client():
     with patch('src.service.user_info_client.UserInfoClient') as mock_user_info_client:
-        mock_user_info_client.get_books_read.return_value = BooksReadResponse(book_ids=[])
+        mock_user_info_client.get_books_read = AsyncMock(return_value=BooksReadResponse(book_ids=[]))
         yield mock_user_info_client
 
 
@@ -24,13 +34,13 @@ def factorization_service():
         # Map user ID 1:1 to factorized ID
         mock_factorization_service.factorize_user_id = lambda user_id: user_id
         # Map book ID 1:1 to factorized ID
-        mock_factorization_service.factorize_book_id = lambda book_id: book_id
+        mock_factorization_service.factorize_book_ids = lambda book_ids: book_ids
         yield mock_factorization_service
 
 
 @pytest.fixture()
 def model():
-    yield get_model()
+    yield get_artifacts().model
 
 
 def test_result_set_truncated_to_100_regardless_of_count(model: NCF,
@@ -39,10 +49,11 @@ def test_result_set_truncated_to_100_regardless_of_count(model: NCF,
     # Given
     df_data = [_generate_dummy_book(idx) for idx in range(0, 200)]
     dataframe = pd.DataFrame(df_data, columns=_get_df_columns())
-    pred_service = PredictionService(model, dataframe, user_info_client, factorization_service)
+    candidate_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids)
+    pred_service = PredictionService(model, candidate_store, user_info_client, factorization_service)
 
     # When
-    result = pred_service.predict(1, [], count=200)
+    result = asyncio.run(pred_service.predict(1, [], count=200))
 
     # Then
     assert_that(result.items).is_length(100)
@@ -56,10 +67,36 @@ def test_missing_factorized_user_id_fails_with_exception(model: NCF,
     dataframe = pd.DataFrame([_generate_dummy_book(1)], columns=_get_df_columns())
     # Simulate user not found
     factorization_service.factorize_user_id = lambda user_id: None
-    pred_service = PredictionService(model, dataframe, user_info_client, factorization_service)
+    candidate_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids)
+    pred_service = PredictionService(model, candidate_store, user_info_client, factorization_service)
 
     # When / Then
-    assert_that(pred_service.predict).raises(UserNotFoundException).when_called_with(1)
+    assert_that(asyncio.run).raises(UserNotFoundException).when_called_with(pred_service.predict(1))
+
+
+def test_batched_scoring_takes_one_executor_slot_and_turns_unknown_users_away_first(
+        model: NCF, user_info_client: UserInfoClient, factorization_service: FactorizationService):
+    # Given
+    dataframe = pd.DataFrame([_generate_dummy_book(idx) for idx in range(1, 10)], columns=_get_df_columns())
+    candidate_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids)
+    inference_executor = MagicMock()
+    inference_executor.run = AsyncMock(side_effect=lambda fn, *args: fn(*args))
+    pred_service = PredictionService(model, candidate_store, user_info_client, factorization_service,
+                                     inference_executor=inference_executor,
+                                     inference_batcher=InferenceBatcher(max_batch_size=4, max_wait_ms=1,
+                                                                        inference_executor=inference_executor))
+
+    # When
+    result = asyncio.run(pred_service.predict(1, count=3))
+    ran_for_known_user = [call.args[0].__name__ for call in inference_executor.run.call_args_list]
+    inference_executor.run.reset_mock()
+    factorization_service.factorize_user_id = lambda user_id: None
+
+    # Then
+    assert_that(result.items).is_length(3)
+    assert_that(ran_for_known_user).is_equal_to(["_score_batch"])
+    assert_that(asyncio.run).raises(UserNotFoundException).when_called_with(pred_service.predict(2))
+    assert_that(inference_executor.run.call_args_list).is_empty()
 
 
 def test_missing_factorized_book_id_drops_it_from_recommendations(model: NCF,
@@ -68,16 +105,237 @@ def test_missing_factorized_book_id_drops_it_from_recommendations(model: NCF,
     # Given
     dataframe = pd.DataFrame([_generate_dummy_book(idx) for idx in range(1, 4)], columns=_get_df_columns())
     # Simulate book not found for second book
-    factorization_service.factorize_book_id = lambda book_id: None if book_id == 2 else int(book_id)
-    pred_service = PredictionService(model, dataframe, user_info_client, factorization_service)
+    factorization_service.factorize_book_ids = lambda book_ids: np.where(book_ids == 2, MISSING_ID, book_ids)
+    candidate_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids)
+    pred_service = PredictionService(model, candidate_store, user_info_client, factorization_service)
 
     # When
-    results = pred_service.predict(1)
+    results = asyncio.run(pred_service.predict(1))
 
     # Then
     assert_that(results.items).is_length(2)
 
 
+def test_cached_item_tower_scores_match_full_forward_pass(model: NCF,
+                                                          user_info_client: UserInfoClient,
+                                                          factorization_service: FactorizationService):
+    # Given
+    dataframe = pd.DataFrame([_generate_dummy_book(idx) for idx in range(1, 50)], columns=_get_df_columns())
+    full_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids)
+    cached_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids, model)
+    full_service = PredictionService(model, full_store, user_info_client, factorization_service)
+    cached_service = PredictionService(model, cached_store, user_info_client, factorization_service)
+
+    # When
+    full_results = asyncio.run(full_service.predict(1, count=50))
+    cached_results = asyncio.run(cached_service.predict(1, count=50))
+
+    # Then
+    assert_that(cached_store.item_tower.shape).is_equal_to((49, 140))
+    full_scores = {item.book_id: item.score for item in full_results.items}
+    assert_that(cached_results.items).is_length(len(full_scores))
+    for item in cached_results.items:
+        assert_that(item.score).is_close_to(full_scores[item.book_id], 1e-5)
+
+
+def test_repeat_requests_are_served_from_result_cache(model: NCF,
+                                                      user_info_client: UserInfoClient,
+                                                      factorization_service: FactorizationService):
+    # Given
+    dataframe = pd.DataFrame([_generate_dummy_book(idx) for idx in range(1, 30)], columns=_get_df_columns())
+    candidate_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids)
+    counting_model = MagicMock(wraps=model)
+    pred_service = PredictionService(counting_model, candidate_store, user_info_client, factorization_service,
+                                     result_cache=ResultCache(max_size=10, ttl_seconds=60))
+
+    # When
+    first_results = asyncio.run(pred_service.predict(1, count=20))
+    second_results = asyncio.run(pred_service.predict(1, count=5))
+
+    # Then
+    assert_that(counting_model.call_count).is_equal_to(1)
+    assert_that(second_results.items).is_equal_to(first_results.items[:5])
+
+
+def test_top_count_items_match_head_of_full_ranking(model: NCF,
+                                                    user_info_client: UserInfoClient,
+                                                    factorization_service: FactorizationService):
+    # Given
+    dataframe = pd.DataFrame([_generate_dummy_book(idx) for idx in range(1, 150)], columns=_get_df_columns())
+    candidate_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids)
+    pred_service = PredictionService(model, candidate_store, user_info_client, factorization_service)
+
+    # When
+    top_results = asyncio.run(pred_service.predict(1, count=7))
+    all_results = asyncio.run(pred_service.predict(1, count=100))
+
+    # Then
+    scores = [item.score for item in all_results.items]
+    assert_that(scores).is_equal_to(sorted(scores, reverse=True))
+    assert_that([item.book_id for item in top_results.items]).is_equal_to(
+        [item.book_id for item in all_results.items[:7]])
+
+
+def test_batch_predictions_match_individual_predictions(model: NCF,
+                                                        user_info_client: UserInfoClient,
+                                                        factorization_service: FactorizationService):
+    # Given
+    dataframe = pd.DataFrame([_generate_dummy_book(idx) for idx in range(1, 40)], columns=_get_df_columns())
+    candidate_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids, model)
+    pred_service = PredictionService(model, candidate_store, user_info_client, factorization_service)
+    requests = [BatchPredictionRequestItem(user_id=user_id, count=count)
+                for user_id, count in [(1, 5), (2, 20), (3, 1)]]
+
+    # When
+    batch_results = asyncio.run(pred_service.predict_batch(requests))
+    individual_results = [asyncio.run(pred_service.predict(request.user_id, count=request.count))
+                          for request in requests]
+
+    # Then
+    assert_that(batch_results.count).is_equal_to(3)
+    for batch_result, individual_result in zip(batch_results.results, individual_results):
+        assert_that(batch_result.count).is_equal_to(individual_result.count)
+        assert_that([item.book_id for item in batch_result.items]).is_equal_to(
+            [item.book_id for item in individual_result.items])
+
+
+def test_only_retrieved_candidates_are_ranked(model: NCF,
+                                              user_info_client: UserInfoClient,
+                                              factorization_service: FactorizationService):
+    # Given
+    dataframe = pd.DataFrame([_generate_dummy_book(idx) for idx in range(1, 200)], columns=_get_df_columns())
+    candidate_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids, model)
+    retrieval_index = RetrievalIndex.build(candidate_store, depth=30, num_clusters=10)
+    pred_service = PredictionService(model, candidate_store, user_info_client, factorization_service,
+                                     retrieval_index=retrieval_index)
+    retrieved_rows = retrieval_index.retrieve(model, 1, np.ones(len(candidate_store), dtype=bool))
+
+    # When
+    result = asyncio.run(pred_service.predict(1, [], count=100))
+    batch_result = asyncio.run(pred_service.predict_batch([BatchPredictionRequestItem(user_id=1, count=100)]))
+
+    # Then
+    assert_that(result.count).is_equal_to(len(retrieved_rows))
+    assert_that([item.book_id for item in result.items]).is_subset_of(
+        candidate_store.book_ids[retrieved_rows].tolist())
+    assert_that([item.book_id for item in batch_result.results[0].items]).is_equal_to(
+        [item.book_id for item in result.items])
+
+
+def test_retrieval_index_over_another_store_is_ignored(model: NCF,
+                                                       user_info_client: UserInfoClient,
+                                                       factorization_service: FactorizationService):
+    # Given
+    dataframe = pd.DataFrame([_generate_dummy_book(idx) for idx in range(1, 200)], columns=_get_df_columns())
+    candidate_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids, model)
+    other_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids, model)
+    retrieval_index = RetrievalIndex.build(other_store, depth=30, num_clusters=10)
+    pred_service = PredictionService(model, candidate_store, user_info_client, factorization_service,
+                                     retrieval_index=retrieval_index)
+
+    # When
+    result = asyncio.run(pred_service.predict(1, [], count=100))
+
+    # Then
+    assert_that(pred_service.retrieval_index).is_none()
+    assert_that(result.count).is_equal_to(100)
+
+
+def test_precomputed_ranking_is_served_after_filtering(model: NCF,
+                                                      user_info_client: UserInfoClient,
+                                                      factorization_service: FactorizationService):
+    # Given
+    dataframe = pd.DataFrame([_generate_dummy_book(idx) for idx in range(1, 200)], columns=_get_df_columns())
+    candidate_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids, model)
+    score_store = ScoreStore.build(model, candidate_store, [1], top_n=50,
+                                   num_users=model.user_id_embedding.num_embeddings, model_version="v1")
+    user_info_client.get_books_read = AsyncMock(return_value=BooksReadResponse(book_ids=[10, 20, 30]))
+    live_service = PredictionService(model, candidate_store, user_info_client, factorization_service)
+    pred_service = PredictionService(model, candidate_store, user_info_client, factorization_service,
+                                     score_store=score_store)
+    expected = asyncio.run(live_service.predict(1, [], count=20))
+
+    # When
+    with patch('src.service.prediction_service.score_candidates') as mock_score_candidates:
+        result = asyncio.run(pred_service.predict(1, [], count=20))
+        batch_results = asyncio.run(pred_service.predict_batch([BatchPredictionRequestItem(user_id=1, count=20)]))
+
+    # Then
+    mock_score_candidates.assert_not_called()
+    assert_that([item.book_id for item in result.items]).is_equal_to([item.book_id for item in expected.items])
+    assert_that([item.book_id for item in result.items]).does_not_contain(10, 20, 30)
+    assert_that(batch_results.results[0].items).is_equal_to(result.items)
+
+
+def test_precomputed_ranking_falls_back_to_live_scoring_when_it_runs_out(model: NCF,
+                                                                         user_info_client: UserInfoClient,
+                                                                         factorization_service: FactorizationService):
+    # Given
+    dataframe = pd.DataFrame([_generate_dummy_book(idx) for idx in range(1, 200)], columns=_get_df_columns())
+    candidate_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids, model)
+    score_store = ScoreStore.build(model, candidate_store, [1], top_n=10,
+                                   num_users=model.user_id_embedding.num_embeddings, model_version="v1")
+    live_service = PredictionService(model, candidate_store, user_info_client, factorization_service)
+    pred_service = PredictionService(model, candidate_store, user_info_client, factorization_service,
+                                     score_store=score_store)
+
+    # When
+    result = asyncio.run(pred_service.predict(1, [], count=20))
+    not_precomputed = asyncio.run(pred_service.predict(2, [], count=5))
+
+    # Then
+    expected = asyncio.run(live_service.predict(1, [], count=20))
+    assert_that([item.book_id for item in result.items]).is_equal_to([item.book_id for item in expected.items])
+    assert_that(not_precomputed.count).is_equal_to(5)
+
+
+def test_batch_skips_scoring_when_no_book_matches_genres(model: NCF,
+                                                         user_info_client: UserInfoClient,
+                                                         factorization_service: FactorizationService):
+    # Given
+    dataframe = pd.DataFrame([_generate_dummy_book(idx) for idx in range(1, 4)], columns=_get_df_columns())
+    candidate_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids)
+    pred_service = PredictionService(model, candidate_store, user_info_client, factorization_service)
+
+    # When
+    results = asyncio.run(pred_service.predict_batch([
+        BatchPredictionRequestItem(user_id=1, genres=[GenreList.genre_science])]))
+
+    # Then
+    assert_that(results.results[0].items).is_empty()
+    user_info_client.get_books_read.assert_not_called()
+
+
+def test_batch_reports_users_whose_books_read_could_not_be_fetched(model: NCF,
+                                                                   user_info_client: UserInfoClient,
+                                                                   factorization_service: FactorizationService):
+    # Given
+    dataframe = pd.DataFrame([_generate_dummy_book(idx) for idx in range(1, 10)], columns=_get_df_columns())
+    candidate_store = CandidateStore.from_dataframe(dataframe, factorization_service.factorize_book_ids)
+    pred_service = PredictionService(model, candidate_store, user_info_client, factorization_service)
+    failures = {2: UserInfoServerException("Boom"), 3: UserInfoClientException("Boom")}
+
+    async def get_books_read(user_id):
+        if user_id in failures:
+            raise failures[user_id]
+        return BooksReadResponse(book_ids=np.array([1, 2], dtype=np.int64))
+
+    user_info_client.get_books_read = get_books_read
+
+    # When
+    results = asyncio.run(pred_service.predict_batch([BatchPredictionRequestItem(user_id=user_id, count=20)
+                                                      for user_id in [1, 2, 3]])).results
+
+    # Then
+    assert_that(results[0].error).is_none()
+    assert_that([item.book_id for item in results[0].items]).does_not_contain(1, 2)
+    assert_that(results[1].error.status_code).is_equal_to(503)
+    assert_that(results[1].items).is_empty()
+    # The Book Recommender API not knowing the user just means they haven't read anything
+    assert_that(results[2].error).is_none()
+    assert_that(results[2].count).is_equal_to(9)
+
+
 def _get_df_columns():
     return ["0", "book_title", "avg_rating", "num_ratings", "num_pages", "promoters",
             "detractors", "author_url", "book_id", "book_url", "isbn", "isbn13", "asin",
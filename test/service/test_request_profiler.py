@@ -0,0 +1,72 @@
+import pstats
+
+import torch
+from assertpy import assert_that
+
+from src.service.request_profiler import RequestProfiler
+
+
+def test_nothing_is_sampled_until_profiling_starts():
+    # Given
+    profiler = RequestProfiler()
+
+    # Then
+    assert_that(profiler.sample()).is_false()
+
+
+def test_only_the_next_requests_are_sampled():
+    # Given
+    profiler = RequestProfiler()
+    profiler.start(requests=2)
+
+    # When
+    sampled = [profiler.sample() for _ in range(4)]
+
+    # Then
+    assert_that(sampled).is_equal_to([True, True, False, False])
+    assert_that(profiler.status()).contains_entry({"enabled": False}, {"profiled_requests": 2})
+
+
+def test_a_share_of_requests_is_sampled_until_stopped():
+    # Given
+    profiler = RequestProfiler(seed=0)
+    profiler.start(sample_rate=0.5)
+
+    # When
+    sampled = [profiler.sample() for _ in range(200)]
+    profiler.stop()
+
+    # Then
+    assert_that(sum(sampled)).is_between(60, 140)
+    assert_that(profiler.sample()).is_false()
+
+
+def test_profiled_calls_are_added_up_into_loadable_stats(tmp_path):
+    # Given
+    profiler = RequestProfiler()
+    profiler.start(requests=2)
+
+    # When
+    results = [profiler.run(sorted, [3, 1, 2]) for _ in range(2)]
+    (tmp_path / "predict.pstats").write_bytes(profiler.pstats_bytes())
+
+    # Then
+    assert_that(results).is_equal_to([[1, 2, 3], [1, 2, 3]])
+    stats = pstats.Stats(str(tmp_path / "predict.pstats"))
+    sorted_calls = [calls for (_, _, name), (calls, *_) in stats.stats.items() if "sorted" in name]
+    assert_that(sorted_calls).is_equal_to([2])
+
+
+def test_forward_passes_are_broken_down_by_torch_op():
+    # Given
+    profiler = RequestProfiler()
+    profiler.start(requests=1)
+
+    # When
+    with profiler.profile_forward():
+        torch.ones(4, 4) @ torch.ones(4, 4)
+
+    # Then
+    ops = {op["op"]: op for op in profiler.torch_ops()}
+    assert_that(ops).contains_key("aten::matmul")
+    assert_that(ops["aten::matmul"]["calls"]).is_equal_to(1)
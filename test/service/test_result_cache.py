@@ -0,0 +1,64 @@
+from assertpy import assert_that
+
+from src.models.genre_list import GenreList
+from src.service.result_cache import ResultCache
+
+
+def test_key_ignores_genre_and_books_read_order():
+    # When
+    key = ResultCache.key(1, [GenreList.genre_horror, GenreList.genre_fantasy], [3, 1, 2])
+    same_key = ResultCache.key(1, [GenreList.genre_fantasy, GenreList.genre_horror], [1, 2, 3, 3])
+
+    # Then
+    assert_that(key).is_equal_to(same_key)
+
+
+def test_key_changes_with_books_read():
+    # When
+    key = ResultCache.key(1, [], [1, 2, 3])
+    other_key = ResultCache.key(1, [], [1, 2])
+
+    # Then
+    assert_that(key).is_not_equal_to(other_key)
+
+
+def test_cached_result_is_returned_for_same_model_and_store():
+    # Given
+    model, candidate_store = object(), object()
+    result_cache = ResultCache(max_size=10, ttl_seconds=60)
+    result_cache.get(model, candidate_store, "key")
+    result_cache.put(model, candidate_store, "key", ["result"])
+
+    # When
+    result = result_cache.get(model, candidate_store, "key")
+
+    # Then
+    assert_that(result).is_equal_to(["result"])
+
+
+def test_new_model_or_store_invalidates_everything():
+    # Given
+    model, candidate_store = object(), object()
+    result_cache = ResultCache(max_size=10, ttl_seconds=60)
+    result_cache.get(model, candidate_store, "key")
+    result_cache.put(model, candidate_store, "key", ["result"])
+
+    # When
+    new_model_result = result_cache.get(object(), candidate_store, "key")
+
+    # Then
+    assert_that(new_model_result).is_none()
+    assert_that(result_cache.stats()).contains_entry({"invalidations": 1}, {"size": 0})
+
+
+def test_results_from_a_replaced_model_are_not_stored():
+    # Given
+    old_model, new_model, candidate_store = object(), object(), object()
+    result_cache = ResultCache(max_size=10, ttl_seconds=60)
+    result_cache.get(new_model, candidate_store, "key")
+
+    # When
+    result_cache.put(old_model, candidate_store, "key", ["stale"])
+
+    # Then
+    assert_that(result_cache.get(new_model, candidate_store, "key")).is_none()
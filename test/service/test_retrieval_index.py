@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import pytest
+from assertpy import assert_that
+
+from src.dependencies import get_artifacts
+from src.retrieval_report import retrieval_recall
+from src.service.candidate_store import CandidateStore
+from src.service.retrieval_index import RetrievalIndex
+
+
+class FirstColumnModel:
+    """
+    Scores each item tower row by its first column, whoever the user is
+    """
+
+    def forward_from_item_tower(self, user_input, item_tower, user_index=None):
+        return item_tower[:, :1]
+
+
+@pytest.fixture()
+def candidate_store():
+    yield CandidateStore.from_dataframe(_get_books_dataframe(300), lambda book_ids: book_ids, get_artifacts().model)
+
+
+@pytest.fixture()
+def clustered_store():
+    # Three well separated groups of 100 books, the last one scoring best under FirstColumnModel
+    candidate_store = CandidateStore.from_dataframe(_get_books_dataframe(300), lambda book_ids: book_ids)
+    random = np.random.default_rng(7)
+    item_tower = random.normal(scale=0.01, size=(300, 140)).astype(np.float32)
+    item_tower[:, 0] += np.repeat([0.0, 10.0, 20.0], 100)
+    candidate_store.item_tower = item_tower
+    yield candidate_store
+
+
+def test_every_row_belongs_to_exactly_one_cluster(candidate_store: CandidateStore):
+    # When
+    retrieval_index = RetrievalIndex.build(candidate_store, depth=50, num_clusters=12)
+
+    # Then
+    assert_that(len(retrieval_index)).is_equal_to(12)
+    assert_that(sorted(retrieval_index.order.tolist())).is_equal_to(list(range(300)))
+    assert_that(retrieval_index.offsets.tolist()[0]).is_equal_to(0)
+    assert_that(retrieval_index.offsets.tolist()[-1]).is_equal_to(300)
+    assert_that(bool(np.all(np.diff(retrieval_index.offsets) >= 0))).is_true()
+
+
+def test_best_scoring_clusters_are_retrieved_first(clustered_store: CandidateStore):
+    # Given
+    retrieval_index = RetrievalIndex.build(clustered_store, depth=80, num_clusters=3)
+
+    # When
+    rows = retrieval_index.retrieve(FirstColumnModel(), 1, np.ones(300, dtype=bool))
+
+    # Then
+    assert_that(rows.tolist()).is_equal_to(list(range(200, 300)))
+
+
+def test_clusters_are_probed_until_depth_filtered_candidates(clustered_store: CandidateStore):
+    # Given
+    retrieval_index = RetrievalIndex.build(clustered_store, depth=30, num_clusters=3)
+    candidate_mask = np.zeros(300, dtype=bool)
+    candidate_mask[::4] = True
+
+    # When
+    rows = retrieval_index.retrieve(FirstColumnModel(), 1, candidate_mask)
+
+    # Then
+    assert_that(rows.tolist()).is_equal_to(list(range(100, 300, 4)))
+
+
+def test_small_candidate_sets_skip_retrieval(candidate_store: CandidateStore):
+    # Given
+    retrieval_index = RetrievalIndex.build(candidate_store, depth=50, num_clusters=12)
+    candidate_mask = np.zeros(300, dtype=bool)
+    candidate_mask[:50] = True
+
+    # When
+    rows = retrieval_index.retrieve(get_artifacts().inference_model, 1, candidate_mask)
+
+    # Then
+    assert_that(rows.tolist()).is_equal_to(list(range(50)))
+
+
+def test_retrieval_returns_at_least_depth_candidates(candidate_store: CandidateStore):
+    # Given
+    retrieval_index = RetrievalIndex.build(candidate_store, depth=60, num_clusters=12)
+
+    # When
+    rows = retrieval_index.retrieve(get_artifacts().inference_model, 1, np.ones(300, dtype=bool))
+
+    # Then
+    assert_that(len(rows)).is_greater_than_or_equal_to(60)
+    assert_that(len(np.unique(rows))).is_equal_to(len(rows))
+
+
+def test_recall_is_complete_when_everything_is_retrieved(candidate_store: CandidateStore):
+    # Given
+    retrieval_index = RetrievalIndex.build(candidate_store, depth=300, num_clusters=12)
+
+    # When
+    report = retrieval_recall(get_artifacts().inference_model, retrieval_index, [1, 2, 3], k=10)
+
+    # Then
+    assert_that(report).contains_entry({"mean_recall": 1.0}, {"mean_retrieved": 300.0})
+
+
+def test_item_tower_is_required():
+    # Given
+    candidate_store = CandidateStore.from_dataframe(_get_books_dataframe(10), lambda book_ids: book_ids)
+
+    # When / Then
+    with pytest.raises(ValueError):
+        RetrievalIndex.build(candidate_store, depth=5)
+
+
+def _get_books_dataframe(num_books):
+    # Same layout the model expects: 4 scaled features and 40 genre flags
+    dataframe = pd.DataFrame({"book_id": np.arange(1, num_books + 1),
+                              "book_title": [f"Book {idx}" for idx in range(1, num_books + 1)]})
+    random = np.random.default_rng(42)
+    for idx in range(4):
+        dataframe[f"scaled_{idx}"] = random.normal(size=num_books)
+    for idx in range(40):
+        dataframe[f"genre_{idx}"] = random.random(num_books) < 0.2
+    return dataframe
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+from assertpy import assert_that
+
+from src.dependencies import get_artifacts
+from src.service.candidate_store import CandidateStore
+from src.service.score_store import ScoreStore, SCORE_STORE_MANIFEST_FILE
+from src.service.scoring import score_candidates
+
+
+@pytest.fixture()
+def candidate_store():
+    yield CandidateStore.from_dataframe(_get_books_dataframe(300), lambda book_ids: book_ids, get_artifacts().model)
+
+
+@pytest.fixture()
+def score_store(candidate_store: CandidateStore):
+    model = get_artifacts().model
+    yield ScoreStore.build(model, candidate_store, [3, 1], top_n=50,
+                           num_users=model.user_id_embedding.num_embeddings, model_version="v1")
+
+
+def test_top_n_matches_the_head_of_the_full_ranking(candidate_store: CandidateStore, score_store: ScoreStore):
+    # Given
+    scores = score_candidates(get_artifacts().model, candidate_store, [3], np.arange(len(candidate_store)))
+
+    # When
+    rows, top_scores = score_store.top(3)
+
+    # Then
+    assert_that(rows.tolist()).is_equal_to(np.argsort(-scores, kind="stable")[:50].tolist())
+    np.testing.assert_allclose(top_scores, scores[rows])
+
+
+def test_users_that_were_not_precomputed_have_no_ranking(score_store: ScoreStore):
+    # When
+    not_precomputed, _ = score_store.top(2)
+    unknown, _ = score_store.top(10 ** 9)
+
+    # Then
+    assert_that(len(score_store)).is_equal_to(2)
+    assert_that(not_precomputed.tolist()).is_empty()
+    assert_that(unknown.tolist()).is_empty()
+
+
+def test_saved_store_is_memory_mapped_back(score_store: ScoreStore, tmp_path):
+    # Given
+    score_store.save(tmp_path)
+
+    # When
+    loaded = ScoreStore.load(tmp_path)
+
+    # Then
+    assert_that(loaded.rows).is_instance_of(np.memmap)
+    assert_that(loaded.top(1)[0].tolist()).is_equal_to(score_store.top(1)[0].tolist())
+    assert_that(loaded.matches("v1", 300, "fp32", "fp32")).is_true()
+    assert_that(loaded.matches("v2", 300, "fp32", "fp32")).is_false()
+    assert_that(loaded.matches("v1", 300, "int8", "fp32")).is_false()
+
+
+def test_unknown_store_format_is_rejected(tmp_path):
+    # Given
+    (tmp_path / SCORE_STORE_MANIFEST_FILE).write_text('{"format_version": 0}')
+
+    # When / Then
+    with pytest.raises(ValueError):
+        ScoreStore.load(tmp_path)
+
+
+def _get_books_dataframe(num_books):
+    # Same layout the model expects: 4 scaled features and 40 genre flags
+    dataframe = pd.DataFrame({"book_id": np.arange(1, num_books + 1),
+                              "book_title": [f"Book {idx}" for idx in range(1, num_books + 1)]})
+    random = np.random.default_rng(42)
+    for idx in range(4):
+        dataframe[f"scaled_{idx}"] = random.normal(size=num_books)
+    for idx in range(40):
+        dataframe[f"genre_{idx}"] = random.random(num_books) < 0.2
+    return dataframe
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+from assertpy import assert_that
+
+from src.service.ttl_lru_cache import TtlLruCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingLoader:
+    def __init__(self, value="value", delay=0.0, exception=None):
+        self.calls = 0
+        self.value = value
+        self.delay = delay
+        self.exception = exception
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+
+def test_second_lookup_is_a_hit():
+    # Given
+    cache = TtlLruCache(max_size=10, ttl_seconds=60)
+    loader = CountingLoader()
+
+    async def lookup_twice():
+        return [await cache.get_or_load(1, loader), await cache.get_or_load(1, loader)]
+
+    # When
+    results = asyncio.run(lookup_twice())
+
+    # Then
+    assert_that(results).is_equal_to(["value", "value"])
+    assert_that(loader.calls).is_equal_to(1)
+    assert_that(cache.stats()).contains_entry({"hits": 1}, {"misses": 1})
+
+
+def test_entries_expire_after_ttl():
+    # Given
+    clock = FakeClock()
+    cache = TtlLruCache(max_size=10, ttl_seconds=60, clock=clock)
+    loader = CountingLoader()
+
+    # When
+    asyncio.run(cache.get_or_load(1, loader))
+    clock.now = 61
+    asyncio.run(cache.get_or_load(1, loader))
+
+    # Then
+    assert_that(loader.calls).is_equal_to(2)
+    assert_that(cache.stats()).contains_entry({"expirations": 1})
+
+
+def test_least_recently_used_entry_is_evicted():
+    # Given
+    cache = TtlLruCache(max_size=2, ttl_seconds=60)
+    cache.put(1, "one")
+    cache.put(2, "two")
+    loader = CountingLoader()
+
+    async def touch_then_insert():
+        # Touching 1 makes 2 the least recently used entry
+        await cache.get_or_load(1, loader)
+        cache.put(3, "three")
+        await cache.get_or_load(2, loader)
+
+    # When
+    asyncio.run(touch_then_insert())
+
+    # Then
+    assert_that(loader.calls).is_equal_to(1)
+    assert_that(len(cache)).is_equal_to(2)
+    assert_that(cache.stats()).contains_entry({"evictions": 2})
+
+
+def test_concurrent_misses_are_coalesced():
+    # Given
+    cache = TtlLruCache(max_size=10, ttl_seconds=60)
+    loader = CountingLoader(delay=0.01)
+
+    async def lookup_concurrently():
+        return await asyncio.gather(*[cache.get_or_load(1, loader) for _ in range(5)])
+
+    # When
+    results = asyncio.run(lookup_concurrently())
+
+    # Then
+    assert_that(results).is_equal_to(["value"] * 5)
+    assert_that(loader.calls).is_equal_to(1)
+    assert_that(cache.stats()).contains_entry({"misses": 1}, {"coalesced": 4})
+
+
+def test_failed_loads_are_not_cached():
+    # Given
+    cache = TtlLruCache(max_size=10, ttl_seconds=60)
+    loader = CountingLoader(exception=ValueError("Boom"))
+
+    # When
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            asyncio.run(cache.get_or_load(1, loader))
+
+    # Then
+    assert_that(loader.calls).is_equal_to(2)
+    assert_that(len(cache)).is_equal_to(0)
+
+
+def test_load_is_cached_even_if_the_caller_that_started_it_is_cancelled():
+    # Given
+    cache = TtlLruCache(max_size=10, ttl_seconds=60)
+    loader = CountingLoader(delay=0.01)
+
+    async def cancel_first_caller():
+        first = asyncio.ensure_future(cache.get_or_load(1, loader))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_load(1, loader))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second, await cache.get_or_load(1, loader)
+
+    # When
+    results = asyncio.run(cancel_first_caller())
+
+    # Then
+    assert_that(results).is_equal_to(("value", "value"))
+    assert_that(loader.calls).is_equal_to(1)
+    assert_that(cache.stats()).contains_entry({"hits": 1}, {"coalesced": 1})
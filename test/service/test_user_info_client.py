@@ -1,10 +1,13 @@
+import asyncio
+
 import httpx
+import numpy as np
 import pytest
 from assertpy import assert_that
 
 from src.dependencies import Properties
 from src.service.user_info_client import BooksReadResponse, UserInfoClient, UserInfoClientException, \
-    UserInfoServerException
+    UserInfoServerException, get_user_info_client
 
 TEST_PROPERTIES = Properties(book_recommender_api_base_url="https://testurl", env_name="test")
 
@@ -14,8 +17,10 @@ def test_successful_response_from_user_info_client(httpx_mock):
 
     user_id = 1
     client = UserInfoClient(properties=TEST_PROPERTIES)
-    response = client.get_books_read(user_id)
-    assert response == BooksReadResponse(book_ids=[1, 2, 3])
+    response = asyncio.run(client.get_books_read(user_id))
+    assert_that(response).is_instance_of(BooksReadResponse)
+    assert_that(response.book_ids.dtype).is_equal_to(np.int64)
+    assert_that(response.book_ids.tolist()).is_equal_to([1, 2, 3])
 
 
 @pytest.mark.parametrize("response_code", [500, 501, 502, 503, 504])
@@ -24,7 +29,7 @@ def test_5xx_custom_exception_from_user_info_client(response_code, httpx_mock):
 
     user_id = 1
     client = UserInfoClient(properties=TEST_PROPERTIES)
-    assert_that(client.get_books_read).raises(UserInfoServerException).when_called_with(user_id)
+    assert_that(asyncio.run).raises(UserInfoServerException).when_called_with(client.get_books_read(user_id))
 
 
 @pytest.mark.parametrize("response_code", [400, 401, 402, 403, 404])
@@ -33,7 +38,15 @@ def test_4xx_custom_exception_from_user_info_client(response_code, httpx_mock):
 
     user_id = 1
     client = UserInfoClient(properties=TEST_PROPERTIES)
-    assert_that(client.get_books_read).raises(UserInfoClientException).when_called_with(user_id)
+    assert_that(asyncio.run).raises(UserInfoClientException).when_called_with(client.get_books_read(user_id))
+
+
+@pytest.mark.parametrize("body", [{"books": [1]}, {"book_ids": None}, {"book_ids": ["one"]}])
+def test_invalid_response_from_user_info_client(body, httpx_mock):
+    httpx_mock.add_response(json=body, url="https://testurl/users/1/book-ids")
+
+    client = UserInfoClient(properties=TEST_PROPERTIES)
+    assert_that(asyncio.run).raises(UserInfoServerException).when_called_with(client.get_books_read(1))
 
 
 def test_uncaught_exception_from_user_info_client(httpx_mock):
@@ -41,4 +54,69 @@ def test_uncaught_exception_from_user_info_client(httpx_mock):
 
     user_id = 1
     client = UserInfoClient(properties=TEST_PROPERTIES)
-    assert_that(client.get_books_read).raises(UserInfoServerException).when_called_with(user_id)
+    assert_that(asyncio.run).raises(UserInfoServerException).when_called_with(client.get_books_read(user_id))
+
+
+def test_books_read_are_cached_per_user(httpx_mock):
+    httpx_mock.add_response(json={'book_ids': [1, 2, 3]}, url="https://testurl/users/1/book-ids")
+
+    client = UserInfoClient(properties=TEST_PROPERTIES)
+
+    async def get_books_read_twice():
+        return [await client.get_books_read(1), await client.get_books_read(1)]
+
+    responses = asyncio.run(get_books_read_twice())
+    assert_that([response.book_ids.tolist() for response in responses]).is_equal_to([[1, 2, 3]] * 2)
+    assert_that(httpx_mock.get_requests()).is_length(1)
+
+
+def test_books_read_cache_can_be_disabled(httpx_mock):
+    httpx_mock.add_response(json={'book_ids': [1, 2, 3]}, url="https://testurl/users/1/book-ids")
+
+    client = UserInfoClient(properties=Properties(book_recommender_api_base_url="https://testurl",
+                                                  books_read_cache_max_size=0))
+
+    async def get_books_read_twice():
+        return [await client.get_books_read(1), await client.get_books_read(1)]
+
+    asyncio.run(get_books_read_twice())
+    assert_that(client.cache).is_none()
+    assert_that(httpx_mock.get_requests()).is_length(2)
+
+
+def test_timeouts_come_from_properties():
+    properties = Properties(book_recommender_api_base_url="https://testurl", user_info_connect_timeout=0.1,
+                            user_info_read_timeout=0.3)
+
+    client = UserInfoClient(properties=properties)
+    assert_that(client.http_client.timeout.connect).is_equal_to(0.1)
+    assert_that(client.http_client.timeout.read).is_equal_to(0.3)
+
+
+def test_concurrent_requests_are_bounded_by_the_connection_pool():
+    properties = Properties(book_recommender_api_base_url="https://testurl", user_info_max_connections=2,
+                            books_read_cache_max_size=0)
+    client = UserInfoClient(properties=properties)
+    in_flight = []
+    most_in_flight = []
+
+    async def get(url):
+        in_flight.append(url)
+        most_in_flight.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(url)
+        return httpx.Response(200, json={"book_ids": [1]})
+
+    client.http_client.get = get
+
+    async def get_books_read_at_once():
+        return await asyncio.gather(*[client.get_books_read(user_id) for user_id in range(10)])
+
+    responses = asyncio.run(get_books_read_at_once())
+    assert_that(responses).is_length(10)
+    assert_that(max(most_in_flight)).is_equal_to(2)
+
+
+def test_requests_share_one_client(test_client):
+    assert_that(get_user_info_client()).is_not_none()
+    assert_that(get_user_info_client()).is_same_as(get_user_info_client())
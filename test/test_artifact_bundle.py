@@ -0,0 +1,78 @@
+import pickle
+import shutil
+
+import numpy as np
+import pytest
+import torch
+from assertpy import assert_that
+
+from src.artifact_bundle import build_bundle, load_bundle, load_source_folder, load_artifacts, MANIFEST_FILE
+from src.dependencies import Properties, _load_score_store
+from src.service.score_store import ScoreStore
+from test.conftest import cwd
+
+SOURCE_FOLDER = cwd / "files"
+
+
+@pytest.fixture(scope="module")
+def bundle_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp("bundle")
+    build_bundle(SOURCE_FOLDER, path)
+    yield path
+
+
+def test_bundle_matches_source_folder(bundle_path):
+    # Given
+    source = load_source_folder(SOURCE_FOLDER)
+
+    # When
+    bundle = load_bundle(bundle_path)
+
+    # Then
+    assert_that(bundle.model_properties).is_equal_to(source.model_properties)
+    assert_that(bundle.candidate_store.book_ids.tolist()).is_equal_to(source.candidate_store.book_ids.tolist())
+    rows = np.arange(len(source.candidate_store))
+    assert_that(bundle.candidate_store.titles.take(rows)).is_equal_to(source.candidate_store.titles.take(rows))
+    book_id_to_f_book_id = pickle.load(open(SOURCE_FOLDER / "book_id_to_f_book_id.p", "rb"))
+    for book_id, f_book_id in book_id_to_f_book_id.items():
+        assert_that(bundle.book_id_to_f_book_id.get(book_id)).is_equal_to(f_book_id)
+    assert_that(bundle.user_id_to_f_user_id.get(-1)).is_none()
+    np.testing.assert_allclose(bundle.candidate_store.item_tower, source.candidate_store.item_tower)
+    for name, tensor in source.model.state_dict().items():
+        assert_that(torch.equal(bundle.model.state_dict()[name], tensor)).is_true()
+
+
+def test_bundle_is_preferred_when_present(bundle_path):
+    # When
+    artifacts = load_artifacts(bundle_path)
+
+    # Then
+    assert_that(artifacts.books_df).is_none()
+    assert_that(artifacts.candidate_store.book_ids.flags.writeable).is_false()
+    assert_that([parameter.requires_grad for parameter in artifacts.model.parameters()]).does_not_contain(True)
+
+
+def test_unknown_bundle_format_is_rejected(bundle_path, tmp_path):
+    # Given
+    (tmp_path / MANIFEST_FILE).write_text('{"format_version": 0}')
+
+    # When / Then
+    with pytest.raises(ValueError):
+        load_bundle(tmp_path)
+
+
+def test_scores_precomputed_against_a_copy_of_the_source_folder_are_served_from_its_bundle(bundle_path, tmp_path):
+    # Given
+    source_copy = tmp_path / "source"
+    shutil.copytree(SOURCE_FOLDER, source_copy)
+    source = load_source_folder(source_copy)
+    ScoreStore.build(source.model, source.candidate_store, [0, 1], top_n=5, num_users=2,
+                     model_version=source.version).save(tmp_path / "scores")
+
+    # When
+    bundle = load_bundle(bundle_path)
+    score_store = _load_score_store(tmp_path / "scores", bundle, Properties())
+
+    # Then
+    assert_that(bundle.version).is_equal_to(source.version)
+    assert_that(score_store).is_not_none()
@@ -0,0 +1,62 @@
+import pickle
+
+import pandas as pd
+import pytest
+import torch
+from assertpy import assert_that
+
+from benchmark.fixtures import generate_model_folder, parse_scale
+from benchmark.run import benchmark_model_folder, compare
+from test.conftest import cwd
+
+
+@pytest.fixture(scope="module")
+def model_folder(tmp_path_factory):
+    yield generate_model_folder(tmp_path_factory.mktemp("synthetic"), num_books=300, num_users=500)
+
+
+def test_synthetic_model_folder_has_the_same_layout_as_the_test_files(model_folder):
+    # Given
+    books_df = pd.read_csv(model_folder / "books.csv")
+    expected_books_df = pd.read_csv(cwd / "files" / "books.csv")
+    state_dict = torch.load(model_folder / "model_weights.pth")
+    expected_state_dict = torch.load(cwd / "files" / "model_weights.pth")
+
+    # Then
+    assert_that(books_df.columns.tolist()).is_equal_to(expected_books_df.columns.tolist())
+    assert_that(books_df).is_length(300)
+    assert_that(sorted(state_dict)).is_equal_to(sorted(expected_state_dict))
+    assert_that(state_dict["user_id_embedding.weight"].shape[0]).is_equal_to(500)
+    user_id_to_f_user_id = pickle.load(open(model_folder / "user_id_to_f_user_id.p", "rb"))
+    assert_that(sorted(user_id_to_f_user_id.values())).is_equal_to(list(range(500)))
+
+
+def test_every_stage_is_timed(model_folder):
+    # When
+    report = benchmark_model_folder(model_folder, requests=3)
+
+    # Then
+    assert_that(report["startup_ms"]).contains_key("load_source_folder", "build_bundle", "load_bundle")
+    assert_that(report["stages"]).contains_key("factorize", "filter", "forward", "top_k", "serialize", "predict")
+    assert_that(report["stages"]["forward"]).contains_key("p50_ms", "p95_ms", "mean_ms")
+
+
+def test_only_stages_slower_than_the_tolerance_regress():
+    # Given
+    baseline = {"scales": {"10k": {"startup_ms": {"load_bundle": 10.0},
+                                   "stages": {"forward": {"p50_ms": 2.0}, "top_k": {"p50_ms": 0.01}}}}}
+    report = {"scales": {"10k": {"startup_ms": {"load_bundle": 11.0},
+                                 "stages": {"forward": {"p50_ms": 3.0}, "top_k": {"p50_ms": 0.05}}},
+                         "100k": {"startup_ms": {}, "stages": {"forward": {"p50_ms": 30.0}}}}}
+
+    # When
+    comparisons = compare(report, baseline, tolerance=0.25)
+
+    # Then
+    regressed = {comparison["stage"]: comparison["regressed"] for comparison in comparisons}
+    assert_that(regressed).is_equal_to({"startup.load_bundle": False, "forward": True, "top_k": False})
+
+
+@pytest.mark.parametrize("scale, expected", [("10k", (10_000, 100_000)), ("50x70", (50, 70))])
+def test_scales_are_named_or_given_as_books_by_users(scale, expected):
+    assert_that(parse_scale(scale)).is_equal_to(expected)
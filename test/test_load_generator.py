@@ -0,0 +1,91 @@
+import asyncio
+import itertools
+import time
+
+import httpx
+import numpy as np
+import pytest
+from assertpy import assert_that
+
+from benchmark.load import FakeUpstream, ServiceProcess, generate_load, read_requests, summarize, \
+    synthesize_requests, HISTOGRAM_BUCKETS_MS
+from test.conftest import cwd
+
+
+@pytest.fixture()
+def upstream():
+    upstream = FakeUpstream(np.arange(1, 101), books_read_per_user=5)
+    upstream.url = upstream.start()
+    yield upstream
+    upstream.stop()
+
+
+def test_fake_upstream_always_returns_the_same_books_read_for_a_user(upstream: FakeUpstream):
+    # When
+    first = httpx.get(f"{upstream.url}/users/7/book-ids").json()
+    second = httpx.get(f"{upstream.url}/users/7/book-ids").json()
+    other_user = httpx.get(f"{upstream.url}/users/8/book-ids").json()
+
+    # Then
+    assert_that(first["book_ids"]).is_length(5).is_equal_to(second["book_ids"])
+    assert_that(other_user["book_ids"]).is_not_equal_to(first["book_ids"])
+
+
+def test_fake_upstream_injects_latency_and_errors(upstream: FakeUpstream):
+    # Given
+    upstream.latency_ms = 50
+    upstream.error_rate = 1.0
+
+    # When
+    start_time = time.perf_counter()
+    response = httpx.get(f"{upstream.url}/users/7/book-ids")
+
+    # Then
+    assert_that(time.perf_counter() - start_time).is_greater_than_or_equal_to(0.05)
+    assert_that(response.status_code).is_equal_to(500)
+    assert_that(upstream.errors).is_equal_to(1)
+
+
+def test_requests_are_read_with_default_genres_and_count():
+    # When
+    requests = read_requests(['{"user_id": 1, "genres": ["fantasy"], "count": 5}\n', '\n', '{"user_id": 2}\n'])
+
+    # Then
+    assert_that(requests).is_equal_to([{"user_id": 1, "genres": ["fantasy"], "count": 5},
+                                       {"user_id": 2, "genres": [], "count": 20}])
+
+
+def test_synthesized_requests_only_ask_for_known_users():
+    # When
+    requests = synthesize_requests(np.array([3, 5, 8]), 50)
+
+    # Then
+    assert_that(requests).is_length(50)
+    assert_that({request["user_id"] for request in requests}).is_subset_of({3, 5, 8})
+
+
+def test_summary_counts_every_latency_in_one_bucket():
+    # When
+    summary = summarize([0.5, 3.0, 3.5, 7000.0], {"200": 3, "503": 1}, duration=2.0)
+
+    # Then
+    counts = {bucket["le_ms"]: bucket["count"] for bucket in summary["histogram"]}
+    assert_that(counts).contains_entry({1: 1}, {5: 2}, {None: 1})
+    assert_that(summary["histogram"]).is_length(len(HISTOGRAM_BUCKETS_MS) + 1)
+    assert_that(summary).contains_entry({"requests": 4}, {"errors": 1}, {"throughput_rps": 2.0})
+    assert_that(summary["latency_ms"]["max"]).is_equal_to(7000.0)
+
+
+def test_load_is_generated_against_the_service(upstream: FakeUpstream):
+    # Given
+    requests = read_requests(['{"user_id": 100, "count": 5}', '{"user_id": 200, "genres": ["fiction"]}'])
+
+    # When
+    with ServiceProcess(cwd / "files", upstream.url) as service:
+        result = asyncio.run(generate_load(service.url, itertools.cycle(requests), concurrency=2, num_requests=10,
+                                           warm_up=2))
+
+    # Then
+    assert_that(result["requests"]).is_equal_to(10)
+    assert_that(result["statuses"]).is_equal_to({"200": 10})
+    assert_that(result["throughput_rps"]).is_positive()
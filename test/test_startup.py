@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from assertpy import assert_that
+
+from test.conftest import cwd
+
+# Serving only ever runs a forward pass, and these add seconds to the start of every worker
+TRAINING_ONLY_MODULES = ["pytorch_lightning", "torchmetrics", "src.ml.ncf"]
+
+# Generous enough for a slow CI machine, they're there to catch something heavy creeping back into the serving path.
+# Importing pytorch_lightning alone used to take over a second.
+IMPORT_TIME_BUDGET_SECONDS = float(os.getenv("STARTUP_IMPORT_TIME_BUDGET_SECONDS", "10"))
+BOOT_TIME_BUDGET_SECONDS = float(os.getenv("STARTUP_BOOT_TIME_BUDGET_SECONDS", "10"))
+
+_BOOT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import src.main, src.bulk_predict
+imported = time.perf_counter()
+from src.dependencies import initialize_dependencies, validate_dependencies, shutdown_dependencies
+initialize_dependencies()
+validate_dependencies()
+booted = time.perf_counter()
+shutdown_dependencies()
+print(json.dumps({"import_seconds": imported - start, "boot_seconds": booted - imported, "modules": list(sys.modules)}))
+"""
+
+
+@pytest.fixture(scope="module")
+def startup():
+    # A fresh interpreter, since everything is already imported into this one
+    result = subprocess.run([sys.executable, "-c", _BOOT_SCRIPT], cwd=cwd.parent, capture_output=True, text=True,
+                            env={**os.environ, "MODEL_FOLDER": (cwd / "files").as_posix()}, check=True)
+    yield json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_serving_doesnt_import_training_modules(startup):
+    # When / Then
+    assert_that(startup["modules"]).does_not_contain(*TRAINING_ONLY_MODULES)
+
+
+def test_import_and_boot_time_stay_within_budget(startup):
+    # When / Then
+    assert_that(startup["import_seconds"]).described_as("import seconds").is_less_than(IMPORT_TIME_BUDGET_SECONDS)
+    assert_that(startup["boot_seconds"]).described_as("boot seconds").is_less_than(BOOT_TIME_BUDGET_SECONDS)